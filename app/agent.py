@@ -0,0 +1,177 @@
+"""
+Tryb agenta M2Watcher
+Monitoruje lokalnych klientów bez bota Discord i dźwięku, a zmiany stanu
+oraz próbkowaną telemetrię wysyła do centralnego agregatora przez TCP
+"""
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+import protocol
+
+
+class Agent:
+    """Agent wysyłający stan lokalnych klientów do agregatora"""
+
+    # Maksymalna liczba ramek buforowanych gdy agregator jest niedostępny
+    MAX_PENDING_FRAMES = 1000
+    HEARTBEAT_INTERVAL = 15.0
+    RECONNECT_DELAY_MIN = 1.0
+    RECONNECT_DELAY_MAX = 30.0
+
+    def __init__(self, watcher, host_id: str, aggregator_host: str, aggregator_port: int,
+                 telemetry_interval: float = 10.0, token: str = ""):
+        """
+        Inicjalizuje agenta
+
+        Args:
+            watcher: Obiekt Metin2Watcher monitorujący lokalnych klientów
+            host_id: Identyfikator tego komputera widoczny w agregatorze
+            aggregator_host: Adres agregatora
+            aggregator_port: Port agregatora
+            telemetry_interval: Co ile sekund wysyłać telemetrię klientów
+            token: Wspólny sekret agregatora wysyłany w HELLO
+        """
+        self.watcher = watcher
+        self.host_id = host_id
+        self.aggregator_address = (aggregator_host, aggregator_port)
+        self.telemetry_interval = telemetry_interval
+        self.token = token
+        self.running = False
+
+        # Kolejka jest zapełniana przez wątek monitorowania i opróżniana przez wątek wysyłający
+        self._pending = deque(maxlen=self.MAX_PENDING_FRAMES)
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._need_resync = threading.Event()
+        self._last_telemetry = 0.0
+        self._telemetry_bytes: Dict[int, int] = {}
+
+        # Agent działa bez interakcji - bez dźwięku i powiadomień lokalnych
+        self.watcher.sound_enabled = False
+        self.watcher.notification_manager = None
+        self.watcher.listeners.append(self._on_client_event)
+
+    def _format_time(self) -> str:
+        return datetime.now().strftime('%H:%M:%S')
+
+    def _enqueue(self, frame: bytes) -> None:
+        # Przy pełnej kolejce deque usuwa najstarszą ramkę
+        with self._pending_lock:
+            self._pending.append(frame)
+        self._wakeup.set()
+
+    def _take_pending(self) -> list:
+        """Zabiera wszystkie oczekujące ramki"""
+        with self._pending_lock:
+            frames = list(self._pending)
+            self._pending.clear()
+        return frames
+
+    def _requeue(self, frames: list) -> None:
+        """Zwraca niewysłane ramki na początek kolejki; przy przepełnieniu giną najstarsze"""
+        with self._pending_lock:
+            frames.extend(self._pending)
+            self._pending = deque(frames[-self.MAX_PENDING_FRAMES:], maxlen=self.MAX_PENDING_FRAMES)
+
+    def _on_client_event(self, event: str, client) -> None:
+        """Obserwator zdarzeń watchera - kolejkuje zdarzenie do wysłania"""
+        self._enqueue(protocol.encode_event(
+            event, client.pid, client.create_time, time.time(),
+            client.is_logged_in, client.num_connections, client.window_title
+        ))
+
+    def _send_resync(self) -> None:
+        """Wysyła pełny stan klientów (po każdym połączeniu z agregatorem)"""
+        for client in list(self.watcher.clients.values()):
+            self._on_client_event("discovered", client)
+        self._send_telemetry()
+
+    def _send_telemetry(self) -> None:
+        """Wysyła próbkę telemetrii: przyrost bajtów, połączenia i status każdego klienta"""
+        records = []
+        current_bytes = {}
+        for client in list(self.watcher.clients.values()):
+            previous = self._telemetry_bytes.get(client.pid, client.last_network_bytes)
+            current_bytes[client.pid] = client.last_network_bytes
+            records.append((client.pid, client.last_network_bytes - previous,
+                            client.num_connections, client.is_logged_in))
+        self._telemetry_bytes = current_bytes
+        for frame in protocol.encode_telemetry(time.time(), records):
+            self._enqueue(frame)
+        self._last_telemetry = time.monotonic()
+
+    def _connect(self) -> Optional[socket.socket]:
+        try:
+            sock = socket.create_connection(self.aggregator_address, timeout=10.0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(protocol.encode_hello(self.host_id, self.token))
+            return sock
+        except OSError:
+            return None
+
+    def _sender_loop(self) -> None:
+        """Wątek wysyłający: utrzymuje połączenie i opróżnia kolejkę ramek"""
+        delay = self.RECONNECT_DELAY_MIN
+        while self.running:
+            sock = self._connect()
+            if sock is None:
+                time.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+                continue
+
+            delay = self.RECONNECT_DELAY_MIN
+            print(f"[{self._format_time()}] [AGENT] Połączono z agregatorem {self.aggregator_address[0]}:{self.aggregator_address[1]}")
+            self._need_resync.set()
+            try:
+                while self.running:
+                    self._wakeup.wait(self.HEARTBEAT_INTERVAL)
+                    self._wakeup.clear()
+                    # Wyślij wszystkie oczekujące ramki jednym wywołaniem
+                    frames = self._take_pending()
+                    if not frames:
+                        sock.sendall(protocol.encode_heartbeat())
+                        continue
+                    try:
+                        sock.sendall(b"".join(frames))
+                    except OSError:
+                        # Nie zgub ramek - wrócą do kolejki po ponownym połączeniu
+                        self._requeue(frames)
+                        raise
+            except OSError:
+                print(f"[{self._format_time()}] [AGENT] Utracono połączenie z agregatorem, ponawianie...")
+            finally:
+                sock.close()
+
+    def run(self) -> None:
+        """Uruchamia agenta w pętli (monitorowanie w wątku głównym, wysyłanie w tle)"""
+        self.running = True
+        print("=" * 60)
+        print(f"M2Watcher - tryb agenta (host: {self.host_id})")
+        print("=" * 60)
+        print(f"Agregator: {self.aggregator_address[0]}:{self.aggregator_address[1]}")
+        print("Naciśnij Ctrl+C aby zatrzymać\n")
+
+        sender = threading.Thread(target=self._sender_loop, daemon=True)
+        sender.start()
+        self.watcher.running = True
+        self.watcher.restore_state()
+
+        try:
+            while self.running:
+                self.watcher.tick(show_status=False)
+                if self._need_resync.is_set():
+                    self._need_resync.clear()
+                    self._send_resync()
+                elif time.monotonic() - self._last_telemetry >= self.telemetry_interval:
+                    self._send_telemetry()
+                self.watcher.wait_next()
+        except KeyboardInterrupt:
+            print("\n\nZatrzymywanie agenta...")
+        finally:
+            self.running = False
+            self._wakeup.set()
+            self.watcher.shutdown()
@@ -0,0 +1,257 @@
+"""
+Tryb agregatora M2Watcher
+Przyjmuje połączenia agentów z wielu komputerów, utrzymuje jeden widok całej
+floty klientów i jako jedyny wysyła powiadomienia (jedno połączenie Discord)
+"""
+import asyncio
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Dict
+
+import protocol
+
+
+@dataclass
+class FleetClient:
+    """Stan klienta na zdalnym hoście, widziany przez agregator"""
+    host: str
+    pid: int
+    create_time: float
+    window_title: str
+    is_logged_in: bool
+    num_connections: int
+    last_update: float
+    bytes_delta: int = 0  # Przyrost bajtów z ostatniej próbki telemetrii
+
+    def __str__(self):
+        status = "Zalogowany" if self.is_logged_in else "Wylogowany"
+        connections_info = f"({self.num_connections} połączeń)" if self.num_connections > 0 else "(brak połączeń)"
+        return f"[{self.host}] PID: {self.pid} | {self.window_title} | {status} {connections_info}"
+
+
+@dataclass
+class AgentInfo:
+    """Informacje o połączonym agencie"""
+    host: str
+    address: str
+    connected_since: float
+    last_seen: float
+    online: bool = True
+
+
+class Aggregator:
+    """Serwer agregatora - widok floty i powiadomienia"""
+
+    def __init__(self, listen_host: str = "127.0.0.1", listen_port: int = 7878,
+                 notification_manager=None, agent_timeout: float = 60.0,
+                 status_interval: float = 30.0, show_status: bool = True, event_store=None,
+                 token: str = ""):
+        """
+        Inicjalizuje agregator
+
+        Args:
+            listen_host: Adres nasłuchiwania
+            listen_port: Port nasłuchiwania
+            notification_manager: NotificationManager z jedynym botem Discord (opcjonalny)
+            agent_timeout: Po ilu sekundach bez wiadomości agent jest uznawany za offline
+            status_interval: Co ile sekund wyświetlać status floty
+            show_status: Czy wyświetlać status floty w konsoli
+            event_store: EventStore do zapisu zdarzeń (opcjonalny)
+            token: Wspólny sekret wymagany w HELLO od agentów (pusty = bez sprawdzania)
+        """
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.notification_manager = notification_manager
+        self.agent_timeout = agent_timeout
+        self.status_interval = status_interval
+        self.show_status = show_status
+        self.event_store = event_store
+        self.token = token
+
+        # Widok floty: host -> {pid -> klient}
+        self.fleet: Dict[str, Dict[int, FleetClient]] = {}
+        self.agents: Dict[str, AgentInfo] = {}
+        # Powiadomienia są blokujące (send_notification_sync) - jeden wątek
+        # zachowuje ich kolejność i nie blokuje pętli obsługującej agentów
+        self._notify_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _format_time(self) -> str:
+        return datetime.now().strftime('%H:%M:%S')
+
+    def _notify(self, method_name: str, client: FleetClient) -> None:
+        if not self.notification_manager:
+            return
+        method = getattr(self.notification_manager, method_name)
+        # Kopia - klient floty zmienia się, zanim wątek powiadomień wyśle wiadomość
+        self._notify_executor.submit(method, replace(client))
+
+    def handle_event(self, host: str, event: str, pid: int, create_time: float, timestamp: float,
+                     is_logged_in: bool, num_connections: int, window_title: str) -> None:
+        """Aktualizuje widok floty na podstawie zdarzenia agenta"""
+        clients = self.fleet.setdefault(host, {})
+        if self.event_store:
+            self.event_store.record_event(host, event, pid, create_time, timestamp,
+                                          is_logged_in, num_connections, window_title)
+
+        if event in ("closed", "crashed"):
+            client = clients.pop(pid, None)
+            if client is None:
+                client = FleetClient(host, pid, create_time, window_title, is_logged_in, num_connections, timestamp)
+            if event == "crashed":
+                print(f"[{self._format_time()}] [CRASH] Crash klienta: {client}")
+                self._notify("notify_client_crashed", client)
+            else:
+                print(f"[{self._format_time()}] [UWAGA] Klient zamknięty: {client}")
+                self._notify("notify_client_closed", client)
+            return
+
+        client = clients.get(pid)
+        is_new = client is None or client.create_time != create_time
+        if is_new:
+            client = FleetClient(host, pid, create_time, window_title, is_logged_in, num_connections, timestamp)
+            clients[pid] = client
+        else:
+            client.window_title = window_title
+            client.is_logged_in = is_logged_in
+            client.num_connections = num_connections
+            client.last_update = timestamp
+
+        if event == "discovered":
+            if is_new:
+                print(f"[{self._format_time()}] [OK] Klient: {client}")
+        elif event == "logout":
+            print(f"[{self._format_time()}] [WYLOGOWANY] Wylogowanie wykryte: {client}")
+            self._notify("notify_logout", client)
+        elif event == "reconnect":
+            print(f"[{self._format_time()}] [ZALOGOWANY] Ponowne zalogowanie: {client}")
+            self._notify("notify_reconnect", client)
+        elif event == "hung":
+            print(f"[{self._format_time()}] [ZAWIESZONY] Klient nie odpowiada: {client}")
+            self._notify("notify_client_hung", client)
+        elif event == "responsive":
+            print(f"[{self._format_time()}] [OK] Klient znowu odpowiada: {client}")
+        elif event == "unstable":
+            # Liczba zmian stanu nie jest przesyłana w zdarzeniu - tylko sam fakt
+            print(f"[{self._format_time()}] [NIESTABILNY] Niestabilne połączenie: {client}")
+            self._notify("notify_client_unstable", client)
+        elif event == "stable":
+            print(f"[{self._format_time()}] [STABILNY] Połączenie ustabilizowane: {client}")
+            self._notify("notify_client_stable", client)
+
+    def handle_telemetry(self, host: str, timestamp: float, records) -> None:
+        """Aktualizuje widok floty na podstawie próbki telemetrii"""
+        clients = self.fleet.get(host, {})
+        if self.event_store:
+            # Protokół nie przesyła create_time w telemetrii - zna go widok floty ze zdarzeń klientów
+            create_times = {pid: clients[pid].create_time for pid, *_ in records if pid in clients}
+            self.event_store.record_samples(host, timestamp, records, create_times)
+        for pid, bytes_delta, num_connections, is_logged_in in records:
+            client = clients.get(pid)
+            if client is None:
+                continue  # Zdarzenie "discovered" jeszcze nie dotarło
+            client.bytes_delta = bytes_delta
+            client.num_connections = num_connections
+            client.is_logged_in = is_logged_in
+            client.last_update = timestamp
+
+    async def _handle_agent(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Obsługuje połączenie jednego agenta"""
+        peer = writer.get_extra_info("peername")
+        address = f"{peer[0]}:{peer[1]}" if peer else "?"
+        host = None
+        try:
+            msg_type, body = await asyncio.wait_for(protocol.read_message(reader), self.agent_timeout)
+            if msg_type != protocol.MSG_HELLO:
+                raise protocol.ProtocolError("Pierwsza wiadomość musi być HELLO")
+            hello_host, token = body
+            if self.token and not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+                print(f"[{self._format_time()}] [AGREGATOR] Odrzucono agenta {hello_host} ({address}): "
+                      f"nieprawidłowy token")
+                return
+            host = hello_host
+
+            previous = self.agents.get(host)
+            if previous and previous.online:
+                print(f"[{self._format_time()}] [AGREGATOR] Host {host} połączył się ponownie z {address}")
+            now = time.time()
+            self.agents[host] = AgentInfo(host, address, now, now)
+            # Agent po połączeniu wysyła pełny stan, więc stary widok hosta jest nieaktualny
+            self.fleet[host] = {}
+            print(f"[{self._format_time()}] [AGREGATOR] Agent połączony: {host} ({address})")
+
+            while True:
+                msg_type, body = await asyncio.wait_for(protocol.read_message(reader), self.agent_timeout)
+                self.agents[host].last_seen = time.time()
+                if msg_type == protocol.MSG_EVENT:
+                    self.handle_event(host, *body)
+                elif msg_type == protocol.MSG_TELEMETRY:
+                    self.handle_telemetry(host, *body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.TimeoutError:
+            print(f"[{self._format_time()}] [AGREGATOR] Agent {host or address} nie odpowiada")
+        except protocol.ProtocolError as e:
+            print(f"[{self._format_time()}] [AGREGATOR] Błąd protokołu od {host or address}: {e}")
+        finally:
+            writer.close()
+            if host and self.agents.get(host) and self.agents[host].address == address:
+                self.agents[host].online = False
+                if self.event_store:
+                    # Stan klientów hosta jest nieznany do ponownego połączenia
+                    self.event_store.close_open_sessions(host)
+                print(f"[{self._format_time()}] [AGREGATOR] Agent rozłączony: {host}")
+                if self.notification_manager:
+                    self._notify_executor.submit(self.notification_manager.notify_host_offline, host)
+
+    def print_status(self) -> None:
+        """Wyświetla status całej floty"""
+        total = sum(len(clients) for clients in self.fleet.values())
+        online = sum(1 for agent in self.agents.values() if agent.online)
+        print(f"\n[{self._format_time()}] Status floty: {online}/{len(self.agents)} hostów online, {total} klientów")
+        for host in sorted(self.agents):
+            agent = self.agents[host]
+            state = "online" if agent.online else "OFFLINE"
+            clients = self.fleet.get(host, {})
+            logged_in = sum(1 for client in clients.values() if client.is_logged_in)
+            print(f"  {host} ({state}): {logged_in}/{len(clients)} zalogowanych")
+            for client in clients.values():
+                status_icon = "[ZALOGOWANY]" if client.is_logged_in else "[WYLOGOWANY]"
+                print(f"    {status_icon} {client}")
+        print()
+
+    async def _status_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.status_interval)
+            if self.agents:
+                self.print_status()
+
+    async def serve(self) -> None:
+        """Uruchamia serwer agregatora"""
+        server = await asyncio.start_server(self._handle_agent, self.listen_host, self.listen_port)
+        print(f"Agregator nasłuchuje na {self.listen_host}:{self.listen_port}")
+        status_task = asyncio.ensure_future(self._status_loop()) if self.show_status else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if status_task:
+                status_task.cancel()
+
+    def run(self) -> None:
+        """Uruchamia agregator (blokuje do Ctrl+C)"""
+        print("=" * 60)
+        print("M2Watcher - tryb agregatora")
+        print("=" * 60)
+        print("Naciśnij Ctrl+C aby zatrzymać\n")
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n\nZatrzymywanie agregatora...")
+        finally:
+            self._notify_executor.shutdown(wait=False)
+            if self.event_store:
+                # Zatwierdza zapisy oczekujące w wątku zapisującym i otwarte kubełki telemetrii
+                self.event_store.close()
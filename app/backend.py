@@ -0,0 +1,735 @@
+"""
+Warstwa zależna od systemu operacyjnego dla M2Watcher
+Wykrywanie zakończenia procesów przez uchwyty systemowe (pidfd na Linuksie/Wine,
+uchwyty procesów na Windows) z odpytywaniem jako rozwiązaniem awaryjnym
+oraz tanie wykrywanie uruchomienia nowych procesów w trybie bezczynności,
+sprawdzanie, czy okno klienta odpowiada, i lokalny kanał sterowania
+(gniazdo Unix lub nazwany potok Windows)
+"""
+import os
+import platform
+import select
+import signal
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+try:
+    import win32api
+    import win32event
+    import win32process
+    WIN32_WAIT_AVAILABLE = True
+except ImportError:
+    WIN32_WAIT_AVAILABLE = False
+
+try:
+    import ntsecuritycon
+    import pywintypes
+    import win32api as _win32api
+    import win32file
+    import win32pipe
+    import win32security
+    WIN32_PIPE_AVAILABLE = True
+except ImportError:
+    WIN32_PIPE_AVAILABLE = False
+
+try:
+    import ctypes
+    _user32 = ctypes.windll.user32
+except (ImportError, AttributeError):
+    _user32 = None
+
+# Zakończony proces: (pid, kod wyjścia lub None jeśli system go nie udostępnia)
+ProcessExit = Tuple[int, Optional[int]]
+
+# Sygnały oznaczające awarię procesu (kod wyjścia = -numer sygnału)
+CRASH_SIGNALS = {
+    getattr(signal, name) for name in ("SIGSEGV", "SIGABRT", "SIGBUS", "SIGFPE", "SIGILL")
+    if hasattr(signal, name)
+}
+
+
+def is_crash_exit_code(exit_code: Optional[int]) -> bool:
+    """
+    Sprawdza czy kod wyjścia oznacza crash, a nie normalne zamknięcie.
+    Windows: kody NTSTATUS błędów (0xC0000000 i wyżej, np. 0xC0000005 - naruszenie dostępu).
+    Linux: zakończenie sygnałem awarii (SIGSEGV, SIGABRT, ...).
+    """
+    if exit_code is None:
+        return False
+    if exit_code < 0:
+        return -exit_code in CRASH_SIGNALS
+    return exit_code >= 0xC0000000
+
+
+def format_exit_code(exit_code: Optional[int]) -> str:
+    """Zwraca czytelny opis kodu wyjścia"""
+    if exit_code is None:
+        return "kod wyjścia nieznany"
+    if exit_code < 0:
+        try:
+            return f"sygnał {signal.Signals(-exit_code).name}"
+        except ValueError:
+            return f"sygnał {-exit_code}"
+    if exit_code >= 0xC0000000:
+        return f"kod wyjścia 0x{exit_code:08X}"
+    return f"kod wyjścia {exit_code}"
+
+
+def is_window_responding(hwnd: Optional[int]) -> Optional[bool]:
+    """
+    Sprawdza, czy okno przetwarza komunikaty (IsHungAppWindow - bez wysyłania komunikatu,
+    system uznaje okno za zawieszone po 5 sekundach bez odbierania komunikatów).
+    Zwraca None, jeśli nie da się tego sprawdzić (brak okna lub system inny niż Windows).
+    """
+    if _user32 is None or not hwnd:
+        return None
+    try:
+        return not _user32.IsHungAppWindow(hwnd)
+    except OSError:
+        return None
+
+
+class ProcessExitMonitor:
+    """
+    Bazowy monitor zakończenia procesów.
+    Zakończenia są zbierane w tle; wakeup jest ustawiany przy każdym nowym zakończeniu,
+    więc pętla główna może na nim czekać zamiast spać przez cały interwał.
+    """
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._exits: List[ProcessExit] = []
+        self._running = True
+
+    def watch(self, pid: int) -> None:
+        """Zaczyna obserwować proces (wielokrotne wywołanie dla tego samego PID nic nie robi)"""
+        raise NotImplementedError
+
+    def poll_exits(self) -> List[ProcessExit]:
+        """Zwraca i czyści listę procesów zakończonych od ostatniego wywołania"""
+        self.wakeup.clear()
+        with self._lock:
+            exits, self._exits = self._exits, []
+        return exits
+
+    def close(self) -> None:
+        """Zatrzymuje monitor"""
+        self._running = False
+
+    def _report_exit(self, pid: int, exit_code: Optional[int]) -> None:
+        with self._lock:
+            self._exits.append((pid, exit_code))
+        self.wakeup.set()
+
+
+class PollingExitMonitor(ProcessExitMonitor):
+    """Monitor awaryjny - sprawdza istnienie obserwowanych procesów co poll_interval sekund"""
+
+    def __init__(self, poll_interval: float = 0.25):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self._processes: Dict[int, psutil.Process] = {}
+        self._thread = threading.Thread(target=self._loop, name="M2Watcher-exit-poll", daemon=True)
+        self._thread.start()
+
+    def watch(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._processes:
+                return
+        try:
+            proc = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            self._report_exit(pid, None)
+            return
+        with self._lock:
+            self._processes[pid] = proc
+
+    def _loop(self) -> None:
+        while self._running:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                processes = list(self._processes.items())
+            for pid, proc in processes:
+                # is_running porównuje też czas utworzenia - wykrywa ponowne użycie PID
+                if not proc.is_running():
+                    with self._lock:
+                        self._processes.pop(pid, None)
+                    self._report_exit(pid, None)
+
+    def close(self) -> None:
+        super().close()
+        self._thread.join(timeout=2.0)
+        with self._lock:
+            self._processes.clear()
+
+
+class PidfdExitMonitor(ProcessExitMonitor):
+    """
+    Monitor dla Linuksa (także klienci uruchomieni przez Wine) oparty o pidfd.
+    Deskryptor pidfd staje się gotowy do odczytu w chwili zakończenia procesu.
+    Kod wyjścia jest dostępny tylko dla procesów potomnych - dla pozostałych jest None.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._fds: Dict[int, int] = {}  # fd -> pid
+        self._pids: Dict[int, int] = {}  # pid -> fd
+        self._poller = select.poll()
+        # Potok budzący wątek po dodaniu nowego procesu
+        self._wake_read, self._wake_write = os.pipe()
+        self._poller.register(self._wake_read, select.POLLIN)
+        self._thread = threading.Thread(target=self._loop, name="M2Watcher-exit-pidfd", daemon=True)
+        self._thread.start()
+
+    def watch(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._pids or not self._running:
+                return
+        try:
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self._report_exit(pid, None)
+            return
+        except OSError:
+            return  # Brak uprawnień - proces wykryje zwykłe odpytywanie
+        with self._lock:
+            if not self._running:
+                os.close(fd)
+                return
+            self._fds[fd] = pid
+            self._pids[pid] = fd
+            self._poller.register(fd, select.POLLIN)
+            os.write(self._wake_write, b"\0")
+
+    def _exit_code(self, fd: int) -> Optional[int]:
+        try:
+            result = os.waitid(os.P_PIDFD, fd, os.WEXITED | os.WNOHANG)
+        except (AttributeError, ChildProcessError, OSError):
+            return None  # Nie jest procesem potomnym
+        if result is None:
+            return None
+        if result.si_code == os.CLD_EXITED:
+            return result.si_status
+        return -result.si_status
+
+    def _loop(self) -> None:
+        while self._running:
+            for fd, _ in self._poller.poll(1000):
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                    continue
+                with self._lock:
+                    pid = self._fds.pop(fd, None)
+                    if pid is None:
+                        continue
+                    self._pids.pop(pid, None)
+                    self._poller.unregister(fd)
+                exit_code = self._exit_code(fd)
+                os.close(fd)
+                self._report_exit(pid, exit_code)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            os.write(self._wake_write, b"\0")
+        self._thread.join(timeout=2.0)
+        # Wątek już nie korzysta z deskryptorów - można je zamknąć
+        with self._lock:
+            for fd in self._fds:
+                self._poller.unregister(fd)
+                os.close(fd)
+            self._fds.clear()
+            self._pids.clear()
+            self._poller.unregister(self._wake_read)
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+
+
+class WindowsExitMonitor(ProcessExitMonitor):
+    """
+    Monitor dla Windows oparty o uchwyty procesów.
+    WaitForMultipleObjects obsługuje maksymalnie 64 uchwyty, więc procesy są dzielone
+    na grupy po 63 (plus zdarzenie budzące), każda obsługiwana przez osobny wątek.
+    """
+
+    GROUP_SIZE = 63
+    SYNCHRONIZE = 0x00100000
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+    # Co ile sekund sprawdzać kody wyjścia grupy, której nie da się obsłużyć przez WaitForMultipleObjects
+    POLL_INTERVAL = 0.25
+
+    def __init__(self):
+        super().__init__()
+        self._pids = set()
+        self._groups: List[dict] = []
+
+    def watch(self, pid: int) -> None:
+        with self._lock:
+            if pid in self._pids or not self._running:
+                return
+        try:
+            handle = win32api.OpenProcess(
+                self.SYNCHRONIZE | self.PROCESS_QUERY_LIMITED_INFORMATION, False, pid
+            )
+        except win32api.error:
+            return  # Brak uprawnień lub proces już nie istnieje - wykryje go odpytywanie
+
+        with self._lock:
+            self._pids.add(pid)
+            group = next((g for g in self._groups if len(g["handles"]) < self.GROUP_SIZE), None)
+            if group is None:
+                group = {"handles": {}, "event": win32event.CreateEvent(None, False, False, None)}
+                group["thread"] = threading.Thread(target=self._group_loop, args=(group,),
+                                                   name="M2Watcher-exit-wait", daemon=True)
+                self._groups.append(group)
+                group["thread"].start()
+            group["handles"][pid] = handle
+        win32event.SetEvent(group["event"])
+
+    def _finish(self, group: dict, pid: int, handle, exit_code: Optional[int]) -> None:
+        with self._lock:
+            group["handles"].pop(pid, None)
+            self._pids.discard(pid)
+        win32api.CloseHandle(handle)
+        self._report_exit(pid, exit_code)
+
+    def _group_loop(self, group: dict) -> None:
+        while self._running:
+            with self._lock:
+                pids = list(group["handles"])
+                handles = [group["handles"][pid] for pid in pids]
+            try:
+                result = win32event.WaitForMultipleObjects(handles + [group["event"]], False, 1000)
+            except win32api.error as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] [MONITOR] Oczekiwanie na zakończenie procesów "
+                      f"nie powiodło się ({e.strerror}) - odpytywanie kodów wyjścia co {self.POLL_INTERVAL} s")
+                self._poll_group(group)
+                return
+            if result == win32event.WAIT_TIMEOUT:
+                continue
+            index = result - win32event.WAIT_OBJECT_0
+            if 0 <= index < len(pids):
+                pid, handle = pids[index], handles[index]
+                try:
+                    exit_code = win32process.GetExitCodeProcess(handle) & 0xFFFFFFFF
+                except win32api.error:
+                    exit_code = None
+                self._finish(group, pid, handle, exit_code)
+
+    def _poll_group(self, group: dict) -> None:
+        """Awaryjna obsługa grupy: okresowe sprawdzanie kodów wyjścia zamiast czekania na uchwytach"""
+        while self._running:
+            time.sleep(self.POLL_INTERVAL)
+            with self._lock:
+                watched = list(group["handles"].items())
+            for pid, handle in watched:
+                try:
+                    exit_code = win32process.GetExitCodeProcess(handle) & 0xFFFFFFFF
+                except win32api.error:
+                    # Uchwyt bezużyteczny - o zakończeniu rozstrzyga istnienie PID-u
+                    if psutil.pid_exists(pid):
+                        continue
+                    exit_code = None
+                if exit_code != self.STILL_ACTIVE:
+                    self._finish(group, pid, handle, exit_code)
+
+    def close(self) -> None:
+        super().close()
+        for group in self._groups:
+            win32event.SetEvent(group["event"])
+        for group in self._groups:
+            group["thread"].join(timeout=2.0)
+        # Uchwyty zamykamy tylko w grupach, których wątek się zakończył - zamknięcie uchwytu,
+        # na którym wątek nadal czeka, jest niebezpieczne (numer może zostać ponownie użyty)
+        with self._lock:
+            for group in self._groups:
+                if group["thread"].is_alive():
+                    continue
+                for handle in group["handles"].values():
+                    win32api.CloseHandle(handle)
+                win32api.CloseHandle(group["event"])
+            self._groups = []
+            self._pids.clear()
+
+
+def create_exit_monitor() -> ProcessExitMonitor:
+    """Tworzy najlepszy dostępny monitor zakończenia procesów dla bieżącego systemu"""
+    system = platform.system()
+    if system == 'Windows' and WIN32_WAIT_AVAILABLE:
+        return WindowsExitMonitor()
+    if system == 'Linux' and hasattr(os, "pidfd_open"):
+        return PidfdExitMonitor()
+    return PollingExitMonitor()
+
+
+class ProcessStartDetector:
+    """
+    Bazowy detektor uruchomienia nowych procesów, używany gdy nie ma żadnych klientów.
+    Zamiast pełnego skanowania wszystkich procesów zwraca tylko PID-y procesów nowych.
+    """
+
+    name = "brak"
+
+    def wait_for_new_pids(self, timeout: float) -> Optional[List[int]]:
+        """
+        Czeka maksymalnie timeout sekund i zwraca PID-y procesów uruchomionych w tym czasie.
+        Zwraca None, gdy detektor mógł zgubić zdarzenia i potrzebne jest pełne sprawdzenie.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Zwalnia zasoby detektora"""
+
+
+class PidWatermarkStartDetector(ProcessStartDetector):
+    """
+    Detektor oparty o porównywanie listy PID-ów co poll_interval sekund.
+    Na Linuksie czyta tylko katalog /proc, na pozostałych systemach psutil.pids()
+    (EnumProcesses) - bez otwierania procesów, w przeciwieństwie do process_iter.
+    """
+
+    name = "lista PID-ów"
+
+    def __init__(self, poll_interval: float = 5.0):
+        self.poll_interval = poll_interval
+        self._use_proc = os.path.isdir("/proc")
+        self._known = set(self._list_pids())
+
+    def _list_pids(self) -> List[int]:
+        if self._use_proc:
+            return [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+        return psutil.pids()
+
+    def wait_for_new_pids(self, timeout: float) -> Optional[List[int]]:
+        time.sleep(min(timeout, self.poll_interval))
+        current = set(self._list_pids())
+        new_pids = current - self._known
+        self._known = current
+        return sorted(new_pids)
+
+
+class NetlinkStartDetector(ProcessStartDetector):
+    """
+    Detektor dla Linuksa oparty o netlink process connector - jądro samo zgłasza
+    każde wywołanie exec, więc w trybie bezczynności nie ma żadnego odpytywania.
+    Wymaga uprawnień CAP_NET_ADMIN (zwykle root).
+    """
+
+    name = "netlink"
+
+    NETLINK_CONNECTOR = 11
+    CN_IDX_PROC = 1
+    CN_VAL_PROC = 1
+    PROC_CN_MCAST_LISTEN = 1
+    PROC_EVENT_EXEC = 0x00000002
+    NLMSG_DONE = 3
+    # nlmsghdr (16 bajtów) + cn_msg (20 bajtów)
+    NLMSG_HEADER = struct.Struct('=IHHII')
+    CN_MSG_HEADER = struct.Struct('=IIIIHH')
+    # proc_event: what, cpu, timestamp_ns, a dla exec: process_pid, process_tgid
+    PROC_EVENT = struct.Struct('=IIQII')
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_CONNECTOR)
+        try:
+            self._sock.bind((0, self.CN_IDX_PROC))
+            op = struct.pack('=I', self.PROC_CN_MCAST_LISTEN)
+            cn_msg = self.CN_MSG_HEADER.pack(self.CN_IDX_PROC, self.CN_VAL_PROC, 0, 0, len(op), 0) + op
+            header = self.NLMSG_HEADER.pack(self.NLMSG_HEADER.size + len(cn_msg), self.NLMSG_DONE, 0, 0, os.getpid())
+            self._sock.send(header + cn_msg)
+        except OSError:
+            self._sock.close()
+            raise
+
+    def wait_for_new_pids(self, timeout: float) -> Optional[List[int]]:
+        new_pids = []
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        while readable:
+            try:
+                data = self._sock.recv(4096)
+            except OSError:
+                # Przepełniony bufor gniazda (ENOBUFS) - część zdarzeń przepadła
+                return None
+            offset = self.NLMSG_HEADER.size + self.CN_MSG_HEADER.size
+            if len(data) >= offset + self.PROC_EVENT.size:
+                what, _, _, pid, tgid = self.PROC_EVENT.unpack_from(data, offset)
+                if what == self.PROC_EVENT_EXEC and pid == tgid:
+                    new_pids.append(pid)
+            # Odbierz wszystkie zdarzenia, które już czekają
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        return new_pids
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def create_start_detector(poll_interval: float = 5.0) -> ProcessStartDetector:
+    """
+    Tworzy najtańszy dostępny detektor uruchomienia procesów.
+    Na Linuksie próbuje netlink process connector, a bez uprawnień wraca do porównywania PID-ów.
+    """
+    if platform.system() == 'Linux':
+        try:
+            return NetlinkStartDetector()
+        except (OSError, AttributeError):
+            pass
+    return PidWatermarkStartDetector(poll_interval)
+
+
+# Kanał sterowania: każde żądanie i każda odpowiedź to jedna linia JSON zakończona \n
+CONTROL_MAX_LINE = 64 * 1024
+CONTROL_MAX_CONNECTIONS = 8
+CONTROL_TIMEOUT = 5.0
+
+# Obsługa żądania: linia żądania (bez \n) -> linia odpowiedzi (bez \n)
+ControlHandler = Callable[[bytes], bytes]
+
+
+class ControlServer:
+    """
+    Lokalny serwer kanału sterowania. Połączenia są obsługiwane w wątkach w tle,
+    a handler nie może blokować ani zmieniać stanu watchera bezpośrednio.
+    """
+
+    name = "brak"
+
+    def __init__(self, address: str, handler: ControlHandler):
+        self.address = address
+        self.handler = handler
+        self._closed = False
+        self._slots = threading.BoundedSemaphore(CONTROL_MAX_CONNECTIONS)
+        self._thread = threading.Thread(target=self._serve, daemon=True, name="M2Watcher-control")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._closed = True
+
+    def _serve(self) -> None:
+        raise NotImplementedError
+
+    def _respond(self, line: bytes) -> bytes:
+        try:
+            return self.handler(line.strip()) + b"\n"
+        except Exception as e:
+            return b'{"ok": false, "error": "' + type(e).__name__.encode() + b'"}\n'
+
+
+class UnixControlServer(ControlServer):
+    """Kanał sterowania przez gniazdo Unix dostępne tylko dla właściciela (0600)"""
+
+    name = "gniazdo Unix"
+
+    def __init__(self, address: str, handler: ControlHandler):
+        super().__init__(address, handler)
+        if os.path.exists(address):
+            # Gniazdo po poprzednim uruchomieniu - usuń je tylko, jeśli nikt już nie nasłuchuje
+            probe_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe_sock.connect(address)
+                raise OSError(f"Kanał sterowania {address} jest używany przez inny proces")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(address)
+            finally:
+                probe_sock.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self._sock.bind(address)
+        finally:
+            os.umask(old_umask)
+        self._sock.listen(CONTROL_MAX_CONNECTIONS)
+
+    def _serve(self) -> None:
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return  # Gniazdo zamknięte
+            if not self._slots.acquire(blocking=False):
+                conn.close()  # Za dużo jednoczesnych połączeń
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        try:
+            conn.settimeout(CONTROL_TIMEOUT)
+            with conn, conn.makefile('rb') as reader:
+                while True:
+                    line = reader.readline(CONTROL_MAX_LINE)
+                    if not line or not line.endswith(b"\n"):
+                        return  # Koniec połączenia lub za długie żądanie
+                    conn.sendall(self._respond(line))
+        except OSError:
+            pass
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        super().close()
+        try:
+            # Samo close() nie budzi wątku czekającego w accept()
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+
+
+class NamedPipeControlServer(ControlServer):
+    """Kanał sterowania przez nazwany potok Windows (tylko połączenia lokalne)"""
+
+    name = "nazwany potok"
+
+    PIPE_REJECT_REMOTE_CLIENTS = 0x00000008
+    FILE_FLAG_FIRST_PIPE_INSTANCE = 0x00080000
+    ERROR_ACCESS_DENIED = 5
+    ERROR_PIPE_BUSY = 231
+    ERROR_PIPE_CONNECTED = 535
+
+    @staticmethod
+    def _owner_only_security():
+        """Atrybuty bezpieczeństwa z DACL dającym dostęp tylko bieżącemu użytkownikowi"""
+        token = win32security.OpenProcessToken(_win32api.GetCurrentProcess(), win32security.TOKEN_QUERY)
+        user_sid = win32security.GetTokenInformation(token, win32security.TokenUser)[0]
+        dacl = win32security.ACL()
+        dacl.AddAccessAllowedAce(win32security.ACL_REVISION, ntsecuritycon.FILE_ALL_ACCESS, user_sid)
+        descriptor = win32security.SECURITY_DESCRIPTOR()
+        descriptor.SetSecurityDescriptorDacl(1, dacl, 0)
+        attributes = win32security.SECURITY_ATTRIBUTES()
+        attributes.SECURITY_DESCRIPTOR = descriptor
+        return attributes
+
+    def _create_pipe(self, first: bool = False):
+        open_mode = win32pipe.PIPE_ACCESS_DUPLEX
+        if first:
+            # Nazwa potoku zajęta przez inny proces (lub drugi watcher) = błąd, a nie wspólny potok
+            open_mode |= self.FILE_FLAG_FIRST_PIPE_INSTANCE
+        return win32pipe.CreateNamedPipe(
+            self.address,
+            open_mode,
+            win32pipe.PIPE_TYPE_BYTE | win32pipe.PIPE_READMODE_BYTE | win32pipe.PIPE_WAIT
+            | self.PIPE_REJECT_REMOTE_CLIENTS,
+            win32pipe.PIPE_UNLIMITED_INSTANCES, CONTROL_MAX_LINE, CONTROL_MAX_LINE, 0, self._security
+        )
+
+    def __init__(self, address: str, handler: ControlHandler):
+        super().__init__(address, handler)
+        self._security = self._owner_only_security()
+        # Pierwsza instancja potoku od razu - błąd nazwy lub uprawnień zgłaszamy przy starcie
+        try:
+            self._pipe = self._create_pipe(first=True)
+        except pywintypes.error as e:
+            if e.winerror in (self.ERROR_ACCESS_DENIED, self.ERROR_PIPE_BUSY):
+                raise OSError(f"Kanał sterowania {address} jest używany przez inny proces")
+            raise OSError(f"Nie można utworzyć potoku {address}: {e.strerror}")
+
+    def _serve(self) -> None:
+        while not self._closed:
+            pipe, self._pipe = self._pipe, None
+            if pipe is None:
+                try:
+                    pipe = self._create_pipe()
+                except pywintypes.error:
+                    time.sleep(1.0)
+                    continue
+            try:
+                win32pipe.ConnectNamedPipe(pipe, None)
+            except pywintypes.error as e:
+                if e.winerror != self.ERROR_PIPE_CONNECTED:
+                    win32file.CloseHandle(pipe)
+                    continue
+            if self._closed or not self._slots.acquire(blocking=False):
+                win32file.CloseHandle(pipe)
+                continue
+            threading.Thread(target=self._handle, args=(pipe,), daemon=True).start()
+
+    def _handle(self, pipe) -> None:
+        buffer = b""
+        try:
+            while len(buffer) <= CONTROL_MAX_LINE:
+                _, data = win32file.ReadFile(pipe, 4096)
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    win32file.WriteFile(pipe, self._respond(line))
+        except pywintypes.error:
+            pass  # Klient się rozłączył
+        finally:
+            try:
+                win32pipe.DisconnectNamedPipe(pipe)
+            except pywintypes.error:
+                pass
+            win32file.CloseHandle(pipe)
+            self._slots.release()
+
+    def close(self) -> None:
+        super().close()
+        try:
+            # Połączenie z własnym potokiem budzi wątek czekający w ConnectNamedPipe
+            handle = win32file.CreateFile(
+                self.address, win32file.GENERIC_READ | win32file.GENERIC_WRITE,
+                0, None, win32file.OPEN_EXISTING, 0, None
+            )
+            win32file.CloseHandle(handle)
+        except pywintypes.error:
+            pass
+
+
+def default_control_address(config_dir: str) -> str:
+    """Domyślny adres kanału sterowania: nazwany potok na Windows, gniazdo w katalogu konfiguracji gdzie indziej"""
+    if platform.system() == 'Windows':
+        return r'\\.\pipe\m2watcher'
+    return os.path.join(config_dir, "control.sock")
+
+
+def create_control_server(address: str, handler: ControlHandler) -> ControlServer:
+    """
+    Tworzy serwer kanału sterowania dla bieżącego systemu.
+
+    Raises:
+        OSError: adres jest zajęty lub system nie obsługuje kanału sterowania
+    """
+    if platform.system() == 'Windows':
+        if not WIN32_PIPE_AVAILABLE:
+            raise OSError("Nazwane potoki wymagają pywin32")
+        return NamedPipeControlServer(address, handler)
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError("System nie obsługuje gniazd Unix")
+    return UnixControlServer(address, handler)
+
+
+def send_control_request(address: str, request: bytes, timeout: float = CONTROL_TIMEOUT) -> bytes:
+    """Wysyła jedno żądanie do kanału sterowania działającego watchera i zwraca linię odpowiedzi"""
+    if platform.system() == 'Windows':
+        # Nazwany potok otwiera się jak zwykły plik
+        with open(address, 'r+b', buffering=0) as pipe:
+            pipe.write(request + b"\n")
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = pipe.read(4096)
+                if not chunk:
+                    break
+                response += chunk
+            return response.strip()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(request + b"\n")
+        with sock.makefile('rb') as reader:
+            return reader.readline().strip()
@@ -3,13 +3,278 @@ Skrypt do budowania exe
 Używa PyInstaller do kompilacji aplikacji
 """
 import os
+import statistics
 import sys
 import subprocess
 import shutil
+import time
 from pathlib import Path
+from typing import Optional
 
-def build_exe():
-    """Buduje exe używając PyInstaller"""
+# Moduły aplikacji - zawsze dołączane do exe
+APP_MODULES = [
+    "main",
+    "m2watcher",
+    "config",
+    "notifications",
+    "discord_bot",
+    "state_snapshot",
+    "protocol",
+    "agent",
+    "aggregator",
+    "event_store",
+    "query_api",
+    "sharding",
+    "backend",
+    "detectors",
+    "probe",
+    "matcher",
+    "control",
+    "events",
+    "routing",
+    "metrics",
+    "diagnostics",
+    "oneshot",
+    "stability",
+    "export",
+]
+
+# Moduły wykluczane w każdym profilu
+BASE_EXCLUDES = [
+    "matplotlib",
+    "numpy",
+    "pandas",
+    "PIL",
+    "tkinter",
+    # Eksport kolumnowy (export.py) importuje pyarrow dopiero przy --export - w exe niedostępny
+    "pyarrow",
+]
+
+# Profile budowania:
+# - slim: tylko to, czego aplikacja faktycznie używa (psutil tylko w wersji Windows,
+#   bez requests) - mniejszy exe, szybsze rozpakowanie przy każdym starcie.
+#   flask jest dołączany, bo query_api (API zapytań agregatora, domyślnie włączone) go wymaga
+# - full: poprzednie zachowanie - wszystkie warianty psutil, flask i requests
+BUILD_PROFILES = {
+    "slim": {
+        "description": "tylko używane moduły (domyślny)",
+        "hidden_imports": APP_MODULES + [
+            "psutil",
+            "psutil._pswindows",
+            "psutil._psutil_windows",
+            "win32gui",
+            "win32process",
+            "win32con",
+            "win32api",
+            "win32event",
+            "win32file",
+            "win32pipe",
+            "win32security",
+            "ntsecuritycon",
+            "winsound",
+            "pywintypes",
+            "discord",
+            "discord.ext.commands",
+            "flask",
+            "werkzeug.serving",
+        ],
+        "collect_all": [
+            "discord",
+        ],
+        "excludes": BASE_EXCLUDES + [
+            "requests",
+            "urllib3",
+            "psutil._pslinux",
+            "psutil._psosx",
+            "psutil._psbsd",
+            "psutil._pssunos",
+            "psutil._psaix",
+            "psutil._psutil_linux",
+            "psutil._psutil_osx",
+            "psutil._psutil_posix",
+            "psutil.tests",
+        ],
+    },
+    "full": {
+        "description": "wszystkie zależności z requirements.txt",
+        "hidden_imports": APP_MODULES + [
+            "psutil",
+            "psutil._pswindows",
+            "psutil._psutil_windows",
+            "psutil._psutil_linux",
+            "psutil._psutil_osx",
+            "win32gui",
+            "win32process",
+            "win32con",
+            "win32api",
+            "win32event",
+            "win32file",
+            "win32pipe",
+            "win32security",
+            "ntsecuritycon",
+            "winsound",
+            "requests",
+            "requests.packages.urllib3",
+            "flask",
+            "discord",
+            "discord.ext.commands",
+            "discord.ext.tasks",
+            "pywintypes",
+        ],
+        "collect_all": [
+            "psutil",
+            "requests",
+            "discord",
+        ],
+        "excludes": BASE_EXCLUDES,
+    },
+}
+
+DEFAULT_PROFILE = "slim"
+
+# Moduły, których czas importu jest mierzony przez --measure
+MEASURED_MODULES = [
+    "config",
+    "m2watcher",
+    "notifications",
+    "main",
+    "discord_bot",
+]
+
+
+def measure_import_time(module: str) -> tuple:
+    """
+    Mierzy czas zimnego importu modułu w osobnym procesie (python -X importtime).
+    
+    Args:
+        module: Nazwa modułu do zaimportowania
+        
+    Returns:
+        (łączny czas w ms, lista (czas ms, nazwa) najcięższych bezpośrednich importów)
+        lub (None, []) jeśli modułu nie da się zaimportować
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None, []
+    
+    # Linie mają format "import time: self | cumulative | nazwa", gdzie wcięcie
+    # nazwy oznacza głębokość. Import modułu jest wypisywany po swoich zależnościach.
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        try:
+            cumulative_ms = int(cumulative) / 1000
+        except ValueError:
+            continue  # Nagłówek tabeli
+        depth = len(name) - len(name.lstrip(" "))
+        if depth == 1:
+            if name.strip() == module:
+                children.sort(reverse=True)
+                return cumulative_ms, children[:5]
+            children = []
+        elif depth == 3:
+            children.append((cumulative_ms, name.strip()))
+    
+    return None, []
+
+
+def measure_startup() -> None:
+    """Wyświetla czasy zimnego importu modułów aplikacji"""
+    print("=" * 60)
+    print("Czas importu modułów (zimny start, python -X importtime)")
+    print("=" * 60)
+    
+    for module in MEASURED_MODULES:
+        total_ms, heaviest = measure_import_time(module)
+        if total_ms is None:
+            print(f"  {module:<15} niedostępny (brak zależności)")
+            continue
+        print(f"  {module:<15} {total_ms:8.1f} ms")
+        for cumulative_ms, name in heaviest:
+            print(f"      {cumulative_ms:8.1f} ms  {name}")
+    
+    print()
+    print("main nie importuje discord_bot - discord.py i aiohttp są ładowane")
+    print("dopiero gdy discord.enabled = true (różnica = czas importu discord_bot)")
+
+
+# Argumenty, z którymi exe jest uruchamiane przy pomiarze czasu startu: pełny import
+# main (rozpakowanie exe, interpreter, config) bez dostępu do procesów i sieci
+LAUNCH_ARGS = ["--help"]
+LAUNCH_RUNS = 5
+
+
+def exe_path(name: str = "M2Watcher") -> Path:
+    """Ścieżka pliku wynikowego PyInstaller (bez rozszerzenia poza Windows)"""
+    return Path("dist") / (name + (".exe" if sys.platform == "win32" else ""))
+
+
+def measure_launch(path: Path, runs: int = LAUNCH_RUNS) -> tuple:
+    """
+    Mierzy czas uruchomienia exe (od startu procesu do zakończenia z LAUNCH_ARGS).
+    Exe w trybie onefile rozpakowuje się przy każdym uruchomieniu, więc każdy pomiar
+    obejmuje rozpakowanie; pierwszy dodatkowo odczyt pliku z dysku.
+    
+    Returns:
+        (czas pierwszego uruchomienia s, mediana kolejnych s)
+    """
+    times = []
+    for _ in range(max(2, runs)):
+        started = time.perf_counter()
+        subprocess.run([str(path)] + LAUNCH_ARGS, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return times[0], statistics.median(times[1:])
+
+
+def compare_profiles(reuse: bool = False) -> None:
+    """
+    Buduje exe w każdym profilu (dist/M2Watcher-<profil>) i porównuje rozmiar oraz czas startu.
+    
+    Args:
+        reuse: Użyj istniejących plików w dist/ zamiast budować je ponownie
+    """
+    results = {}
+    for profile_name in BUILD_PROFILES:
+        name = f"M2Watcher-{profile_name}"
+        path = exe_path(name)
+        if not (reuse and path.exists()):
+            path = build_exe(profile_name, name=name, cleanup=True)
+        if path is None or not path.exists():
+            print(f"✗ Brak exe dla profilu {profile_name} - pomijam")
+            continue
+        results[profile_name] = (path.stat().st_size / (1024 * 1024),) + measure_launch(path)
+    
+    print("\n" + "=" * 60)
+    print(f"PORÓWNANIE PROFILI (start: {' '.join(LAUNCH_ARGS)}, {LAUNCH_RUNS} uruchomień)")
+    print("=" * 60)
+    print(f"  {'profil':<8} {'rozmiar':>10} {'1. start':>10} {'mediana':>10}")
+    for profile_name, (size_mb, first, median) in results.items():
+        print(f"  {profile_name:<8} {size_mb:7.2f} MB {first:8.2f} s {median:8.2f} s")
+    if DEFAULT_PROFILE in results and "full" in results:
+        slim, full = results[DEFAULT_PROFILE], results["full"]
+        print(f"\n  {DEFAULT_PROFILE} względem full: rozmiar {slim[0] - full[0]:+.2f} MB "
+              f"({(slim[0] / full[0] - 1) * 100:+.0f}%), start {slim[2] - full[2]:+.2f} s "
+              f"({(slim[2] / full[2] - 1) * 100:+.0f}%)")
+
+
+def build_exe(profile_name: str = DEFAULT_PROFILE, name: str = "M2Watcher",
+              cleanup: Optional[bool] = None) -> Optional[Path]:
+    """
+    Buduje exe używając PyInstaller
+    
+    Args:
+        profile_name: Profil budowania (BUILD_PROFILES)
+        name: Nazwa pliku wynikowego w dist/
+        cleanup: Czy usunąć pliki tymczasowe (None = zapytaj, w CI zawsze)
+    
+    Returns:
+        Ścieżka exe lub None, jeśli budowanie się nie powiodło
+    """
     
     # Ustaw kodowanie UTF-8 dla stdout/stderr (potrzebne w Windows CI)
     if sys.platform == 'win32':
@@ -45,62 +310,29 @@ def build_exe():
     # Sprawdź czy główny plik istnieje
     if not main_file.exists():
         print(f"  ✗ Błąd: Nie znaleziono pliku {main_file}")
-        return
+        return None
     
     # Przygotuj argumenty dla PyInstaller
     pyinstaller_args = [
         sys.executable, "-m", "PyInstaller",
         "--clean",
         "--onefile",
-        "--name", "M2Watcher",
+        "--name", name,
         "--console",
     ]
     
-    # Dodaj ukryte importy - wszystkie wymagane moduły
-    hidden_imports = [
-        "main",
-        "m2watcher",
-        "config",
-        "notifications",
-        "discord_bot",
-        "psutil",
-        "psutil._pswindows",
-        "psutil._psutil_windows",
-        "psutil._psutil_linux",
-        "psutil._psutil_osx",
-        "win32gui",
-        "win32process",
-        "win32con",
-        "win32api",
-        "winsound",
-        "requests",
-        "requests.packages.urllib3",
-        "discord",
-        "discord.ext.commands",
-        "discord.ext.tasks",
-        "pywintypes",
-    ]
+    profile = BUILD_PROFILES[profile_name]
+    print(f"  Profil budowania: {profile_name} - {profile['description']}")
     
-    for module in hidden_imports:
+    for module in profile["hidden_imports"]:
         pyinstaller_args.extend(["--hidden-import", module])
     
-    # Dodaj kolekcje danych (dla psutil i innych modułów z dodatkowymi plikami)
-    pyinstaller_args.extend([
-        "--collect-all", "psutil",
-        "--collect-all", "requests",
-        "--collect-all", "discord",
-    ])
+    # Dodaj kolekcje danych (dla modułów z dodatkowymi plikami)
+    for package in profile["collect_all"]:
+        pyinstaller_args.extend(["--collect-all", package])
     
     # Wyklucz niepotrzebne moduły aby zmniejszyć rozmiar
-    excludes = [
-        "matplotlib",
-        "numpy",
-        "pandas",
-        "PIL",
-        "tkinter",
-    ]
-    
-    for exclude in excludes:
+    for exclude in profile["excludes"]:
         pyinstaller_args.extend(["--exclude-module", exclude])
     
     # Dodaj główny plik
@@ -122,7 +354,7 @@ def build_exe():
         if e.stderr:
             print(f"  Errors: {e.stderr[:500]}")
         build_warnings.append(f"Błąd budowania: {e}")
-        return
+        return None
     
     # Krok 2: Czyszczenie
     print("\n[2/2] Czyszczenie...")
@@ -131,14 +363,16 @@ def build_exe():
     is_ci = os.getenv("CI") == "true" or os.getenv("NON_INTERACTIVE") == "true"
     
     # Usuń tymczasowe pliki (opcjonalnie - można zostawić dla debugowania)
-    if is_ci:
+    if cleanup is not None:
+        pass
+    elif is_ci:
         # W trybie CI zawsze czyść pliki tymczasowe
-        cleanup = 'y'
+        cleanup = True
         print("  Tryb CI wykryty - automatyczne czyszczenie plików tymczasowych")
     else:
-        cleanup = input("  Czy usunąć pliki tymczasowe (build, *.spec)? [T/n]: ").strip().lower()
+        cleanup = input("  Czy usunąć pliki tymczasowe (build, *.spec)? [T/n]: ").strip().lower() != 'n'
     
-    if cleanup != 'n':
+    if cleanup:
         if Path("build").exists():
             shutil.rmtree("build")
             print("  ✓ Usunięto katalog build/")
@@ -155,14 +389,14 @@ def build_exe():
     print("=" * 60)
     
     # Sprawdź wynik
-    exe_path = Path("dist") / "M2Watcher.exe"
-    exe_exists = exe_path.exists()
+    output_path = exe_path(name)
+    exe_exists = output_path.exists()
     
     if exe_exists:
-        size_mb = exe_path.stat().st_size / (1024 * 1024)
+        size_mb = output_path.stat().st_size / (1024 * 1024)
         print(f"\n✓ SUKCES: Plik exe został utworzony")
-        print(f"  Lokalizacja: {exe_path.absolute()}")
-        print(f"  Rozmiar: {size_mb:.2f} MB")
+        print(f"  Lokalizacja: {output_path.absolute()}")
+        print(f"  Rozmiar: {size_mb:.2f} MB (profil: {profile_name})")
         build_success = True
     else:
         print(f"\n✗ BŁĄD: Plik exe nie został utworzony")
@@ -182,6 +416,26 @@ def build_exe():
         print("✗ Budowanie zakończone z błędami")
         print("  Sprawdź komunikaty powyżej i popraw błędy")
     print("=" * 60)
+    return output_path if exe_exists else None
 
 if __name__ == "__main__":
-    build_exe()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Budowanie M2Watcher.exe")
+    parser.add_argument("--profile", choices=sorted(BUILD_PROFILES),
+                        default=os.getenv("BUILD_PROFILE", DEFAULT_PROFILE),
+                        help="Profil budowania (domyślnie: slim)")
+    parser.add_argument("--measure", action="store_true",
+                        help="Zamiast budować, zmierz czas importu modułów aplikacji")
+    parser.add_argument("--compare", action="store_true",
+                        help="Zbuduj exe we wszystkich profilach i porównaj rozmiar oraz czas startu")
+    parser.add_argument("--reuse", action="store_true",
+                        help="Z --compare: użyj istniejących dist/M2Watcher-<profil> zamiast budować")
+    args = parser.parse_args()
+    
+    if args.measure:
+        measure_startup()
+    elif args.compare:
+        compare_profiles(args.reuse)
+    else:
+        build_exe(args.profile)
@@ -21,22 +21,99 @@ class Config:
         "sound_enabled": True,
         "sound_wait_for_input": True,
         "show_status": True,
+        "state_snapshot_interval": 30.0,
+        "workers": 0,
+        "exit_detection": True,
+        "idle_check_interval": 5.0,
+        "probe_recheck_interval": 10.0,
+        "probe_cpu_threshold": 0.02,
+        "detectors": ["connections", "network_activity"],
+        "detector_budget_ms": 50.0,
+        "hung_timeout": 30.0,
+        "flap": {
+            "hysteresis": 1,
+            "min_dwell": 0.0,
+            "window": 300.0,
+            "threshold": 4
+        },
+        "process_match": {
+            "names": ["metin2client.exe"],
+            "exe_patterns": [],
+            "cmdline_patterns": []
+        },
+        "login_title_patterns": [
+            "select server",
+            "wybierz serwer",
+            "^\\s*(?:\\S*metin2\\S*(?:\\s+\\S+)?|\\S+\\s+\\S*metin2\\S*)\\s*$"
+        ],
+        "event_queue_size": 256,
+        "event_log": "",
+        "control": {
+            "enabled": False,
+            "address": ""
+        },
+        "diagnostics": {
+            "enabled": False,
+            "interval": 600.0,
+            "top": 10
+        },
+        "metrics": {
+            "enabled": False,
+            "host": "127.0.0.1",
+            "port": 9108
+        },
+        "mode": "standalone",
+        "agent": {
+            "host_id": "",
+            "aggregator_host": "127.0.0.1",
+            "aggregator_port": 7878,
+            "telemetry_interval": 10.0,
+            "token": ""
+        },
+        "aggregator": {
+            "listen_host": "127.0.0.1",
+            "listen_port": 7878,
+            "token": "",
+            "agent_timeout": 60.0,
+            "event_store": True,
+            "retention_days": {
+                "raw": 2,
+                "minute": 14,
+                "hour": 180,
+                "day": 0
+            },
+            "api_enabled": True,
+            "api_host": "127.0.0.1",
+            "api_port": 7879
+        },
         "discord": {
             "enabled": False,
             "bot_token": "",
             "guild_id": "",
             "user_id": "",
-            "channel_id": ""
+            "channel_id": "",
+            "command_cooldown": 3.0,
+            "routes": [],
+            "rate_limit": {
+                "burst": 5,
+                "per_second": 1.0
+            }
         }
     }
     
-    def __init__(self):
+    def __init__(self, create: bool = True):
+        """
+        Args:
+            create: Czy utworzyć domyślny plik konfiguracji, jeśli nie istnieje
+                    (False - tylko odczyt, np. dla jednorazowego sprawdzenia)
+        """
         self._config = self.DEFAULT_CONFIG.copy()
-        self._load_config()
+        self._load_config(create)
     
-    def _load_config(self) -> None:
+    def _load_config(self, create: bool = True) -> None:
         """Ładuje konfigurację z pliku"""
-        CONFIG_DIR.mkdir(exist_ok=True)
+        if create:
+            CONFIG_DIR.mkdir(exist_ok=True)
         
         if CONFIG_FILE.exists():
             try:
@@ -46,7 +123,7 @@ class Config:
                     self._config = {**self.DEFAULT_CONFIG, **loaded_config}
             except Exception as e:
                 print(f"Błąd podczas ładowania konfiguracji: {e}")
-        else:
+        elif create:
             # Jeśli plik nie istnieje, utwórz domyślny plik konfiguracyjny
             try:
                 self.save_config()
@@ -0,0 +1,274 @@
+"""
+Snapshot stanu i lokalny kanał sterowania M2Watcher
+Zapytania o stan klientów (kanał sterowania, komendy bota Discord) są obsługiwane
+z niezmiennego snapshotu, który watcher publikuje po każdym cyklu przez podmianę
+referencji, a komendy (pauza klienta, wymuszenie pełnego sprawdzenia) trafiają do
+kolejki wykonywanej na początku kolejnego cyklu - zapytania nigdy nie blokują ani nie
+spowalniają monitorowania. Wyjątkiem jest potwierdzenie alertu, które dotyczy tylko
+stanu snapshotu i działa od razu, także w trybie bezczynności
+"""
+import collections
+import json
+import queue
+import threading
+import time
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+import events
+
+try:
+    import backend
+except ImportError:
+    backend = None
+
+try:
+    from config import CONFIG_DIR
+except ImportError:
+    CONFIG_DIR = None
+
+# Zdarzenia wymagające reakcji użytkownika - alert trwa do potwierdzenia (ack)
+# albo do zdarzenia, które go rozwiązuje
+ALERT_EVENTS = ("logout", "closed", "crashed", "hung", "unstable")
+RESOLVING_EVENTS = {"reconnect": "logout", "responsive": "hung", "stable": "unstable"}
+# Alerty zamkniętych klientów czekają na potwierdzenie - najstarsze są usuwane ponad limit
+MAX_ALERTS = 100
+# Liczba ostatnich zdarzeń klientów w historii snapshotu
+HISTORY_SIZE = 50
+
+COMMANDS = ("status", "client", "history", "ack", "pause", "resume", "reprobe")
+
+
+class ClientView(NamedTuple):
+    """Niezmienny widok klienta w snapshocie"""
+    pid: int
+    name: str
+    create_time: float
+    window_title: str
+    is_logged_in: bool
+    num_connections: int
+    is_hung: bool
+    paused: bool
+    endpoints: Tuple[str, ...]  # "ip:port" połączeń ESTABLISHED
+    endpoint_event: Optional[str]
+    monitored_since: float  # Czas (time.time()) wykrycia klienta
+
+
+class Alert(NamedTuple):
+    """Niepotwierdzony alert klienta"""
+    pid: int
+    event: str
+    client: str  # Opis klienta z chwili zdarzenia
+    timestamp: float
+
+
+class HistoryEntry(NamedTuple):
+    """Zdarzenie klienta w historii"""
+    timestamp: float
+    event: str
+    pid: int
+    client: str
+
+
+class WatcherSnapshot(NamedTuple):
+    """Stan watchera opublikowany po jednym cyklu"""
+    timestamp: float
+    clients: Tuple[ClientView, ...]
+    alerts: Tuple[Alert, ...]
+    history: Tuple[HistoryEntry, ...]  # Od najstarszego
+
+    def find_client(self, pid: Optional[int]) -> Optional[ClientView]:
+        return next((view for view in self.clients if view.pid == pid), None)
+
+
+EMPTY_SNAPSHOT = WatcherSnapshot(0.0, (), (), ())
+
+
+def default_address() -> str:
+    return backend.default_control_address(str(CONFIG_DIR))
+
+
+class SnapshotPublisher(events.Sink):
+    """Buduje snapshoty stanu watchera, alerty i historię zdarzeń (ujście magistrali zdarzeń)"""
+
+    name = "snapshot"
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        # Czytany z innych wątków bez blokad - watcher tylko podmienia referencję
+        self.snapshot = EMPTY_SNAPSHOT
+        self.alerts: Dict[int, Alert] = {}
+        self.history: Deque[HistoryEntry] = collections.deque(maxlen=HISTORY_SIZE)
+        self._history_tuple: Optional[Tuple[HistoryEntry, ...]] = ()
+        # Chroni alerty i historię - zmieniane przez zdarzenia (wątek monitorowania) i potwierdzenia
+        self._lock = threading.Lock()
+        # PID -> (pola, z których zbudowano widok, widok) - niezmienieni klienci współdzielą widok
+        self._views: Dict[int, Tuple[tuple, ClientView]] = {}
+        watcher.bus.add_sink(self)
+
+    def handle(self, event: events.ClientEvent) -> None:
+        pid, name = event.client.pid, event.name
+        with self._lock:
+            text = str(event.client)
+            self.history.append(HistoryEntry(event.timestamp, name, pid, text))
+            self._history_tuple = None
+            if name in ALERT_EVENTS:
+                self.alerts.pop(pid, None)
+                self.alerts[pid] = Alert(pid, name, text, event.timestamp)
+                while len(self.alerts) > MAX_ALERTS:
+                    del self.alerts[next(iter(self.alerts))]
+            elif name in RESOLVING_EVENTS:
+                alert = self.alerts.get(pid)
+                if alert and alert.event == RESOLVING_EVENTS[name]:
+                    del self.alerts[pid]
+
+    def publish(self) -> None:
+        """Buduje nowy snapshot po cyklu - widoki niezmienionych klientów są używane ponownie"""
+        now, now_monotonic = time.time(), time.monotonic()
+        paused = self.watcher.paused
+        views = {}
+        for pid, client in self.watcher.clients.items():
+            key = (client.create_time, client.window_title, client.is_logged_in, client.num_connections,
+                   client.is_hung, pid in paused, client.remote_endpoints, client.endpoint_event)
+            cached = self._views.get(pid)
+            if cached is None or cached[0] != key:
+                view = ClientView(
+                    pid, client.name, client.create_time, client.window_title or "",
+                    client.is_logged_in, client.num_connections, client.is_hung, pid in paused,
+                    tuple(f"{ip}:{port}" for ip, port in sorted(client.remote_endpoints)),
+                    client.endpoint_event, now - (now_monotonic - client.start_time)
+                )
+                cached = (key, view)
+            views[pid] = cached
+        self._views = views
+        with self._lock:
+            if self._history_tuple is None:
+                self._history_tuple = tuple(self.history)
+            self.snapshot = WatcherSnapshot(
+                now, tuple(view for _, view in views.values()), tuple(self.alerts.values()),
+                self._history_tuple
+            )
+
+    def acknowledge(self, pid: Optional[int] = None) -> int:
+        """Potwierdza alerty klienta (lub wszystkie) i od razu publikuje snapshot bez nich"""
+        with self._lock:
+            if pid is None:
+                count = len(self.alerts)
+                self.alerts.clear()
+            else:
+                count = 1 if self.alerts.pop(pid, None) else 0
+            self.snapshot = self.snapshot._replace(alerts=tuple(self.alerts.values()))
+        return count
+
+
+class ControlChannel:
+    """Serwer i kolejka komend kanału sterowania jednego watchera"""
+
+    def __init__(self, watcher, publisher: SnapshotPublisher, address: str = ""):
+        self.watcher = watcher
+        self.publisher = publisher
+        self.address = address or default_address()
+        self._commands: "queue.SimpleQueue[Tuple[str, Optional[int]]]" = queue.SimpleQueue()
+        # Odpowiedź "status" serializowana raz na snapshot
+        self._status_cache: Tuple[Optional[WatcherSnapshot], bytes] = (None, b"")
+        self._server = None
+
+    def start(self) -> bool:
+        """Uruchamia serwer kanału. Zwraca False, jeśli adres jest zajęty lub niedostępny."""
+        try:
+            self._server = backend.create_control_server(self.address, self.handle_request)
+        except OSError as e:
+            print(f"[{self.watcher._format_time()}] [STEROWANIE] Kanał sterowania niedostępny: {e}")
+            return False
+        self._server.start()
+        print(f"[{self.watcher._format_time()}] [STEROWANIE] Kanał sterowania ({self._server.name}): {self.address}")
+        return True
+
+    def close(self) -> None:
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    # Wątek monitorowania
+
+    def apply_commands(self) -> None:
+        """Wykonuje komendy oczekujące w kolejce (na początku cyklu)"""
+        while True:
+            try:
+                command, pid = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if command in ("pause", "resume"):
+                self.watcher.set_paused(pid, command == "pause")
+            elif command == "reprobe":
+                for target in ([pid] if pid is not None else list(self.watcher.clients)):
+                    self.watcher.request_reprobe(target)
+
+    # Wątki kanału - tylko odczyt snapshotu i kolejkowanie komend
+
+    def handle_request(self, line: bytes) -> bytes:
+        """Obsługuje jedno żądanie JSON, np. {"cmd": "pause", "pid": 1234}"""
+        try:
+            request = json.loads(line)
+            command = request.get("cmd")
+            pid = request.get("pid")
+            if pid is not None:
+                pid = int(pid)
+        except (ValueError, TypeError, AttributeError):
+            return _error("Nieprawidłowe żądanie - oczekiwano obiektu JSON z polem cmd")
+
+        snapshot = self.publisher.snapshot
+        if command == "status":
+            cached_snapshot, response = self._status_cache
+            if cached_snapshot is not snapshot:
+                response = _encode({"ok": True, **snapshot_to_dict(snapshot)})
+                self._status_cache = (snapshot, response)
+            return response
+
+        if command not in COMMANDS:
+            return _error(f"Nieznana komenda: {command} (dostępne: {', '.join(COMMANDS)})")
+
+        view = snapshot.find_client(pid)
+        if command == "client":
+            if view is None:
+                return _error(f"Brak klienta o PID {pid}")
+            return _encode({"ok": True, "client": view._asdict()})
+        if command == "history":
+            return _encode({"ok": True, "history": [entry._asdict() for entry in snapshot.history]})
+
+        if pid is None and command in ("pause", "resume"):
+            return _error(f"Komenda {command} wymaga pola pid")
+        if pid is not None and view is None and command != "ack":
+            return _error(f"Brak klienta o PID {pid}")
+
+        if command == "ack":
+            # Dźwięk alertu zatrzymujemy od razu - wątek monitorowania może na niego czekać
+            self.watcher.stop_alert_sound()
+            return _encode({"ok": True, "acknowledged": self.publisher.acknowledge(pid)})
+
+        self._commands.put((command, pid))
+        return _encode({"ok": True, "queued": command})
+
+
+def snapshot_to_dict(snapshot: WatcherSnapshot) -> dict:
+    return {
+        "timestamp": snapshot.timestamp,
+        "clients": [view._asdict() for view in snapshot.clients],
+        "alerts": [alert._asdict() for alert in snapshot.alerts],
+    }
+
+
+def _encode(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _error(message: str) -> bytes:
+    return _encode({"ok": False, "error": message})
+
+
+def send_command(address: str, command: str, pid: Optional[int] = None) -> dict:
+    """Wysyła komendę do działającego watchera (klient kanału sterowania)"""
+    request = {"cmd": command}
+    if pid is not None:
+        request["pid"] = pid
+    response = backend.send_control_request(address or default_address(), _encode(request))
+    return json.loads(response) if response else {"ok": False, "error": "Brak odpowiedzi"}
@@ -0,0 +1,313 @@
+"""
+Detektory wylogowania dla M2Watcher
+Każdy detektor deklaruje sygnały, których potrzebuje, i szacowany koszt.
+Watcher zbiera sygnały leniwie (raz na klienta w cyklu, wspólnie dla wszystkich
+detektorów) i uruchamia detektory w ramach budżetu czasu CPU na jeden cykl.
+"""
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Type
+
+from probe import IO_BYTES_INCLUDE_NETWORK, Endpoint, ProbeRecord
+
+# Sygnały i ich szacowany koszt zebrania dla jednego klienta (ms).
+# Szacunki są na bieżąco korygowane na podstawie zmierzonych czasów.
+SIGNAL_IO = "io"                    # (bajty I/O, czas CPU) - zbierane przy każdym cyklu
+SIGNAL_CONNECTIONS = "connections"  # probe.Endpoints - zdalne adresy połączeń procesu
+SIGNAL_WINDOW = "window"            # (hwnd, tytuł okna, rozmiar okna)
+
+SIGNAL_COSTS = {
+    SIGNAL_IO: 0.05,
+    SIGNAL_CONNECTIONS: 2.0,
+    SIGNAL_WINDOW: 1.0,
+}
+
+# Sygnały, których zbieranie jest kosztowne - tylko gdy tanie sygnały na to wskazują
+EXPENSIVE_SIGNALS = {SIGNAL_CONNECTIONS, SIGNAL_WINDOW}
+
+
+# Klasyfikacja zmian zbioru zdalnych adresów klienta między sprawdzeniami
+ENDPOINT_CONNECTED = "connected"            # pierwsze połączenie
+ENDPOINT_LOST = "lost"                      # wszystkie połączenia zniknęły - czekamy na powrót
+ENDPOINT_RECONNECT = "reconnect"            # powrót do tych samych serwerów
+ENDPOINT_CHANNEL_SWITCH = "channel_switch"  # przejście na inny serwer/kanał
+ENDPOINT_DISCONNECT = "disconnect"          # połączenia nie wróciły - rzeczywiste rozłączenie
+
+
+def classify_endpoints(previous: FrozenSet[Endpoint], current: FrozenSet[Endpoint],
+                       lost: FrozenSet[Endpoint]) -> Optional[str]:
+    """
+    Klasyfikuje zmianę zbioru zdalnych adresów (None = bez zmian).
+
+    Args:
+        previous: Adresy z poprzedniego sprawdzenia
+        current: Adresy z bieżącego sprawdzenia
+        lost: Adresy sprzed utraty wszystkich połączeń (pusty zbiór, jeśli nie było przerwy)
+    """
+    if current == previous:
+        return None
+    if not current:
+        return ENDPOINT_LOST
+    reference = previous or lost
+    if not reference:
+        return ENDPOINT_CONNECTED
+    if current == reference:
+        return ENDPOINT_RECONNECT
+    return ENDPOINT_CHANNEL_SWITCH
+
+
+class ClientSignals:
+    """
+    Sygnały jednego klienta w bieżącym cyklu - zbierane przy pierwszym użyciu i współdzielone.
+    Tanie sygnały pochodzą z rekordu odczytu procesu (probe.probe_process).
+    """
+
+    __slots__ = ("proc", "record", "_collectors", "_values", "_timings")
+
+    def __init__(self, proc, collectors: Dict[str, Callable], record: Optional[ProbeRecord] = None):
+        self.proc = proc
+        self.record = record
+        self._collectors = collectors
+        self._values: Dict[str, object] = {}
+        # Zmierzone czasy zbierania sygnałów (sekundy) - do korekty szacunków kosztu
+        self._timings: Dict[str, float] = {}
+        if record is not None:
+            self._values[SIGNAL_IO] = (record.io_bytes, record.cpu_time)
+
+    def set(self, name: str, value) -> None:
+        """Zapisuje sygnał zebrany poza detektorami"""
+        self._values[name] = value
+
+    def has(self, name: str) -> bool:
+        return name in self._values
+
+    def get(self, name: str):
+        """Zwraca wartość sygnału, zbierając go przy pierwszym użyciu"""
+        if name not in self._values:
+            start = time.perf_counter()
+            self._values[name] = self._collectors[name](self.proc)
+            self._timings[name] = time.perf_counter() - start
+            if name == SIGNAL_CONNECTIONS and self.record is not None:
+                self.record.endpoints = self._values[name]
+        return self._values[name]
+
+
+class Detector:
+    """
+    Bazowy detektor. Metoda check zwraca:
+        True - klient zalogowany, False - wylogowany, None - brak rozstrzygnięcia.
+    Pierwszy rozstrzygający wynik (w kolejności z konfiguracji) wygrywa.
+    """
+
+    name = ""
+    signals: Tuple[str, ...] = ()
+    cost = 0.01  # Szacowany koszt samego detektora (ms), bez zbierania sygnałów
+
+    @property
+    def expensive(self) -> bool:
+        return any(signal in EXPENSIVE_SIGNALS for signal in self.signals)
+
+    def check(self, watcher, client, signals: ClientSignals) -> Optional[bool]:
+        raise NotImplementedError
+
+
+DETECTORS: Dict[str, Type[Detector]] = {}
+
+
+def register_detector(cls: Type[Detector]) -> Type[Detector]:
+    """Dekorator rejestrujący detektor pod jego nazwą (do użycia w konfiguracji)"""
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+@register_detector
+class ConnectionTimeoutDetector(Detector):
+    """
+    Brak połączeń ESTABLISHED przez 5 sekund = wylogowanie.
+    Śledzi zbiór zdalnych adresów klienta: powrót połączeń w trakcie odliczania to
+    ponowne połączenie lub zmiana kanału, a nie wylogowanie. Gdy klient właśnie
+    nawiązuje nowe połączenie (SYN_SENT), odliczanie jest wydłużone do CHANNEL_SWITCH_TIMEOUT.
+    """
+
+    name = "connections"
+    signals = (SIGNAL_CONNECTIONS,)
+    NO_CONNECTIONS_TIMEOUT = 5.0
+    CHANNEL_SWITCH_TIMEOUT = 15.0
+
+    def check(self, watcher, client, signals: ClientSignals) -> Optional[bool]:
+        endpoints = signals.get(SIGNAL_CONNECTIONS)
+        event = classify_endpoints(client.remote_endpoints, endpoints.established, client.lost_endpoints)
+        if event == ENDPOINT_LOST:
+            client.lost_endpoints = client.remote_endpoints
+        elif endpoints.established:
+            client.lost_endpoints = frozenset()
+        client.remote_endpoints = endpoints.established
+        if event:
+            client.endpoint_event = event
+
+        if endpoints.established:
+            # Połączenia są aktywne - zresetuj timer, o reszcie decydują kolejne detektory
+            client.no_connections_since = None
+            return None
+
+        # Jeśli to pierwszy raz gdy brak połączeń, zapisz czas
+        if client.no_connections_since is None:
+            client.no_connections_since = time.monotonic()
+
+        # Do końca odliczania klient nadal uważany za zalogowanego
+        timeout = self.CHANNEL_SWITCH_TIMEOUT if endpoints.connecting else self.NO_CONNECTIONS_TIMEOUT
+        time_without_connections = time.monotonic() - client.no_connections_since
+        if time_without_connections < timeout:
+            return True
+        if client.lost_endpoints:
+            client.endpoint_event = ENDPOINT_DISCONNECT
+        return False
+
+
+@register_detector
+class NetworkActivityDetector(Detector):
+    """Przyrost bajtów poniżej progu przez network_check_samples próbek = wylogowanie"""
+
+    name = "network_activity"
+    signals = (SIGNAL_IO,)
+
+    def check(self, watcher, client, signals: ClientSignals) -> Optional[bool]:
+        current_bytes, _ = signals.get(SIGNAL_IO)
+
+        # Dla nowych klientów (bez historii) zbieramy próbki przed oceną
+        if client.last_network_bytes == 0:
+            client.last_network_bytes = current_bytes
+            return None
+
+        # Oblicz zmianę aktywności sieciowej (różnica między sprawdzeniami)
+        bytes_diff = current_bytes - client.last_network_bytes
+
+        # Jeśli różnica jest ujemna (co może się zdarzyć przy restarcie licznika),
+        # zresetuj historię
+        if bytes_diff < 0:
+            client.last_network_bytes = current_bytes
+            client.network_activity_history.clear()
+            return None
+
+        # Dodaj różnicę do historii i zachowaj tylko ostatnie N próbek
+        client.network_activity_history.append(bytes_diff)
+        if len(client.network_activity_history) > watcher.network_check_samples:
+            client.network_activity_history.pop(0)
+        client.last_network_bytes = current_bytes
+
+        # Bez ruchu sieciowego w licznikach I/O historia nie mówi nic o zalogowaniu
+        if not IO_BYTES_INCLUDE_NETWORK or len(client.network_activity_history) < watcher.network_check_samples:
+            return None
+
+        # Jeśli przez ostatnie próbki nie było aktywności sieciowej, prawdopodobnie nastąpiło wylogowanie
+        recent_activity = client.network_activity_history[-watcher.network_check_samples:]
+        total_recent_activity = sum(recent_activity)
+        avg_activity = total_recent_activity / len(recent_activity)
+        if total_recent_activity < watcher.network_threshold and avg_activity < (watcher.network_threshold / watcher.network_check_samples):
+            return False
+        return None
+
+
+@register_detector
+class WindowTitleDetector(Detector):
+    """Tytuł okna wskazujący na ekran logowania = wylogowanie (zależy od serwera)"""
+
+    name = "window_title"
+    signals = (SIGNAL_WINDOW,)
+
+    def check(self, watcher, client, signals: ClientSignals) -> Optional[bool]:
+        _, window_title, _ = signals.get(SIGNAL_WINDOW)
+        return None if watcher.is_logged_in(window_title) else False
+
+
+@register_detector
+class LoginScreenDetector(Detector):
+    """Widoczny ekran logowania rozpoznany po właściwościach okna = wylogowanie"""
+
+    name = "login_screen"
+    signals = (SIGNAL_WINDOW,)
+
+    def check(self, watcher, client, signals: ClientSignals) -> Optional[bool]:
+        hwnd, _, window_size = signals.get(SIGNAL_WINDOW)
+        return False if watcher.is_login_screen_visible(hwnd, window_size) else None
+
+
+DEFAULT_DETECTORS = ["connections", "network_activity"]
+
+
+class DetectorScheduler:
+    """
+    Uruchamia detektory w ramach budżetu czasu CPU na jeden cykl (dla wszystkich klientów).
+    Detektory wymagające kosztownych sygnałów są uruchamiane tylko gdy sprawdzanie warstwowe
+    na to pozwala i starczy budżetu - w przeciwnym razie obowiązuje ich poprzedni wynik.
+    """
+
+    # Waga nowego pomiaru przy korekcie szacowanego kosztu
+    COST_SMOOTHING = 0.2
+
+    def __init__(self, names: Optional[List[str]] = None, budget_ms: float = 50.0):
+        self.detectors: List[Detector] = []
+        for name in names if names is not None else DEFAULT_DETECTORS:
+            if name not in DETECTORS:
+                print(f"Ostrzeżenie: Nieznany detektor '{name}' - pomijanie")
+                continue
+            self.detectors.append(DETECTORS[name]())
+        self.budget_ms = budget_ms
+        self.signal_costs = dict(SIGNAL_COSTS)
+        self.spent_ms = 0.0
+        self._expensive_runs = 0
+
+    def start_tick(self) -> None:
+        """Resetuje budżet na początku cyklu"""
+        self.spent_ms = 0.0
+        self._expensive_runs = 0
+
+    def estimate_ms(self, detector: Detector, signals: ClientSignals) -> float:
+        """Szacowany koszt uruchomienia detektora (sygnały już zebrane są darmowe)"""
+        return detector.cost + sum(
+            self.signal_costs.get(signal, 0.0) for signal in detector.signals if not signals.has(signal)
+        )
+
+    def evaluate(self, watcher, client, signals: ClientSignals, allow_expensive: bool) -> bool:
+        """
+        Ocenia status logowania klienta - pierwszy rozstrzygający wynik wygrywa,
+        a bez rozstrzygnięcia klient jest uważany za zalogowanego.
+        Wyniki detektorów są zapamiętywane w client.detector_results.
+        """
+        verdict = None
+        ran_expensive = False
+        deferred = False
+        for detector in self.detectors:
+            run = True
+            if detector.expensive:
+                # Co najmniej jeden kosztowny detektor w cyklu, aby nie zagłodzić klientów
+                within_budget = (self.spent_ms + self.estimate_ms(detector, signals) <= self.budget_ms
+                                 or self._expensive_runs == 0)
+                run = allow_expensive and within_budget
+                deferred = deferred or (allow_expensive and not within_budget)
+
+            if run:
+                start = time.perf_counter()
+                result = detector.check(watcher, client, signals)
+                self.spent_ms += (time.perf_counter() - start) * 1000
+                client.detector_results[detector.name] = result
+                if detector.expensive:
+                    ran_expensive = True
+                    self._expensive_runs += 1
+            else:
+                result = client.detector_results.get(detector.name)
+
+            if result is not None:
+                verdict = result
+                break
+
+        self._update_costs(signals)
+        if deferred and not ran_expensive:
+            # Zabrakło budżetu - wymuś kosztowne sprawdzenie w następnym cyklu
+            client.probe_signature = None
+        return True if verdict is None else verdict
+
+    def _update_costs(self, signals: ClientSignals) -> None:
+        for name, elapsed in signals._timings.items():
+            measured_ms = elapsed * 1000
+            estimate = self.signal_costs.get(name, measured_ms)
+            self.signal_costs[name] = estimate + self.COST_SMOOTHING * (measured_ms - estimate)
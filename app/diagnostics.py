@@ -0,0 +1,121 @@
+"""
+Diagnostyka pamięci M2Watcher przy długiej pracy
+Okresowo (we własnym wątku) wykonuje snapshot tracemalloc i zlicza obiekty według
+typu, porównuje je z poprzednim pomiarem i zgłasza miejsca oraz typy o największym
+przyroście. tracemalloc zapisuje tylko jedną ramkę stosu na alokację, aby narzut był mały
+"""
+import collections
+import gc
+import threading
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import events
+
+DEFAULT_INTERVAL = 600.0
+DEFAULT_TOP = 10
+
+# Typy zawsze wypisywane w podsumowaniu (nazwa modułu.klasa lub prefiks modułu z kropką)
+WATCHED_TYPES = ("m2watcher.Metin2Client", "psutil.Process")
+WATCHED_MODULE_PREFIXES = ("discord.",)
+
+# Alokacje samej diagnostyki i importów nie są interesujące
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>",
+                  "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def _type_name(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def count_objects() -> Dict[str, int]:
+    """Liczba obiektów śledzonych przez gc według typu"""
+    by_type = collections.Counter(map(type, gc.get_objects()))
+    return {_type_name(cls): count for cls, count in by_type.items()}
+
+
+def _is_watched(name: str) -> bool:
+    return name in WATCHED_TYPES or name.startswith(WATCHED_MODULE_PREFIXES)
+
+
+class MemoryDiagnostics:
+    """Okresowe pomiary pamięci i raport przyrostów"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, top: int = DEFAULT_TOP):
+        """
+        Args:
+            interval: Co ile sekund wykonywać pomiar
+            top: Ile miejsc alokacji i typów o największym przyroście zgłaszać
+        """
+        self.interval = max(1.0, interval)
+        self.top = top
+        # Ostatni raport (linie) - czytany przez status debugowania bez blokad
+        self.summary: List[str] = []
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._objects: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Śledzenie włączone wcześniej (np. PYTHONTRACEMALLOC) należy do kogoś innego - nie wyłączamy go
+        self._started_tracing = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            self._started_tracing = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="M2Watcher-diagnostics")
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _run(self) -> None:
+        # Pierwszy pomiar jest punktem odniesienia dla kolejnych
+        while True:
+            try:
+                report = self.sample()
+            except Exception as e:
+                report = [f"Błąd pomiaru pamięci: {e}"]
+            with events.CONSOLE_LOCK:
+                for line in report:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] [DIAGNOSTYKA] {line}")
+            if self._stop.wait(self.interval):
+                return
+
+    def sample(self) -> List[str]:
+        """Wykonuje pomiar i zwraca raport przyrostów względem poprzedniego pomiaru"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES]
+        )
+        objects = count_objects()
+        previous_snapshot, previous_objects = self._snapshot, self._objects
+        self._snapshot, self._objects = snapshot, objects
+
+        current, peak = tracemalloc.get_traced_memory()
+        report = [f"Pamięć śledzona: {current / 1024 / 1024:.1f} MB (szczyt {peak / 1024 / 1024:.1f} MB), "
+                  f"obiekty: {sum(objects.values())}"]
+        watched = sorted((name, count) for name, count in objects.items() if _is_watched(name))
+        if watched:
+            report.append("Obiekty: " + ", ".join(
+                f"{name} {count} ({count - previous_objects.get(name, 0):+d})" for name, count in watched
+            ))
+        if previous_snapshot is not None:
+            growth = [stat for stat in snapshot.compare_to(previous_snapshot, "lineno") if stat.size_diff > 0]
+            for stat in growth[:self.top]:
+                frame = stat.traceback[0]
+                report.append(f"  +{stat.size_diff / 1024:.1f} KB (+{stat.count_diff} bloków) {frame.filename}:{frame.lineno}")
+            type_growth = sorted(
+                ((count - previous_objects.get(name, 0), name) for name, count in objects.items()),
+                reverse=True
+            )
+            grown = [f"{name} {diff:+d}" for diff, name in type_growth[:self.top] if diff > 0]
+            if grown:
+                report.append("Przyrost obiektów: " + ", ".join(grown))
+        self.summary = report
+        return report
@@ -1,12 +1,91 @@
 """
 Bot Discord dla M2Watcher
-Obsługuje powiadomienia na własnym serwerze użytkownika
+Obsługuje powiadomienia na własnym serwerze użytkownika oraz komendy !status,
+!client i !history, odpowiadające wyłącznie ze snapshotu stanu publikowanego
+przez watcher po każdym cyklu (bez odczytów procesów i okien)
 """
 import discord
 from discord.ext import commands
-from typing import Optional, Dict
+from datetime import datetime
+from typing import Optional, Dict, Iterable, Tuple
 import asyncio
+import concurrent.futures
+import time
 from config import Config
+from routing import Target
+
+# Limit długości opisu embeda Discord
+EMBED_DESCRIPTION_LIMIT = 4096
+# Ilu klientów wypisuje !status (reszta tylko w podsumowaniu)
+STATUS_MAX_CLIENTS = 25
+HISTORY_DEFAULT_ENTRIES = 10
+# Jak długo synchroniczne wysyłanie czeka na wynik
+SYNC_TIMEOUT = 10.0
+# Najdłuższe oczekiwanie na limit odbiorcy - reszta SYNC_TIMEOUT zostaje na samo wysłanie.
+# Dłużej czekające powiadomienie jest pomijane, zamiast zostać wysłane po zgłoszeniu błędu
+MAX_RATE_LIMIT_WAIT = 5.0
+SNAPSHOT_UNAVAILABLE = "Stan klientów jest niedostępny (tryb agregatora lub watcher jeszcze nie wykonał sprawdzenia)"
+
+EVENT_LABELS = {
+    "discovered": "🆕 Wykryty",
+    "logout": "🔴 Wylogowanie",
+    "reconnect": "🟢 Zalogowanie",
+    "closed": "⚠️ Zamknięty",
+    "crashed": "💥 Crash",
+    "hung": "🧊 Nie odpowiada",
+    "responsive": "✅ Znowu odpowiada",
+    "unstable": "📶 Niestabilny",
+    "stable": "📶 Ustabilizowany",
+}
+
+
+def _format_clock(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+
+def _client_state(view) -> Tuple[int, str]:
+    """Zwraca (kolejność sortowania, opis stanu) - problemy na początku listy"""
+    if view.is_hung:
+        return 0, "🧊 Nie odpowiada"
+    if view.paused:
+        return 2, "⏸️ Wstrzymany"
+    if not view.is_logged_in:
+        return 1, "🔴 Wylogowany"
+    return 3, "🟢 Zalogowany"
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= EMBED_DESCRIPTION_LIMIT:
+        return text
+    return text[:EMBED_DESCRIPTION_LIMIT - 1] + "…"
+
+
+class _TargetBucket:
+    """Kubełek żetonów jednego odbiorcy - używany tylko w pętli zdarzeń bota"""
+    
+    def __init__(self, burst: int, per_second: float):
+        self.burst = max(1, burst)
+        self.per_second = per_second
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+    
+    async def acquire(self, max_wait: float) -> bool:
+        """
+        Rezerwuje żeton od razu (także na kredyt) i czeka, aż będzie pokryty.
+        Jeśli czekanie trwałoby dłużej niż max_wait, niczego nie rezerwuje i zwraca False.
+        """
+        if self.per_second <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+        wait = (1 - self.tokens) / self.per_second
+        if wait > max_wait:
+            return False
+        self.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
 
 
 class M2WatcherBot:
@@ -20,6 +99,19 @@ class M2WatcherBot:
         self.channel_id = config.get("discord.channel_id", "")
         self._loop = None
         self._bot_ready = False
+        # Wydawca snapshotu watchera (control.SnapshotPublisher) - ustawiany przez attach_snapshots
+        self.snapshots = None
+        # Jedna komenda na użytkownika co command_cooldown sekund, wspólnie dla wszystkich komend
+        self.command_cooldown = config.get("discord.command_cooldown", 3.0)
+        self._cooldowns = commands.CooldownMapping.from_cooldown(
+            1, self.command_cooldown, commands.BucketType.user
+        )
+        # Opis !status budowany raz na snapshot
+        self._status_cache = (None, "")
+        # Osobny limit wysyłania dla każdego odbiorcy - wolny odbiorca nie opóźnia pozostałych
+        self.rate_limit_burst = config.get("discord.rate_limit.burst", 5)
+        self.rate_limit_per_second = config.get("discord.rate_limit.per_second", 1.0)
+        self._buckets: Dict[Target, _TargetBucket] = {}
         
         intents = discord.Intents.default()
         intents.message_content = True
@@ -28,6 +120,10 @@ class M2WatcherBot:
         self.bot = commands.Bot(command_prefix='!', intents=intents)
         self.setup_commands()
     
+    def attach_snapshots(self, publisher) -> None:
+        """Podłącza snapshot stanu watchera, z którego odpowiadają komendy bota"""
+        self.snapshots = publisher
+    
     def setup_commands(self) -> None:
         """Konfiguruje komendy bota"""
         
@@ -36,17 +132,130 @@ class M2WatcherBot:
             print(f'Bot Discord zalogowany jako {self.bot.user}')
             self._loop = asyncio.get_event_loop()
             self._bot_ready = True
+        
+        @self.bot.check
+        async def allowed_user(ctx) -> bool:
+            # Z user_id w konfiguracji na komendy odpowiada tylko właściciel
+            if self.user_id and str(ctx.author.id) != str(self.user_id):
+                return False
+            bucket = self._cooldowns.get_bucket(ctx.message)
+            retry_after = bucket.update_rate_limit()
+            if retry_after:
+                raise commands.CommandOnCooldown(bucket, retry_after, commands.BucketType.user)
+            return True
+        
+        @self.bot.event
+        async def on_command_error(ctx, error):
+            if isinstance(error, (commands.CommandNotFound, commands.CheckFailure, commands.CommandOnCooldown)):
+                return  # Bez odpowiedzi - spam nie generuje kolejnych wiadomości
+            if isinstance(error, (commands.BadArgument, commands.MissingRequiredArgument)):
+                await ctx.send(f"Użycie: `!{ctx.command.qualified_name} {ctx.command.signature}`")
+                return
+            print(f"Błąd komendy Discord ({ctx.command}): {error}")
+        
+        @self.bot.command(name="status", help="Stan wszystkich klientów")
+        async def status(ctx):
+            snapshot = self._snapshot()
+            if snapshot is None:
+                await ctx.send(SNAPSHOT_UNAVAILABLE)
+                return
+            await ctx.send(embed=self._embed(f"Status klientów ({len(snapshot.clients)})",
+                                             self._status_text(snapshot), snapshot, 0x3498db))
+        
+        @self.bot.command(name="client", help="Szczegóły klienta o podanym PID")
+        async def client(ctx, pid: int):
+            snapshot = self._snapshot()
+            if snapshot is None:
+                await ctx.send(SNAPSHOT_UNAVAILABLE)
+                return
+            view = snapshot.find_client(pid)
+            if view is None:
+                await ctx.send(f"Brak klienta o PID {pid}")
+                return
+            await ctx.send(embed=self._embed(f"Klient PID {pid}", self._client_text(view, snapshot),
+                                             snapshot, 0x3498db))
+        
+        @self.bot.command(name="history", help="Ostatnie zdarzenia klientów")
+        async def history(ctx, count: int = HISTORY_DEFAULT_ENTRIES):
+            snapshot = self._snapshot()
+            if snapshot is None:
+                await ctx.send(SNAPSHOT_UNAVAILABLE)
+                return
+            entries = snapshot.history[-max(1, count):]
+            lines = [
+                f"`{_format_clock(entry.timestamp)}` {EVENT_LABELS.get(entry.event, entry.event)}: {entry.client}"
+                for entry in reversed(entries)
+            ]
+            await ctx.send(embed=self._embed("Ostatnie zdarzenia", "\n".join(lines) or "Brak zdarzeń",
+                                             snapshot, 0x95a5a6))
+    
+    # Odpowiedzi komend - tylko odczyt niezmiennego snapshotu
+    
+    def _snapshot(self):
+        snapshot = self.snapshots.snapshot if self.snapshots else None
+        if snapshot is None or snapshot.timestamp == 0:
+            return None
+        return snapshot
+    
+    def _embed(self, title: str, description: str, snapshot, color: int) -> discord.Embed:
+        embed = discord.Embed(title=title, description=_truncate(description), color=discord.Color(color))
+        embed.set_footer(text=f"M2Watcher | stan z {_format_clock(snapshot.timestamp)}")
+        return embed
+    
+    def _status_text(self, snapshot) -> str:
+        cached_snapshot, text = self._status_cache
+        if cached_snapshot is snapshot:
+            return text
+        
+        states = sorted(((_client_state(view), view) for view in snapshot.clients),
+                        key=lambda item: (item[0][0], item[1].pid))
+        logged_in = sum(1 for view in snapshot.clients if view.is_logged_in)
+        hung = sum(1 for view in snapshot.clients if view.is_hung)
+        lines = [f"Zalogowani: **{logged_in}** | Wylogowani: **{len(snapshot.clients) - logged_in}**"
+                 + (f" | Nie odpowiada: **{hung}**" if hung else "")]
+        if snapshot.alerts:
+            lines.append(f"Niepotwierdzone alerty: **{len(snapshot.alerts)}**")
+        lines.append("")
+        for (_, state), view in states[:STATUS_MAX_CLIENTS]:
+            lines.append(f"{state} `{view.pid}` {view.window_title or view.name}")
+        if len(states) > STATUS_MAX_CLIENTS:
+            lines.append(f"… i {len(states) - STATUS_MAX_CLIENTS} więcej")
+        if not snapshot.clients:
+            lines = ["Brak aktywnych klientów Metin2"]
+        
+        text = "\n".join(lines)
+        self._status_cache = (snapshot, text)
+        return text
+    
+    def _client_text(self, view, snapshot) -> str:
+        _, state = _client_state(view)
+        lines = [
+            f"**Stan:** {state}",
+            f"**Okno:** {view.window_title or 'brak'}",
+            f"**Proces:** {view.name}",
+            f"**Połączenia:** {view.num_connections}"
+            + (f" ({', '.join(view.endpoints[:5])})" if view.endpoints else ""),
+            f"**Monitorowany od:** {_format_clock(view.monitored_since)}",
+        ]
+        if view.endpoint_event:
+            lines.append(f"**Ostatnia zmiana połączeń:** {view.endpoint_event}")
+        alert = next((alert for alert in snapshot.alerts if alert.pid == view.pid), None)
+        if alert:
+            lines.append(f"**Alert:** {EVENT_LABELS.get(alert.event, alert.event)} o {_format_clock(alert.timestamp)}")
+        return "\n".join(lines)
     
     async def send_notification(self, message: str, title: str = "M2Watcher", 
-                               user_id: Optional[str] = None, color: int = 0xff0000) -> bool:
+                               user_id: Optional[str] = None, color: int = 0xff0000,
+                               channel_id: Optional[str] = None) -> bool:
         """
         Wysyła powiadomienie przez bota Discord do kanału z konfiguracji lub DM.
         
         Args:
             message: Treść wiadomości
             title: Tytuł wiadomości
-            user_id: ID użytkownika Discord (używane do DM jeśli brak channel_id)
+            user_id: ID użytkownika Discord do wzmianki lub DM, jeśli brak kanału (None = z konfiguracji, "" = bez wzmianki)
             color: Kolor embeda (hex)
+            channel_id: ID kanału (None = z konfiguracji, "" = bez kanału, tylko DM)
             
         Returns:
             bool: Czy wysłano pomyślnie
@@ -56,11 +265,12 @@ class M2WatcherBot:
         
         try:
             channel = None
-            target_user_id = user_id or self.user_id
+            target_user_id = self.user_id if user_id is None else user_id
+            target_channel_id = self.channel_id if channel_id is None else channel_id
             
-            # Najpierw spróbuj użyć channel_id z konfiguracji
-            if self.channel_id:
-                channel = self.bot.get_channel(int(self.channel_id))
+            # Najpierw spróbuj użyć kanału (z reguły kierowania lub z konfiguracji)
+            if target_channel_id:
+                channel = self.bot.get_channel(int(target_channel_id))
             
             # Jeśli nie ma kanału, spróbuj wysłać DM
             if not channel and target_user_id:
@@ -138,7 +348,49 @@ class M2WatcherBot:
                 self.send_notification(message, title, user_id, color),
                 self._loop
             )
-            return future.result(timeout=10)  # Timeout 10 sekund
+            return future.result(timeout=SYNC_TIMEOUT)
+        except Exception as e:
+            print(f"Błąd wysyłania powiadomienia Discord (sync): {e}")
+            return False
+    
+    async def _send_to_target(self, message: str, title: str, target: Target, color: int) -> bool:
+        bucket = self._buckets.get(target)
+        if bucket is None:
+            bucket = self._buckets[target] = _TargetBucket(self.rate_limit_burst, self.rate_limit_per_second)
+        if not await bucket.acquire(MAX_RATE_LIMIT_WAIT):
+            print(f"Limit powiadomień Discord dla odbiorcy {target.channel_id or target.user_id} "
+                  f"przekroczony - powiadomienie pominięte")
+            return False
+        return await self.send_notification(message, title, target.user_id, color, target.channel_id)
+    
+    async def send_to_targets(self, message: str, title: str, targets: Iterable[Target],
+                              color: int = 0xff0000) -> bool:
+        """Wysyła powiadomienie do wszystkich odbiorców równolegle. Zwraca True, jeśli dotarło do któregokolwiek."""
+        results = await asyncio.gather(
+            *(self._send_to_target(message, title, target, color) for target in targets)
+        )
+        return any(results)
+    
+    def send_to_targets_sync(self, message: str, title: str, targets: Iterable[Target],
+                             color: int = 0xff0000) -> bool:
+        """
+        Synchroniczna wersja send_to_targets - czeka najwyżej SYNC_TIMEOUT sekund na wszystkich odbiorców.
+        Oczekiwanie na limit odbiorcy jest ograniczone do MAX_RATE_LIMIT_WAIT, więc nie zużywa całego czasu.
+        """
+        if not self._bot_ready or not self._loop:
+            return False
+        
+        future = asyncio.run_coroutine_threadsafe(
+            self.send_to_targets(message, title, tuple(targets), color),
+            self._loop
+        )
+        try:
+            return future.result(timeout=SYNC_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Bez anulowania wiadomość mogłaby dotrzeć już po zgłoszeniu niepowodzenia
+            future.cancel()
+            print(f"Błąd wysyłania powiadomienia Discord (sync): brak odpowiedzi w ciągu {SYNC_TIMEOUT:.0f} s")
+            return False
         except Exception as e:
             print(f"Błąd wysyłania powiadomienia Discord (sync): {e}")
             return False
@@ -0,0 +1,650 @@
+"""
+Indeksowany magazyn zdarzeń klientów po stronie agregatora
+Przechowuje przejścia stanów (discovered, logout, reconnect, closed, crashed) w SQLite
+i na bieżąco aktualizuje sumy czasu zalogowania oraz liczby wylogowań.
+Próbki telemetrii są zapisywane surowo (z krótką retencją) i kompaktowane w locie
+do kubełków 1-minutowych, 1-godzinnych i 1-dniowych o dłuższej retencji.
+Zapisy wykonuje jeden wątek zapisujący, który zatwierdza oczekujące operacje
+partiami - wywołujący (pętla asyncio agregatora) nigdy nie czeka na SQLite
+"""
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import CONFIG_DIR
+
+EVENTS_DB = CONFIG_DIR / "events.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    create_time REAL NOT NULL,
+    window_title TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    closed_at REAL,
+    logged_in_since REAL,
+    uptime_seconds REAL NOT NULL DEFAULT 0,
+    logout_count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (host, pid, create_time)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_host_seen ON sessions (host, last_seen);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    host TEXT NOT NULL,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    pid INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    is_logged_in INTEGER NOT NULL,
+    num_connections INTEGER NOT NULL,
+    window_title TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS idx_events_host_ts ON events (host, ts);
+CREATE INDEX IF NOT EXISTS idx_events_host_pid_ts ON events (host, pid, ts);
+CREATE INDEX IF NOT EXISTS idx_events_session ON events (session_id, ts);
+
+-- Dzienne sumy aktualizowane przy każdym przejściu stanu
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    day TEXT NOT NULL,
+    uptime_seconds REAL NOT NULL DEFAULT 0,
+    logout_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, day)
+);
+CREATE INDEX IF NOT EXISTS idx_rollups_day ON daily_rollups (day);
+
+-- Surowe próbki telemetrii agentów (krótka retencja); create_time odróżnia procesy
+-- o tym samym PID (NULL, gdy próbka dotarła przed zdarzeniem "discovered" klienta)
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    bytes_delta INTEGER NOT NULL,
+    num_connections INTEGER NOT NULL,
+    is_logged_in INTEGER NOT NULL,
+    create_time REAL
+);
+CREATE INDEX IF NOT EXISTS idx_samples_ts ON samples (ts);
+CREATE INDEX IF NOT EXISTS idx_samples_host_pid_ts ON samples (host, pid, ts);
+
+-- Kubełki telemetrii: resolution = długość kubełka w sekundach (60, 3600, 86400),
+-- bucket = początek kubełka (timestamp wyrównany do resolution, doby w UTC)
+CREATE TABLE IF NOT EXISTS telemetry_rollups (
+    resolution INTEGER NOT NULL,
+    bucket REAL NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    bytes_sum INTEGER NOT NULL,
+    bytes_min INTEGER,
+    bytes_max INTEGER,
+    connections_sum INTEGER NOT NULL,
+    connections_min INTEGER,
+    connections_max INTEGER,
+    logged_in_seconds REAL NOT NULL,
+    logged_out_seconds REAL NOT NULL,
+    PRIMARY KEY (resolution, host, pid, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_telemetry_rollups_bucket ON telemetry_rollups (resolution, bucket);
+"""
+
+EVENT_COLUMNS = ("id", "ts", "host", "session_id", "pid", "event",
+                 "is_logged_in", "num_connections", "window_title")
+
+# Rozdzielczości kubełków telemetrii (s), od najdrobniejszej; 0 = surowe próbki
+RAW = 0
+RESOLUTIONS = (60, 3600, 86400)
+
+# Domyślna retencja (s) według rozdzielczości; 0 = bez limitu
+DEFAULT_RETENTION = {
+    RAW: 2 * 86400,
+    60: 14 * 86400,
+    3600: 180 * 86400,
+    86400: 0,
+}
+
+# Przerwa między próbkami klienta, powyżej której czas nie jest liczony do stanu
+# (agent był rozłączony albo klient zniknął na dłużej)
+MAX_SAMPLE_GAP = 300.0
+
+# Jak często (s, czas agregatora) usuwać dane starsze niż retencja
+EXPIRE_INTERVAL = 600.0
+
+# Największa akceptowana różnica (s) między czasem próbki agenta a zegarem agregatora;
+# próbki spoza tego zakresu są zapisywane z czasem agregatora
+MAX_CLOCK_SKEW = 300.0
+
+# Ile oczekujących operacji zapisu zatwierdzać jedną transakcją
+WRITE_BATCH = 500
+
+TELEMETRY_COLUMNS = ("resolution", "bucket", "host", "pid", "samples", "bytes_sum", "bytes_min", "bytes_max",
+                     "connections_sum", "connections_min", "connections_max",
+                     "logged_in_seconds", "logged_out_seconds")
+
+# Scalanie kubełka z już zapisanym (NULL min/max = kubełek bez próbek, tylko czas w stanie)
+_ROLLUP_UPSERT = (
+    "INSERT INTO telemetry_rollups (resolution, bucket, host, pid, samples, bytes_sum, bytes_min, bytes_max, "
+    "connections_sum, connections_min, connections_max, logged_in_seconds, logged_out_seconds) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (resolution, host, pid, bucket) DO UPDATE SET "
+    "samples = samples + excluded.samples, "
+    "bytes_sum = bytes_sum + excluded.bytes_sum, "
+    "bytes_min = COALESCE(MIN(bytes_min, excluded.bytes_min), bytes_min, excluded.bytes_min), "
+    "bytes_max = COALESCE(MAX(bytes_max, excluded.bytes_max), bytes_max, excluded.bytes_max), "
+    "connections_sum = connections_sum + excluded.connections_sum, "
+    "connections_min = COALESCE(MIN(connections_min, excluded.connections_min), connections_min, excluded.connections_min), "
+    "connections_max = COALESCE(MAX(connections_max, excluded.connections_max), connections_max, excluded.connections_max), "
+    "logged_in_seconds = logged_in_seconds + excluded.logged_in_seconds, "
+    "logged_out_seconds = logged_out_seconds + excluded.logged_out_seconds"
+)
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """
+    Parsuje parametr czasu: timestamp, wartość ujemną (sekundy wstecz od teraz)
+    lub datę/czas w formacie ISO (np. 2024-05-01 lub 2024-05-01T12:00:00)
+    """
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+        return time.time() + number if number < 0 else number
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+
+
+def _split_by_day(start: float, end: float) -> Iterator[Tuple[str, float]]:
+    """Dzieli przedział czasu na części w poszczególnych dniach: (dzień, sekundy)"""
+    while start < end:
+        day_start = datetime.fromtimestamp(start).replace(hour=0, minute=0, second=0, microsecond=0)
+        next_day = (day_start + timedelta(days=1)).timestamp()
+        part_end = min(end, next_day)
+        yield _day(start), part_end - start
+        start = part_end
+
+
+def _bucket(ts: float, resolution: int) -> float:
+    return float(int(ts // resolution) * resolution)
+
+
+def _split_by_bucket(start: float, end: float, resolution: int) -> Iterator[Tuple[float, float]]:
+    """Dzieli przedział czasu na części w kubełkach: (początek kubełka, sekundy)"""
+    while start < end:
+        bucket = _bucket(start, resolution)
+        part_end = min(end, bucket + resolution)
+        yield bucket, part_end - start
+        start = part_end
+
+
+class _MinuteBucket:
+    """Otwarty kubełek 1-minutowy jednego klienta (w pamięci do zamknięcia minuty)"""
+
+    __slots__ = ("samples", "bytes_sum", "bytes_min", "bytes_max", "connections_sum",
+                 "connections_min", "connections_max", "logged_in_seconds", "logged_out_seconds")
+
+    def __init__(self):
+        self.samples = 0
+        self.bytes_sum = 0
+        self.bytes_min: Optional[int] = None
+        self.bytes_max: Optional[int] = None
+        self.connections_sum = 0
+        self.connections_min: Optional[int] = None
+        self.connections_max: Optional[int] = None
+        self.logged_in_seconds = 0.0
+        self.logged_out_seconds = 0.0
+
+    def add_sample(self, bytes_delta: int, num_connections: int) -> None:
+        self.samples += 1
+        self.bytes_sum += bytes_delta
+        self.bytes_min = bytes_delta if self.bytes_min is None else min(self.bytes_min, bytes_delta)
+        self.bytes_max = bytes_delta if self.bytes_max is None else max(self.bytes_max, bytes_delta)
+        self.connections_sum += num_connections
+        self.connections_min = num_connections if self.connections_min is None else min(self.connections_min, num_connections)
+        self.connections_max = num_connections if self.connections_max is None else max(self.connections_max, num_connections)
+
+    def values(self) -> tuple:
+        return (self.samples, self.bytes_sum, self.bytes_min, self.bytes_max,
+                self.connections_sum, self.connections_min, self.connections_max,
+                self.logged_in_seconds, self.logged_out_seconds)
+
+
+class EventStore:
+    """Magazyn zdarzeń w SQLite (jeden wątek zapisujący, wielu czytających)"""
+
+    def __init__(self, path: Path = EVENTS_DB, retention: Optional[Dict[int, float]] = None):
+        """
+        Args:
+            path: Plik bazy SQLite
+            retention: Retencja (s) według rozdzielczości (RAW, 60, 3600, 86400); 0 = bez limitu.
+                       Brakujące wartości z DEFAULT_RETENTION
+        """
+        self.path = path
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        # Otwarte kubełki 1-minutowe: (host, pid, początek minuty) -> kubełek
+        self._open_buckets: Dict[Tuple[str, int, float], _MinuteBucket] = {}
+        # Ostatnia próbka klienta: (host, pid) -> (czas, zalogowany)
+        self._last_samples: Dict[Tuple[str, int], Tuple[float, bool]] = {}
+        self._last_expire = 0.0
+        self.path.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        # WAL pozwala czytać (API) równolegle z zapisem (agregator)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Bazy utworzone przed dodaniem create_time do próbek
+        if "create_time" not in {row[1] for row in self._conn.execute("PRAGMA table_info(samples)")}:
+            self._conn.execute("ALTER TABLE samples ADD COLUMN create_time REAL")
+        self._conn.commit()
+        self._writes: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True, name="event-store-writer")
+        self._writer.start()
+
+    def connect_reader(self) -> sqlite3.Connection:
+        """Otwiera osobne połączenie tylko do odczytu (np. dla wątku API)"""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def close(self) -> None:
+        """Zapisuje oczekujące operacje i otwarte kubełki, potem zamyka bazę"""
+        if not self._writer.is_alive():
+            return
+        self._writes.put(None)
+        self._writer.join()
+        with self._lock:
+            self._flush_buckets(None)
+            self._conn.commit()
+            self._conn.close()
+
+    def _writer_loop(self) -> None:
+        """Wątek zapisujący: wykonuje oczekujące operacje i zatwierdza je jedną transakcją"""
+        while True:
+            batch = [self._writes.get()]
+            while batch[-1] is not None and len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                try:
+                    for item in batch:
+                        if item is not None:
+                            method, args = item
+                            method(*args)
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    self._conn.rollback()
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] [BAZA] Błąd zapisu, "
+                          f"odrzucono {len(batch)} operacji: {e}")
+            if batch[-1] is None:
+                return
+
+    def _session(self, host: str, pid: int, create_time: float, window_title: str, ts: float) -> tuple:
+        """Zwraca (id, logged_in_since, czy utworzona) sesji, tworząc ją przy pierwszym zdarzeniu"""
+        row = self._conn.execute(
+            "SELECT id, logged_in_since FROM sessions WHERE host = ? AND pid = ? AND create_time = ?",
+            (host, pid, create_time)
+        ).fetchone()
+        if row:
+            self._conn.execute(
+                "UPDATE sessions SET last_seen = ?, window_title = ? WHERE id = ?",
+                (ts, window_title, row[0])
+            )
+            return row[0], row[1], False
+        cursor = self._conn.execute(
+            "INSERT INTO sessions (host, pid, create_time, window_title, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (host, pid, create_time, window_title, ts, ts)
+        )
+        return cursor.lastrowid, None, True
+
+    def _add_uptime(self, session_id: int, start: float, end: float) -> None:
+        """Dolicza zamknięty przedział zalogowania do sum sesji i dni"""
+        if end <= start:
+            return
+        self._conn.execute(
+            "UPDATE sessions SET uptime_seconds = uptime_seconds + ? WHERE id = ?",
+            (end - start, session_id)
+        )
+        for day, seconds in _split_by_day(start, end):
+            self._conn.execute(
+                "INSERT INTO daily_rollups (session_id, day, uptime_seconds) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id, day) DO UPDATE SET uptime_seconds = uptime_seconds + excluded.uptime_seconds",
+                (session_id, day, seconds)
+            )
+
+    def record_event(self, host: str, event: str, pid: int, create_time: float, ts: float,
+                     is_logged_in: bool, num_connections: int, window_title: str) -> None:
+        """
+        Kolejkuje zapis zdarzenia i przyrostowej aktualizacji sum (bez czekania na bazę).
+
+        Args:
+            host: Identyfikator hosta (agenta)
+            event: "discovered", "logout", "reconnect", "closed", "crashed", "hung" lub "responsive"
+            pid, create_time: Identyfikacja procesu klienta
+            ts: Czas zdarzenia (timestamp)
+            is_logged_in: Status klienta po zdarzeniu
+            num_connections: Liczba połączeń klienta
+            window_title: Tytuł okna klienta
+        """
+        self._writes.put((self._record_event, (host, event, pid, create_time, ts,
+                                               is_logged_in, num_connections, window_title)))
+
+    def _record_event(self, host: str, event: str, pid: int, create_time: float, ts: float,
+                      is_logged_in: bool, num_connections: int, window_title: str) -> None:
+        session_id, logged_in_since, created = self._session(host, pid, create_time, window_title, ts)
+
+        if event in ("logout", "closed", "crashed") and logged_in_since is not None:
+            self._add_uptime(session_id, logged_in_since, ts)
+            logged_in_since = None
+        elif event in ("discovered", "reconnect") and is_logged_in and logged_in_since is None:
+            logged_in_since = ts
+
+        if event == "logout":
+            self._conn.execute(
+                "UPDATE sessions SET logout_count = logout_count + 1 WHERE id = ?", (session_id,)
+            )
+            self._conn.execute(
+                "INSERT INTO daily_rollups (session_id, day, logout_count) VALUES (?, ?, 1) "
+                "ON CONFLICT (session_id, day) DO UPDATE SET logout_count = logout_count + 1",
+                (session_id, _day(ts))
+            )
+
+        self._conn.execute(
+            "UPDATE sessions SET logged_in_since = ?, closed_at = ? WHERE id = ?",
+            (logged_in_since, ts if event in ("closed", "crashed") else None, session_id)
+        )
+        # Agent po każdym połączeniu ponownie zgłasza wszystkich klientów jako "discovered" -
+        # dla znanej sesji aktualizuje to tylko jej stan, bez kolejnego wpisu w historii
+        if event != "discovered" or created:
+            self._conn.execute(
+                "INSERT INTO events (ts, host, session_id, pid, event, is_logged_in, num_connections, window_title) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ts, host, session_id, pid, event, int(is_logged_in), num_connections, window_title)
+            )
+
+    def close_open_sessions(self, host: str, ts: Optional[float] = None) -> None:
+        """Kolejkuje zamknięcie przedziałów zalogowania wszystkich sesji hosta (np. gdy agent przestał odpowiadać)"""
+        self._writes.put((self._close_open_sessions, (host, ts or time.time())))
+
+    def _close_open_sessions(self, host: str, ts: float) -> None:
+        rows = self._conn.execute(
+            "SELECT id, logged_in_since FROM sessions "
+            "WHERE host = ? AND closed_at IS NULL AND logged_in_since IS NOT NULL",
+            (host,)
+        ).fetchall()
+        for session_id, logged_in_since in rows:
+            self._add_uptime(session_id, logged_in_since, ts)
+            self._conn.execute(
+                "UPDATE sessions SET logged_in_since = NULL WHERE id = ?", (session_id,)
+            )
+        # Próbki po ponownym połączeniu nie przedłużają czasu w stanie sprzed rozłączenia
+        for key in [key for key in self._last_samples if key[0] == host]:
+            del self._last_samples[key]
+
+    def record_samples(self, host: str, ts: float, records,
+                       create_times: Optional[Dict[int, float]] = None) -> None:
+        """
+        Kolejkuje zapis próbki telemetrii hosta i doliczenie jej do kubełków.
+
+        Kubełek 1-minutowy jest zbierany w pamięci i zapisywany (jednocześnie do kubełków
+        1-minutowych, 1-godzinnych i 1-dniowych) dopiero po zamknięciu minuty, więc koszt
+        kompaktowania nie rośnie z częstotliwością telemetrii. Zamykanie kubełków i retencja
+        korzystają z zegara agregatora, a czas próbki odbiegający od niego o więcej niż
+        MAX_CLOCK_SKEW (źle ustawiony zegar agenta) jest zastępowany czasem agregatora.
+
+        Args:
+            host: Identyfikator hosta (agenta)
+            ts: Czas próbki (timestamp agenta)
+            records: Rekordy (pid, bytes_delta, num_connections, is_logged_in)
+            create_times: Czas utworzenia procesu według PID (z widoku floty agregatora)
+        """
+        now = time.time()
+        if abs(ts - now) > MAX_CLOCK_SKEW:
+            ts = now
+        self._writes.put((self._record_samples, (host, ts, records, create_times or {}, now)))
+
+    def _record_samples(self, host: str, ts: float, records, create_times: Dict[int, float], now: float) -> None:
+        rows = []
+        for pid, bytes_delta, num_connections, is_logged_in in records:
+            rows.append((ts, host, pid, bytes_delta, num_connections, int(is_logged_in), create_times.get(pid)))
+            key = (host, pid)
+            # Czas od poprzedniej próbki należy do stanu z poprzedniej próbki
+            previous = self._last_samples.get(key)
+            if previous and 0 < ts - previous[0] <= MAX_SAMPLE_GAP:
+                for bucket, seconds in _split_by_bucket(previous[0], ts, RESOLUTIONS[0]):
+                    minute = self._open_buckets.setdefault((host, pid, bucket), _MinuteBucket())
+                    if previous[1]:
+                        minute.logged_in_seconds += seconds
+                    else:
+                        minute.logged_out_seconds += seconds
+            self._last_samples[key] = (ts, bool(is_logged_in))
+            minute_key = (host, pid, _bucket(ts, RESOLUTIONS[0]))
+            self._open_buckets.setdefault(minute_key, _MinuteBucket()).add_sample(bytes_delta, num_connections)
+
+        self._conn.executemany(
+            "INSERT INTO samples (ts, host, pid, bytes_delta, num_connections, is_logged_in, create_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        # Próbka spóźniona (np. z kolejki agenta po ponownym połączeniu) trafia do już
+        # zamkniętej minuty - zostanie dopisana do zapisanego kubełka przy następnym wywołaniu
+        self._flush_buckets(_bucket(now, RESOLUTIONS[0]))
+        if now - self._last_expire >= EXPIRE_INTERVAL:
+            self._expire(now)
+            self._last_expire = now
+
+    def _flush_buckets(self, before: Optional[float]) -> None:
+        """Zapisuje otwarte kubełki 1-minutowe sprzed minuty before (None = wszystkie)"""
+        closed = [key for key in self._open_buckets if before is None or key[2] < before]
+        for key in closed:
+            host, pid, minute = key
+            values = self._open_buckets.pop(key).values()
+            self._conn.executemany(_ROLLUP_UPSERT, [
+                (resolution, _bucket(minute, resolution), host, pid) + values for resolution in RESOLUTIONS
+            ])
+        # Klienci bez próbek od dłuższego czasu (zamknięci) nie są już potrzebni do liczenia czasu w stanie
+        if before is not None:
+            for key in [key for key, (ts, _) in self._last_samples.items() if before - ts > MAX_SAMPLE_GAP]:
+                del self._last_samples[key]
+
+    def _expire(self, now: float) -> None:
+        """Usuwa próbki i kubełki starsze niż retencja ich rozdzielczości"""
+        if self.retention[RAW] > 0:
+            self._conn.execute("DELETE FROM samples WHERE ts < ?", (now - self.retention[RAW],))
+        for resolution in RESOLUTIONS:
+            if self.retention[resolution] > 0:
+                self._conn.execute(
+                    "DELETE FROM telemetry_rollups WHERE resolution = ? AND bucket < ?",
+                    (resolution, _bucket(now - self.retention[resolution], resolution))
+                )
+
+
+def _event_filters(host: Optional[str], pid: Optional[int], event: Optional[str],
+                   since: Optional[float], until: Optional[float]) -> Tuple[str, list]:
+    clauses, params = [], []
+    if host:
+        clauses.append("host = ?")
+        params.append(host)
+    if pid is not None:
+        clauses.append("pid = ?")
+        params.append(pid)
+    if event:
+        clauses.append("event = ?")
+        params.append(event)
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(until)
+    return " AND ".join(clauses) or "1", params
+
+
+def query_events(conn: sqlite3.Connection, host: Optional[str] = None, pid: Optional[int] = None,
+                 event: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+                 after_id: int = 0, limit: int = 100) -> Tuple[Iterator[sqlite3.Row], Optional[int]]:
+    """
+    Wyszukuje zdarzenia (stronicowanie po id - kursor to id ostatniego zdarzenia strony).
+
+    Returns:
+        (iterator wierszy strony, kursor następnej strony lub None jeśli to ostatnia)
+    """
+    where, params = _event_filters(host, pid, event, since, until)
+    where += " AND id > ?"
+    params.append(after_id)
+
+    # Kursor następnej strony: id ostatniego wiersza strony, o ile istnieje kolejny wiersz
+    boundary = conn.execute(
+        f"SELECT id FROM events WHERE {where} ORDER BY id LIMIT 2 OFFSET ?",
+        params + [limit - 1]
+    ).fetchall()
+    next_cursor = boundary[0][0] if len(boundary) == 2 else None
+
+    cursor = conn.execute(
+        f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE {where} ORDER BY id LIMIT ?",
+        params + [limit]
+    )
+    return iter(cursor), next_cursor
+
+
+def query_rollups(conn: sqlite3.Connection, host: Optional[str] = None,
+                  since: Optional[float] = None, until: Optional[float] = None,
+                  now: Optional[float] = None) -> List[dict]:
+    """
+    Zwraca czas zalogowania i liczbę wylogowań na sesję klienta w podanym okresie.
+    Korzysta z dziennych sum (dokładność do dnia) oraz dolicza trwające przedziały zalogowania.
+    """
+    now = now or time.time()
+    since = since if since is not None else 0.0
+    until = until if until is not None else now
+    first_day, last_day = _day(since), _day(max(since, until - 0.001))
+
+    clauses, params = ["r.day >= ?", "r.day <= ?"], [first_day, last_day]
+    if host:
+        clauses.append("s.host = ?")
+        params.append(host)
+    rows = conn.execute(
+        "SELECT s.id, s.host, s.pid, s.create_time, s.window_title, s.logged_in_since, s.closed_at, "
+        "SUM(r.uptime_seconds) AS uptime_seconds, SUM(r.logout_count) AS logout_count "
+        "FROM daily_rollups r JOIN sessions s ON s.id = r.session_id "
+        f"WHERE {' AND '.join(clauses)} GROUP BY s.id",
+        params
+    ).fetchall()
+    results = {row["id"]: dict(row) for row in rows}
+
+    # Sesje, które są aktualnie zalogowane, mają przedział jeszcze niezapisany w sumach
+    open_clauses, open_params = ["logged_in_since IS NOT NULL", "logged_in_since < ?"], [until]
+    if host:
+        open_clauses.append("host = ?")
+        open_params.append(host)
+    for row in conn.execute(
+        "SELECT id, host, pid, create_time, window_title, logged_in_since, closed_at FROM sessions "
+        f"WHERE {' AND '.join(open_clauses)}",
+        open_params
+    ):
+        entry = results.setdefault(row["id"], dict(row, uptime_seconds=0.0, logout_count=0))
+        entry["uptime_seconds"] += max(0.0, min(until, now) - max(since, row["logged_in_since"]))
+
+    for entry in results.values():
+        entry["session_id"] = entry.pop("id")
+    return sorted(results.values(), key=lambda e: (e["host"], e["pid"], e["create_time"]))
+
+
+def choose_resolution(since: float, until: float, step: Optional[float], now: float,
+                      retention: Dict[int, float]) -> int:
+    """
+    Wybiera najgrubszą rozdzielczość, która odpowiada na zapytanie:
+    kubełek nie dłuższy niż step, granice zapytania wyrównane do kubełków
+    i dane z since jeszcze nieusunięte przez retencję.
+    Gdy żadna rozdzielczość nie jest dokładna, zwraca najgrubszą dostępną nie dłuższą niż step.
+
+    Returns:
+        Rozdzielczość w sekundach lub RAW (surowe próbki)
+    """
+    step = step if step is not None else until - since
+
+    def retained(resolution: int) -> bool:
+        return retention.get(resolution, 0) == 0 or since >= now - retention[resolution]
+
+    candidates = [resolution for resolution in reversed(RESOLUTIONS) if resolution <= step and retained(resolution)]
+    for resolution in candidates:
+        if since % resolution == 0 and (until % resolution == 0 or until >= now):
+            return resolution
+    if step < RESOLUTIONS[0] and retained(RAW):
+        return RAW
+    if candidates:
+        return candidates[0]
+    # Nic nie spełnia warunków - najdrobniejsze dane, jakie jeszcze istnieją dla since
+    for resolution in (RAW,) + RESOLUTIONS:
+        if retained(resolution):
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def query_telemetry(conn: sqlite3.Connection, host: Optional[str] = None, pid: Optional[int] = None,
+                    since: Optional[float] = None, until: Optional[float] = None, step: Optional[float] = None,
+                    resolution: Optional[int] = None, retention: Optional[Dict[int, float]] = None,
+                    now: Optional[float] = None) -> Tuple[int, Iterator[sqlite3.Row]]:
+    """
+    Zwraca telemetrię klientów z kubełków o rozdzielczości wybranej przez choose_resolution()
+    (lub podanej w resolution). Surowe próbki są zwracane w tym samym układzie kolumn
+    (jedna próbka = kubełek z samples = 1, bez czasu w stanie, z dodatkową kolumną is_logged_in).
+
+    Bieżąca, niezamknięta minuta nie jest jeszcze widoczna w kubełkach.
+
+    Returns:
+        (rozdzielczość, iterator wierszy z kolumnami TELEMETRY_COLUMNS)
+    """
+    now = now or time.time()
+    since = since if since is not None else 0.0
+    until = until if until is not None else now
+    if resolution is None:
+        resolution = choose_resolution(since, until, step, now, {**DEFAULT_RETENTION, **(retention or {})})
+    elif resolution != RAW and resolution not in RESOLUTIONS:
+        raise ValueError(f"nieznana rozdzielczość {resolution}")
+
+    clauses, params = [], []
+    if host:
+        clauses.append("host = ?")
+        params.append(host)
+    if pid is not None:
+        clauses.append("pid = ?")
+        params.append(pid)
+
+    if resolution == RAW:
+        clauses += ["ts >= ?", "ts < ?"]
+        params += [since, until]
+        cursor = conn.execute(
+            "SELECT 0 AS resolution, ts AS bucket, host, pid, 1 AS samples, bytes_delta AS bytes_sum, "
+            "bytes_delta AS bytes_min, bytes_delta AS bytes_max, num_connections AS connections_sum, "
+            "num_connections AS connections_min, num_connections AS connections_max, "
+            "0.0 AS logged_in_seconds, 0.0 AS logged_out_seconds, is_logged_in "
+            f"FROM samples WHERE {' AND '.join(clauses)} ORDER BY host, pid, ts",
+            params
+        )
+        return RAW, cursor
+
+    # Kubełki zachodzące na przedział since..until
+    clauses += ["resolution = ?", "bucket > ?", "bucket < ?"]
+    params += [resolution, since - resolution, until]
+    cursor = conn.execute(
+        f"SELECT {', '.join(TELEMETRY_COLUMNS)} FROM telemetry_rollups "
+        f"WHERE {' AND '.join(clauses)} ORDER BY host, pid, bucket",
+        params
+    )
+    return resolution, cursor
@@ -0,0 +1,386 @@
+"""
+Typowane zdarzenia klientów i magistrala zdarzeń M2Watcher
+Watcher tylko publikuje zdarzenie, a skutki uboczne (konsola, Discord, dźwięk,
+zapis NDJSON, snapshot dla kanału sterowania) wykonują ujścia we własnych wątkach.
+Każde ujście ma ograniczoną kolejkę z polityką przepełnienia, więc wolne ujście
+(np. Discord albo dźwięk czekający na Enter) nigdy nie spowalnia wykrywania
+"""
+import collections
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+try:
+    import backend
+except ImportError:
+    backend = None
+
+# Polityki przepełnienia kolejki ujścia
+DROP_OLDEST = "drop_oldest"  # Nowe zdarzenie wypiera najstarsze oczekujące
+DROP_NEWEST = "drop_newest"  # Nowe zdarzenie jest odrzucane
+
+DEFAULT_QUEUE_SIZE = 256
+# Jak długo przy zatrzymaniu czekać na opróżnienie kolejek (np. wysłanie ostatnich powiadomień)
+CLOSE_TIMEOUT = 3.0
+# Wielowierszowe wypisywanie (status klientów) i komunikaty ujścia konsoli nie mogą się przeplatać
+CONSOLE_LOCK = threading.Lock()
+
+
+class ClientInfo(NamedTuple):
+    """Niezmienna kopia stanu klienta z chwili zdarzenia"""
+    pid: int
+    name: str
+    create_time: float
+    window_title: str
+    is_logged_in: bool
+    num_connections: int
+    is_hung: bool
+    description: str  # str(klient) z chwili zdarzenia
+
+    def __str__(self) -> str:
+        return self.description
+
+    @classmethod
+    def from_client(cls, client) -> "ClientInfo":
+        return cls(client.pid, client.name, client.create_time, client.window_title or "",
+                   client.is_logged_in, client.num_connections, client.is_hung, str(client))
+
+
+class ClientEvent:
+    """Zdarzenie klienta - name to nazwa używana w protokole, bazie zdarzeń i kanale sterowania"""
+
+    __slots__ = ("client", "timestamp")
+    name = ""
+
+    def __init__(self, client: ClientInfo, timestamp: Optional[float] = None):
+        self.client = client
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def details(self) -> dict:
+        """Dodatkowe pola zdarzenia (dla zapisu NDJSON)"""
+        return {}
+
+
+class ClientDiscovered(ClientEvent):
+    __slots__ = ()
+    name = "discovered"
+
+
+class LoggedOut(ClientEvent):
+    __slots__ = ()
+    name = "logout"
+
+
+class Reconnected(ClientEvent):
+    __slots__ = ()
+    name = "reconnect"
+
+
+class Closed(ClientEvent):
+    __slots__ = ("reason",)
+    name = "closed"
+
+    def __init__(self, client: ClientInfo, reason: str, timestamp: Optional[float] = None):
+        super().__init__(client, timestamp)
+        self.reason = reason
+
+    def details(self) -> dict:
+        return {"reason": self.reason}
+
+
+class Crashed(ClientEvent):
+    __slots__ = ("exit_code",)
+    name = "crashed"
+
+    def __init__(self, client: ClientInfo, exit_code: Optional[int], timestamp: Optional[float] = None):
+        super().__init__(client, timestamp)
+        self.exit_code = exit_code
+
+    def details(self) -> dict:
+        return {"exit_code": self.exit_code}
+
+
+class Hung(ClientEvent):
+    __slots__ = ()
+    name = "hung"
+
+
+class Responsive(ClientEvent):
+    __slots__ = ()
+    name = "responsive"
+
+
+class Unstable(ClientEvent):
+    """Stan zalogowania zmienia się zbyt często - dalsze zmiany bez powiadomień"""
+    __slots__ = ("transitions",)
+    name = "unstable"
+
+    def __init__(self, client: ClientInfo, transitions: int, timestamp: Optional[float] = None):
+        super().__init__(client, timestamp)
+        self.transitions = transitions
+
+    def details(self) -> dict:
+        return {"transitions": self.transitions}
+
+
+class Stable(ClientEvent):
+    """Niestabilny klient uspokoił się - podsumowanie pominiętych zmian"""
+    __slots__ = ("suppressed",)
+    name = "stable"
+
+    def __init__(self, client: ClientInfo, suppressed: int, timestamp: Optional[float] = None):
+        super().__init__(client, timestamp)
+        self.suppressed = suppressed
+
+    def details(self) -> dict:
+        return {"suppressed": self.suppressed}
+
+
+EVENT_TYPES = {cls.name: cls for cls in (ClientDiscovered, LoggedOut, Reconnected, Closed, Crashed, Hung, Responsive,
+                                         Unstable, Stable)}
+
+
+class Sink:
+    """Ujście zdarzeń - handle() wywoływane w wątku ujścia, po kolei"""
+
+    name = "ujście"
+    policy = DROP_OLDEST
+    queue_size: Optional[int] = None  # None = rozmiar kolejki magistrali
+    report_drops = True  # Czy ostrzegać w konsoli o pominiętych zdarzeniach
+
+    def handle(self, event: ClientEvent) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _SinkWorker:
+    """Ograniczona kolejka i wątek jednego ujścia (wątek startuje przy pierwszym zdarzeniu)"""
+
+    def __init__(self, sink: Sink, queue_size: int, policy: str):
+        self.sink = sink
+        self.policy = policy
+        self.queue_size = max(1, queue_size)
+        self.queue: Deque[ClientEvent] = collections.deque()
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+
+    def offer(self, event: ClientEvent) -> None:
+        """Dodaje zdarzenie do kolejki bez blokowania"""
+        with self._condition:
+            if self._closing:
+                return
+            if len(self.queue) >= self.queue_size:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                self.queue.popleft()
+            self.queue.append(event)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name=f"M2Watcher-sink-{self.sink.name}")
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self.queue and not self._closing:
+                    self._condition.wait()
+                if not self.queue:
+                    return
+                event = self.queue.popleft()
+                dropped = self.dropped
+            if dropped != self._reported_dropped:
+                if self.sink.report_drops:
+                    with CONSOLE_LOCK:
+                        print(f"[{datetime.now().strftime('%H:%M:%S')}] [ZDARZENIA] Ujście '{self.sink.name}' nie nadąża - "
+                              f"pominięto {dropped - self._reported_dropped} zdarzeń")
+                self._reported_dropped = dropped
+            try:
+                self.sink.handle(event)
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Błąd ujścia zdarzeń '{self.sink.name}' ({event.name}): {e}")
+
+    def close(self, deadline: float) -> None:
+        """Kończy wątek po opróżnieniu kolejki (najpóźniej do deadline)"""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+        try:
+            self.sink.close()
+        except Exception:
+            pass
+
+
+class EventBus:
+    """Rozsyła zdarzenia do ujść - publish() nigdy nie blokuje"""
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._workers: List[_SinkWorker] = []
+
+    def add_sink(self, sink: Sink, queue_size: Optional[int] = None, policy: Optional[str] = None) -> Sink:
+        """
+        Dodaje ujście.
+
+        Args:
+            sink: Ujście zdarzeń
+            queue_size: Rozmiar kolejki (None = sink.queue_size lub rozmiar magistrali)
+            policy: DROP_OLDEST lub DROP_NEWEST (None = sink.policy)
+        """
+        queue_size = queue_size or sink.queue_size or self.queue_size
+        self._workers.append(_SinkWorker(sink, queue_size, policy or sink.policy))
+        return sink
+
+    @property
+    def sinks(self) -> List[Sink]:
+        return [worker.sink for worker in self._workers]
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Liczba zdarzeń oczekujących w kolejce każdego ujścia"""
+        return {worker.sink.name: len(worker.queue) for worker in self._workers}
+
+    def dropped(self) -> Dict[str, int]:
+        """Liczba pominiętych zdarzeń na ujście"""
+        return {worker.sink.name: worker.dropped for worker in self._workers}
+
+    def publish(self, event: ClientEvent) -> None:
+        for worker in self._workers:
+            worker.offer(event)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT) -> None:
+        """Zatrzymuje ujścia, czekając łącznie najwyżej timeout sekund na opróżnienie kolejek"""
+        deadline = time.monotonic() + timeout
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close(deadline)
+
+
+def _format_clock(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+
+class ConsoleSink(Sink):
+    """Komunikaty zdarzeń w konsoli"""
+
+    name = "konsola"
+
+    def handle(self, event: ClientEvent) -> None:
+        client = event.client
+        if isinstance(event, ClientDiscovered):
+            message = f"[OK] Nowy klient wykryty: {client}"
+        elif isinstance(event, LoggedOut):
+            message = f"[WYLOGOWANY] Wylogowanie wykryte (ekran logowania): {client}"
+        elif isinstance(event, Reconnected):
+            message = f"[ZALOGOWANY] Ponowne zalogowanie: {client}"
+        elif isinstance(event, Closed):
+            message = f"[UWAGA] Klient zamknięty ({event.reason}): {client}"
+        elif isinstance(event, Crashed):
+            exit_code = backend.format_exit_code(event.exit_code) if backend else f"kod wyjścia {event.exit_code}"
+            message = f"[CRASH] Crash klienta ({exit_code}): {client}"
+        elif isinstance(event, Hung):
+            message = f"[ZAWIESZONY] Klient nie odpowiada: {client}"
+        elif isinstance(event, Responsive):
+            message = f"[OK] Klient znowu odpowiada: {client}"
+        elif isinstance(event, Unstable):
+            message = (f"[NIESTABILNY] Stan zalogowania zmienił się {event.transitions} razy w krótkim czasie - "
+                       f"kolejne zmiany bez powiadomień: {client}")
+        elif isinstance(event, Stable):
+            message = f"[STABILNY] Połączenie ustabilizowane (pominięte zmiany stanu: {event.suppressed}): {client}"
+        else:
+            return
+        with CONSOLE_LOCK:
+            print(f"[{_format_clock(event.timestamp)}] {message}")
+
+
+class DiscordSink(Sink):
+    """Powiadomienia przez NotificationManager watchera (odczytywany przy każdym zdarzeniu)"""
+
+    name = "discord"
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def handle(self, event: ClientEvent) -> None:
+        manager = self.watcher.notification_manager
+        if manager is None:
+            return
+        if isinstance(event, LoggedOut):
+            manager.notify_logout(event.client)
+        elif isinstance(event, Reconnected):
+            manager.notify_reconnect(event.client)
+        elif isinstance(event, Closed):
+            manager.notify_client_closed(event.client)
+        elif isinstance(event, Crashed):
+            manager.notify_client_crashed(event.client)
+        elif isinstance(event, Hung):
+            manager.notify_client_hung(event.client)
+        elif isinstance(event, Unstable):
+            manager.notify_client_unstable(event.client, event.transitions)
+        elif isinstance(event, Stable):
+            manager.notify_client_stable(event.client, event.suppressed)
+
+
+class SoundSink(Sink):
+    """Dźwięk alertu - przy odtwarzaniu do naciśnięcia Enter czeka najwyżej jeden kolejny alert"""
+
+    name = "dźwięk"
+    policy = DROP_NEWEST
+    queue_size = 1
+    report_drops = False  # Łączenie alertów w czasie odtwarzania jest zamierzone
+
+    ALERT_EVENTS = (LoggedOut, Closed, Crashed, Hung, Unstable)
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def handle(self, event: ClientEvent) -> None:
+        if not isinstance(event, self.ALERT_EVENTS):
+            return
+        wait_for_input = self.watcher.sound_wait_for_input
+        if self.watcher.play_logout_sound(wait_for_input=wait_for_input) and not wait_for_input:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] [DŹWIĘK] Odtworzono powiadomienie dźwiękowe")
+
+
+class RecorderSink(Sink):
+    """Zapisuje zdarzenia do pliku NDJSON (jeden obiekt JSON na linię)"""
+
+    name = "zapis"
+    policy = DROP_NEWEST  # Zachowaj ciągłość zapisanej historii, odrzucaj nadmiarowe nowe
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def handle(self, event: ClientEvent) -> None:
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        client = event.client
+        record = {
+            "timestamp": event.timestamp,
+            "event": event.name,
+            "pid": client.pid,
+            "create_time": client.create_time,
+            "name": client.name,
+            "window_title": client.window_title,
+            "is_logged_in": client.is_logged_in,
+            "num_connections": client.num_connections,
+            "is_hung": client.is_hung,
+            **event.details(),
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
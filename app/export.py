@@ -0,0 +1,178 @@
+"""
+Eksport kolumnowy telemetrii i zdarzeń klientów (main.py --export) do analizy offline
+(pandas, DuckDB, Polars). Wiersze z events.db agregatora są czytane porcjami i zapisywane
+jako kolejne partie (row groups) pliku Parquet lub Arrow IPC, więc zużycie pamięci nie
+zależy od rozmiaru eksportu. pyarrow jest opcjonalną zależnością importowaną dopiero tutaj
+"""
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from event_store import EVENTS_DB
+
+TABLES = ("samples", "events")
+FORMATS = ("parquet", "arrow")
+DEFAULT_CHUNK_ROWS = 65536
+
+# Rozszerzenia plików rozpoznawane, gdy format nie jest podany
+_FORMAT_SUFFIXES = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+# Kolumny SQL (czas jako liczba mikrosekund) w kolejności kolumn schematu
+_QUERIES = {
+    "samples": (
+        "SELECT CAST(ROUND(ts * 1000000) AS INTEGER), host, pid, "
+        "CAST(ROUND(create_time * 1000000) AS INTEGER), bytes_delta, num_connections, is_logged_in "
+        "FROM samples WHERE {where} ORDER BY ts"
+    ),
+    "events": (
+        "SELECT id, CAST(ROUND(ts * 1000000) AS INTEGER), host, session_id, pid, event, "
+        "is_logged_in, num_connections, window_title FROM events WHERE {where} ORDER BY id"
+    ),
+}
+
+
+class ExportError(Exception):
+    """Eksport nie może zostać wykonany (brak pyarrow, brak bazy, nieznany format)"""
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401 - ładuje podmoduł
+    except ImportError:
+        raise ExportError("Eksport wymaga biblioteki pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def schema(table: str, pa=None):
+    """Schemat Arrow eksportowanej tabeli"""
+    pa = pa or _import_pyarrow()
+    timestamp = pa.timestamp("us", tz="UTC")
+    if table == "samples":
+        return pa.schema([
+            ("timestamp", timestamp),
+            ("host", pa.string()),
+            ("pid", pa.uint32()),
+            ("create_time", timestamp),
+            ("bytes_delta", pa.int64()),
+            ("num_connections", pa.uint16()),
+            ("is_logged_in", pa.bool_()),
+        ])
+    return pa.schema([
+        ("id", pa.int64()),
+        ("timestamp", timestamp),
+        ("host", pa.string()),
+        ("session_id", pa.int64()),
+        ("pid", pa.uint32()),
+        ("event", pa.string()),
+        ("is_logged_in", pa.bool_()),
+        ("num_connections", pa.uint16()),
+        ("window_title", pa.string()),
+    ])
+
+
+def detect_format(path: Path, output_format: Optional[str] = None) -> str:
+    """Format podany jawnie albo wynikający z rozszerzenia pliku"""
+    if output_format:
+        if output_format not in FORMATS:
+            raise ExportError(f"Nieznany format eksportu: {output_format}")
+        return output_format
+    try:
+        return _FORMAT_SUFFIXES[path.suffix.lower()]
+    except KeyError:
+        raise ExportError(f"Nie można ustalić formatu z rozszerzenia '{path.suffix}' - podaj --export-format")
+
+
+def _batch(pa, table_schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(table_schema, columns):
+        if pa.types.is_boolean(field.type):
+            # SQLite przechowuje wartości logiczne jako 0/1
+            arrays.append(pa.array(values, pa.int8()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=table_schema)
+
+
+def _open_writer(pa, path: Path, table_schema, output_format: str):
+    if output_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportError("Ta instalacja pyarrow nie obsługuje Parquet - użyj formatu arrow")
+        return pq.ParquetWriter(str(path), table_schema, compression="zstd")
+    return pa.ipc.new_file(str(path), table_schema)
+
+
+def export_table(table: str, path: Path, output_format: Optional[str] = None, db_path: Path = EVENTS_DB,
+                 host: Optional[str] = None, pid: Optional[int] = None, since: Optional[float] = None,
+                 until: Optional[float] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """
+    Eksportuje próbki telemetrii ("samples") lub zdarzenia klientów ("events") do pliku.
+    Plik jest zapisywany pod nazwą tymczasową i podmieniany dopiero po udanym eksporcie.
+
+    Args:
+        table: "samples" lub "events"
+        path: Plik wynikowy
+        output_format: "parquet", "arrow" lub None (z rozszerzenia pliku)
+        db_path: Baza zdarzeń agregatora
+        host, pid, since, until: Filtry wierszy (czas: timestamp, since włącznie, until wyłącznie)
+        chunk_rows: Liczba wierszy czytanych i zapisywanych naraz
+
+    Returns:
+        Liczba wyeksportowanych wierszy
+    """
+    if table not in TABLES:
+        raise ExportError(f"Nieznana tabela eksportu: {table}")
+    path = Path(path)
+    output_format = detect_format(path, output_format)
+    pa = _import_pyarrow()
+    if not Path(db_path).exists():
+        raise ExportError(f"Brak bazy zdarzeń: {db_path}")
+
+    clauses, params = [], []
+    if host:
+        clauses.append("host = ?")
+        params.append(host)
+    if pid is not None:
+        clauses.append("pid = ?")
+        params.append(pid)
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(until)
+
+    table_schema = schema(table, pa)
+    tmp_path = path.with_name(path.name + ".tmp")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    count = 0
+    try:
+        cursor = conn.execute(_QUERIES[table].format(where=" AND ".join(clauses) or "1"), params)
+        writer = _open_writer(pa, tmp_path, table_schema, output_format)
+        try:
+            while True:
+                rows = cursor.fetchmany(max(1, chunk_rows))
+                if not rows:
+                    break
+                writer.write_batch(_batch(pa, table_schema, rows))
+                count += len(rows)
+        finally:
+            writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    finally:
+        conn.close()
+    return count
@@ -0,0 +1,355 @@
+"""
+Test obciążeniowy M2Watcher (Linux)
+Uruchamia N prawdziwych procesów o nazwie metin2client.exe, każdy z połączeniem TCP
+do lokalnego serwera gry (atrapy), i mierzy na prawdziwej pętli Metin2Watcher (psutil)
+opóźnienie wykrycia zdarzeń oraz koszt CPU cyklu w zależności od N.
+
+Scenariusz dla każdego N:
+  1. start klientów i wykrycie wszystkich przez watcher
+  2. bezczynność - czas i koszt CPU cykli
+  3. zmiana adresu serwera (nowe połączenie, potem zamknięcie starego) - nie może dać wylogowania
+  4. zerwanie połączeń przez serwer -> wylogowanie, ponowne połączenie -> zalogowanie
+  5. zakończenie procesów (kod 0 i SIGABRT) -> zamknięcie / crash
+
+Użycie:
+  python loadtest.py --clients 10,50,100 --interval 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import detectors
+import probe
+
+# Kod procesu klienta: łączy się z serwerem, przedstawia PID-em, czyta dane serwera
+# (jak klient gry) i wykonuje komendy z stdin: "connect PORT" (nowe połączenie,
+# potem zamknięcie starego), "exit KOD" i "crash" (SIGABRT)
+CLIENT_CODE = r"""
+import os, socket, sys, threading
+
+def connect(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(f"{os.getpid()}\n".encode())
+    threading.Thread(target=read, args=(sock,), daemon=True).start()
+    return sock
+
+def read(sock):
+    try:
+        while sock.recv(4096):
+            pass
+    except OSError:
+        pass
+    sock.close()
+
+current = connect(int(sys.argv[1]))
+print("ready", flush=True)
+for line in sys.stdin:
+    command, _, argument = line.strip().partition(" ")
+    if command == "connect":
+        previous, current = current, connect(int(argument))
+        previous.close()
+    elif command == "exit":
+        os._exit(int(argument))
+    elif command == "crash":
+        os.abort()
+"""
+
+HEARTBEAT_INTERVAL = 1.0
+
+
+class StubGameServer:
+    """Atrapa serwera gry na kilku portach - przyjmuje połączenia, wysyła heartbeat i zrywa je na żądanie"""
+
+    def __init__(self, ports: int = 2):
+        self.port_count = ports
+        self.ports: List[int] = []
+        # PID klienta -> strumienie jego połączeń
+        self.connections: Dict[int, List[asyncio.StreamWriter]] = {}
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stub-server")
+
+    def start(self) -> None:
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        for _ in range(self.port_count):
+            server = self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+            self.ports.append(server.sockets[0].getsockname()[1])
+        self._loop.create_task(self._heartbeat())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            pid = int(await reader.readline())
+            self.connections.setdefault(pid, []).append(writer)
+            await reader.read()  # Do zamknięcia przez klienta
+        except (ValueError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            return  # Zamykanie serwera - połączenie zamyka _shutdown
+        for writers in self.connections.values():
+            if writer in writers:
+                writers.remove(writer)
+        writer.close()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for writers in list(self.connections.values()):
+                for writer in writers:
+                    if not writer.is_closing():
+                        writer.write(b"ping\n")
+
+    def drop(self, pid: int) -> None:
+        """Zrywa wszystkie połączenia klienta (od strony serwera)"""
+        def close_all():
+            for writer in self.connections.pop(pid, []):
+                writer.close()
+        self._loop.call_soon_threadsafe(close_all)
+
+    async def _shutdown(self) -> None:
+        writers = [writer for pid_writers in self.connections.values() for writer in pid_writers]
+        self.connections.clear()
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+
+
+class FakeClient:
+    """Proces klienta metin2client.exe"""
+
+    def __init__(self, executable: str, port: int):
+        self.process = subprocess.Popen([executable, "-c", CLIENT_CODE, str(port)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.pid = self.process.pid
+
+    def wait_ready(self) -> None:
+        self.process.stdout.readline()
+
+    def send(self, command: str) -> None:
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+
+    def kill(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class EventRecorder:
+    """Czas (monotoniczny) pierwszego wystąpienia zdarzenia klienta od ostatniego reset()"""
+
+    def __init__(self):
+        self.times: Dict[Tuple[int, str], float] = {}
+        self._condition = threading.Condition()
+
+    def __call__(self, event: str, client) -> None:
+        with self._condition:
+            self.times.setdefault((client.pid, event), time.monotonic())
+            self._condition.notify_all()
+
+    def reset(self) -> None:
+        with self._condition:
+            self.times.clear()
+
+    def count(self, event: str) -> int:
+        return sum(1 for _, name in self.times if name == event)
+
+    def wait(self, pids: List[int], events: Tuple[str, ...], timeout: float) -> Dict[int, Optional[float]]:
+        """Czeka na jedno ze zdarzeń dla każdego PID - zwraca czas zdarzenia (None = brak w limicie)"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                found = {pid: min((self.times[(pid, event)] for event in events if (pid, event) in self.times),
+                                  default=None) for pid in pids}
+                remaining = deadline - time.monotonic()
+                if all(value is not None for value in found.values()) or remaining <= 0:
+                    return found
+                self._condition.wait(remaining)
+
+
+class WatcherThread:
+    """Pętla prawdziwego Metin2Watcher w osobnym wątku z pomiarem czasu i CPU cykli"""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.ticks: List[Tuple[float, float]] = []  # (czas, CPU wątku) jednego cyklu
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="watcher")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started, cpu_started = time.perf_counter(), time.thread_time()
+            self.watcher.tick(show_status=False)
+            self.ticks.append((time.perf_counter() - started, time.thread_time() - cpu_started))
+            self._stop.wait(self.watcher.check_interval)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def take_ticks(self) -> List[Tuple[float, float]]:
+        ticks, self.ticks = self.ticks, []
+        return ticks
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _latencies(found: Dict[int, Optional[float]], started: float) -> Tuple[List[float], int]:
+    values = [value - started for value in found.values() if value is not None]
+    return values, sum(1 for value in found.values() if value is None)
+
+
+def _format_latency(values: List[float], missed: int) -> str:
+    if not values:
+        return f"brak ({missed} nie wykryto)"
+    text = f"śr. {statistics.mean(values):.2f} s, maks. {max(values):.2f} s"
+    return text + (f", {missed} nie wykryto" if missed else "")
+
+
+def _format_ticks(ticks: List[Tuple[float, float]]) -> str:
+    if not ticks:
+        return "brak cykli"
+    durations = sorted(duration for duration, _ in ticks)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    cpu = statistics.mean(cpu for _, cpu in ticks)
+    return (f"{len(ticks)} cykli, czas śr. {statistics.mean(durations) * 1000:.1f} ms "
+            f"(p95 {p95 * 1000:.1f} ms), CPU śr. {cpu * 1000:.1f} ms/cykl")
+
+
+def detection_bound(watcher, event: str) -> float:
+    """Najdłuższe oczekiwane opóźnienie wykrycia wylogowania ("logout") lub zalogowania ("reconnect")"""
+    bound = 2 * watcher.check_interval
+    if probe.IO_BYTES_INCLUDE_NETWORK and watcher.probe_recheck_interval > 0:
+        # Przy stabilnych tanich sygnałach połączenia są sprawdzane co probe_recheck_interval
+        bound += watcher.probe_recheck_interval
+    bound += (watcher.flap_policy.hysteresis - 1) * watcher.check_interval + watcher.flap_policy.min_dwell
+    if event == "logout":
+        bound += detectors.ConnectionTimeoutDetector.NO_CONNECTIONS_TIMEOUT
+    return bound
+
+
+def _timeout_note(watcher, event: str, timeout: float) -> str:
+    bound = detection_bound(watcher, event)
+    if timeout >= bound:
+        return ""
+    return f" - uwaga: --timeout {timeout:.1f} s jest krótszy niż oczekiwany czas wykrycia (do {bound:.1f} s)"
+
+
+def run_scenario(count: int, executable: str, interval: float, actions: int, timeout: float) -> List[str]:
+    """Wykonuje scenariusz dla count klientów i zwraca linie raportu"""
+    from config import Config
+    from m2watcher import Metin2Watcher
+
+    server = StubGameServer()
+    server.start()
+    clients = [FakeClient(executable, server.ports[0]) for _ in range(count)]
+    report = [f"=== {count} klientów ==="]
+    try:
+        for client in clients:
+            client.wait_ready()
+        # Konfiguracja tylko do odczytu, bez dźwięku, kanału sterowania i zapisu stanu
+        watcher = Metin2Watcher(check_interval=interval, sound_enabled=False, config=Config(create=False),
+                                probe_recheck_interval=10.0, hung_timeout=0.0)
+        recorder = EventRecorder()
+        watcher.listeners.append(recorder)
+        loop = WatcherThread(watcher)
+        pids = [client.pid for client in clients]
+
+        started = time.monotonic()
+        loop.start()
+        report.append("Wykrycie: " + _format_latency(*_latencies(recorder.wait(pids, ("discovered",), timeout), started)))
+        loop.take_ticks()
+        time.sleep(max(5 * interval, 2.0))
+        report.append("Bezczynność: " + _format_ticks(loop.take_ticks()))
+
+        sample = clients[:actions]
+        sample_pids = [client.pid for client in sample]
+        recorder.reset()
+        for client in sample:
+            client.send(f"connect {server.ports[1]}")
+        time.sleep(timeout / 2)
+        report.append(f"Zmiana adresu serwera: {recorder.count('logout')} fałszywych wylogowań na {len(sample)}")
+
+        recorder.reset()
+        started = time.monotonic()
+        for pid in sample_pids:
+            server.drop(pid)
+        logout_times, logout_missed = _latencies(recorder.wait(sample_pids, ("logout",), timeout), started)
+        report.append("Wylogowanie: " + _format_latency(logout_times, logout_missed)
+                      + _timeout_note(watcher, "logout", timeout))
+
+        recorder.reset()
+        started = time.monotonic()
+        for client in sample:
+            client.send(f"connect {server.ports[0]}")
+        report.append("Zalogowanie: " + _format_latency(*_latencies(recorder.wait(sample_pids, ("reconnect",), timeout), started))
+                      + _timeout_note(watcher, "reconnect", timeout)
+                      # Klient bez wykrytego wylogowania jest nadal zalogowany - nie będzie ponownego zalogowania
+                      + (f" - {logout_missed} bez wykrytego wcześniej wylogowania" if logout_missed else ""))
+        report.append("Zdarzenia: " + _format_ticks(loop.take_ticks()))
+
+        recorder.reset()
+        started = time.monotonic()
+        for index, client in enumerate(sample):
+            client.send("crash" if index % 2 else "exit 0")
+        report.append("Zamknięcie: " + _format_latency(
+            *_latencies(recorder.wait(sample_pids, ("closed", "crashed"), timeout), started)
+        ) + f" (crash: {recorder.count('crashed')})")
+        loop.stop()
+        # Zwalnia też monitor zakończeń i wykrywanie startu przed kolejnym N
+        watcher.shutdown()
+    finally:
+        for client in clients:
+            client.kill()
+        server.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Test obciążeniowy M2Watcher (Linux)")
+    parser.add_argument("--clients", default="10,50,100", help="Liczby klientów oddzielone przecinkami")
+    parser.add_argument("--interval", type=float, default=0.5, help="check_interval watchera (s)")
+    parser.add_argument("--actions", type=int, default=10, help="Ilu klientów wykonuje scenariusz zdarzeń")
+    parser.add_argument("--timeout", type=float, default=20.0, help="Limit czekania na zdarzenie (s)")
+    args = parser.parse_args()
+    if platform.system() != "Linux":
+        parser.error("test obciążeniowy działa tylko w systemie Linux")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Interpreter pod nazwą klienta - psutil widzi proces jako metin2client.exe
+        executable = os.path.join(directory, "metin2client.exe")
+        os.symlink(sys.executable, executable)
+        for count in (int(value) for value in args.clients.split(",")):
+            # Komunikaty watchera pominięte - wypisywany jest tylko raport
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                report = run_scenario(count, executable, args.interval, args.actions, args.timeout)
+            print("\n".join(report) + "\n", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,7 @@ import time
 import platform
 import threading
 import sys
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass
+from typing import List, Dict, Optional, Set, Tuple, Callable, FrozenSet
 from datetime import datetime
 
 # Import modułów aplikacji
@@ -21,6 +20,29 @@ except ImportError:
     Config = None
     NotificationManager = None
 
+import detectors
+import diagnostics
+import events
+import matcher
+import metrics
+import probe
+import stability
+
+try:
+    import state_snapshot
+except ImportError:
+    state_snapshot = None
+
+try:
+    import backend
+except ImportError:
+    backend = None
+
+try:
+    import control
+except ImportError:
+    control = None
+
 # Import dla dźwięku
 try:
     if platform.system() == 'Windows':
@@ -40,56 +62,101 @@ except ImportError:
     print("Ostrzeżenie: win32gui nie jest dostępne. Wykrywanie wylogowań może być ograniczone.")
 
 
-@dataclass
 class Metin2Client:
-    """Reprezentuje klienta Metin2"""
-    pid: int
-    name: str
-    window_title: str
-    start_time: datetime
-    last_check: datetime
-    is_logged_in: bool = True
-    network_activity_history: List[int] = None  # Historia aktywności sieciowej
-    last_network_bytes: int = 0
-    num_connections: int = 0  # Liczba aktywnych połączeń sieciowych
-    window_handle: Optional[int] = None  # Handle do głównego okna gry
-    window_size: Optional[Tuple[int, int]] = None  # Rozmiar okna (width, height)
-    no_connections_since: Optional[datetime] = None  # Czas kiedy połączenia spadły do 0
-    
-    def __post_init__(self):
-        if self.network_activity_history is None:
-            self.network_activity_history = []
+    """
+    Reprezentuje klienta Metin2.
+    Zwarty rekord: __slots__ zamiast __dict__, internowana nazwa procesu (wspólna dla
+    wszystkich klientów) i czasy jako sekundy time.monotonic() zamiast obiektów datetime.
+    Tekst do wyświetlenia jest budowany dopiero przy str() i zapamiętywany,
+    dopóki nie zmienią się wyświetlane pola.
+    """
+    
+    __slots__ = (
+        "pid", "name", "window_title", "start_time", "last_check", "is_logged_in",
+        "network_activity_history", "last_network_bytes", "num_connections", "window_handle",
+        "window_size", "no_connections_since", "create_time", "last_cpu_time", "last_full_probe",
+        "probe_signature", "detector_results", "remote_endpoints", "lost_endpoints",
+        "endpoint_event", "is_hung", "stalled_since", "login_state", "_display",
+    )
+    
+    def __init__(self, pid: int, name: str, window_title: str,
+                 start_time: Optional[float] = None, last_check: Optional[float] = None,
+                 is_logged_in: bool = True, network_activity_history: Optional[List[int]] = None,
+                 last_network_bytes: int = 0, num_connections: int = 0,
+                 window_handle: Optional[int] = None, window_size: Optional[Tuple[int, int]] = None,
+                 no_connections_since: Optional[float] = None, create_time: float = 0.0,
+                 last_cpu_time: float = 0.0, last_full_probe: float = 0.0,
+                 probe_signature: Optional[Tuple[bool, bool]] = None,
+                 detector_results: Optional[Dict[str, Optional[bool]]] = None,
+                 remote_endpoints: FrozenSet[Tuple[str, int]] = frozenset(),
+                 lost_endpoints: FrozenSet[Tuple[str, int]] = frozenset(),
+                 endpoint_event: Optional[str] = None, is_hung: bool = False,
+                 stalled_since: Optional[float] = None):
+        now = time.monotonic()
+        self.pid = pid
+        self.name = sys.intern(name)
+        self.window_title = window_title
+        self.start_time = start_time if start_time is not None else now  # Czas (monotoniczny) wykrycia klienta
+        self.last_check = last_check if last_check is not None else now  # Czas (monotoniczny) ostatniego sprawdzenia
+        self.is_logged_in = is_logged_in
+        self.network_activity_history = network_activity_history if network_activity_history is not None else []  # Historia aktywności sieciowej
+        self.last_network_bytes = last_network_bytes
+        self.num_connections = num_connections  # Liczba aktywnych połączeń sieciowych
+        self.window_handle = window_handle  # Handle do głównego okna gry
+        self.window_size = window_size  # Rozmiar okna (width, height)
+        self.no_connections_since = no_connections_since  # Czas (monotoniczny) kiedy połączenia spadły do 0
+        self.create_time = create_time  # Czas utworzenia procesu (razem z PID identyfikuje proces)
+        self.last_cpu_time = last_cpu_time  # Czas CPU procesu (user + system) przy ostatnim sprawdzeniu
+        self.last_full_probe = last_full_probe  # Czas (monotoniczny) ostatniego sprawdzenia połączeń i okna
+        self.probe_signature = probe_signature  # Ostatni stan tanich sygnałów (sieć, CPU)
+        self.detector_results = detector_results if detector_results is not None else {}  # Ostatnie wyniki detektorów wylogowania
+        self.remote_endpoints = remote_endpoints  # Zdalne adresy połączeń ESTABLISHED
+        self.lost_endpoints = lost_endpoints  # Adresy sprzed utraty wszystkich połączeń
+        self.endpoint_event = endpoint_event  # Ostatnia klasyfikacja zmiany adresów (np. "channel_switch")
+        self.is_hung = is_hung  # Klient nie odpowiada (okno nie przetwarza komunikatów lub stoi czas CPU)
+        self.stalled_since = stalled_since  # Czas (monotoniczny) od kiedy klient wygląda na zawieszonego
+        self.login_state: Optional[stability.LoginStateMachine] = None  # Histereza i wykrywanie niestabilności
+        self._display: Optional[Tuple[tuple, str]] = None
     
     def __str__(self):
+        key = (self.window_title, self.is_logged_in, self.num_connections, self.is_hung)
+        if self._display is not None and self._display[0] == key:
+            return self._display[1]
         status = "Zalogowany" if self.is_logged_in else "Wylogowany"
         connections_info = f"({self.num_connections} połączeń)" if self.num_connections > 0 else "(brak połączeń)"
-        return f"PID: {self.pid} | {self.name} | {self.window_title} | {status} {connections_info}"
+        hung_info = " | Nie odpowiada" if self.is_hung else ""
+        text = f"PID: {self.pid} | {self.name} | {self.window_title} | {status} {connections_info}{hung_info}"
+        self._display = (key, text)
+        return text
+    
+    def __repr__(self):
+        return f"Metin2Client(pid={self.pid}, name={self.name!r}, is_logged_in={self.is_logged_in})"
 
 
 class Metin2Watcher:
     """Główna klasa monitorująca klienty Metin2"""
     
-    # Możliwe nazwy procesów Metin2
-    METIN2_PROCESS_NAMES = [
-        'metin2client.exe',
-    ]
-    
-    # Tytuły okien wskazujące na ekran logowania/wylogowanie
-    LOGIN_SCREEN_INDICATORS = [
-        'metin2',
-        'login',
-        'logowanie',
-        'select server',
-        'wybierz serwer'
-    ]
-    
     def _format_time(self) -> str:
         """Zwraca sformatowany czas w formacie HH:MM:SS"""
         return datetime.now().strftime('%H:%M:%S')
     
     def __init__(self, check_interval: float = 2.0, network_check_samples: int = 5, 
                  network_threshold: int = 1000, debug: bool = False, sound_enabled: bool = True,
-                 sound_wait_for_input: bool = True, config: Optional[Config] = None):
+                 sound_wait_for_input: bool = True, config: Optional[Config] = None,
+                 snapshot_interval: float = 0.0, exit_detection: bool = True,
+                 idle_check_interval: float = 0.0, probe_recheck_interval: float = 0.0,
+                 probe_cpu_threshold: float = 0.02, detector_names: Optional[List[str]] = None,
+                 detector_budget_ms: float = 50.0, hung_timeout: float = 0.0,
+                 control_enabled: bool = False, control_address: str = "",
+                 process_names: Optional[List[str]] = None, process_exe_patterns: Optional[List[str]] = None,
+                 process_cmdline_patterns: Optional[List[str]] = None,
+                 login_title_patterns: Optional[List[str]] = None,
+                 event_queue_size: int = events.DEFAULT_QUEUE_SIZE, event_log: str = "",
+                 metrics_enabled: bool = False, metrics_host: str = "127.0.0.1", metrics_port: int = 9108,
+                 diagnostics_enabled: bool = False, diagnostics_interval: float = diagnostics.DEFAULT_INTERVAL,
+                 diagnostics_top: int = diagnostics.DEFAULT_TOP,
+                 flap_hysteresis: int = 1, flap_min_dwell: float = 0.0,
+                 flap_window: float = 300.0, flap_threshold: int = 0):
         """
         Inicjalizuje monitor
         
@@ -101,6 +168,32 @@ class Metin2Watcher:
             sound_enabled: Czy odtwarzać dźwięk przy wylogowaniu
             sound_wait_for_input: Czy dźwięk ma się powtarzać aż użytkownik naciśnie Enter
             config: Obiekt konfiguracji (opcjonalny)
+            snapshot_interval: Co ile sekund zapisywać stan klientów do ciepłego restartu (0 = wyłączone)
+            exit_detection: Czy wykrywać zakończenie procesów natychmiast przez uchwyty systemowe
+            idle_check_interval: Co ile sekund sprawdzać nowe procesy, gdy nie ma żadnych klientów (0 = tryb bezczynności wyłączony)
+            probe_recheck_interval: Co ile sekund sprawdzać połączenia i okno klienta, gdy tanie sygnały są stabilne (0 = przy każdym sprawdzeniu)
+            probe_cpu_threshold: Próg użycia CPU (ułamek rdzenia) oddzielający aktywnego klienta od bezczynnego
+            detector_names: Nazwy detektorów wylogowania w kolejności ważności (None = domyślne)
+            detector_budget_ms: Budżet czasu CPU na detektory w jednym cyklu (ms)
+            hung_timeout: Po ilu sekundach braku odpowiedzi zgłaszać zawieszenie klienta (0 = wyłączone)
+            control_enabled: Czy uruchomić lokalny kanał sterowania (zapytania o stan i komendy)
+            control_address: Ścieżka gniazda Unix lub nazwa potoku kanału sterowania ("" = domyślna)
+            process_names: Fragmenty nazw procesów klienta (None = domyślne)
+            process_exe_patterns: Wyrażenia regularne ścieżki exe klienta
+            process_cmdline_patterns: Wyrażenia regularne linii poleceń klienta
+            login_title_patterns: Wyrażenia regularne tytułu okna ekranu logowania (None = domyślne)
+            event_queue_size: Rozmiar kolejki każdego ujścia zdarzeń
+            event_log: Ścieżka pliku NDJSON, do którego zapisywane są zdarzenia ("" = wyłączone)
+            metrics_enabled: Czy udostępniać metryki Prometheus przez HTTP
+            metrics_host: Adres serwera metryk
+            metrics_port: Port serwera metryk
+            diagnostics_enabled: Czy okresowo mierzyć pamięć (tracemalloc, liczba obiektów według typu)
+            diagnostics_interval: Co ile sekund mierzyć pamięć
+            diagnostics_top: Ile miejsc alokacji i typów o największym przyroście zgłaszać
+            flap_hysteresis: Ile kolejnych zgodnych wyników detektorów potrzeba do zmiany stanu zalogowania
+            flap_min_dwell: Minimalny czas (s) w stanie zalogowania, zanim zmiana zostanie przyjęta
+            flap_window: Okno (s) liczenia zmian stanu zalogowania
+            flap_threshold: Liczba zmian stanu w oknie, od której klient jest niestabilny (0 = wyłączone)
         """
         self.check_interval = check_interval
         self.network_check_samples = network_check_samples
@@ -110,13 +203,82 @@ class Metin2Watcher:
         self.sound_wait_for_input = sound_wait_for_input
         self.clients: Dict[int, Metin2Client] = {}
         self.running = False
-        
-        # Inicjalizacja modułów (jeśli dostępne)
-        self.config = config or (Config() if Config else None)
+        self.snapshot_interval = snapshot_interval if state_snapshot else 0.0
+        # Reguły rozpoznawania klientów i ekranu logowania, skompilowane raz
+        self.matcher = matcher.ClientMatcher(process_names, process_exe_patterns,
+                                             process_cmdline_patterns, login_title_patterns)
+        self._last_snapshot = time.monotonic()
+        # Obserwatorzy zmian stanu klientów: wywoływani synchronicznie w wątku monitorowania
+        # jako listener(zdarzenie, klient), gdzie zdarzenie to "discovered", "logout", "reconnect",
+        # "closed", "crashed", "hung" (klient nie odpowiada) lub "responsive" (klient znowu odpowiada).
+        # Tylko dla tanich obserwatorów, którzy muszą widzieć zdarzenia w kolejności cyklu (np. agent)
+        self.listeners: List[Callable[[str, Metin2Client], None]] = []
+        # Skutki uboczne zdarzeń wykonują ujścia magistrali, każde we własnym wątku
+        self.bus = events.EventBus(event_queue_size)
+        self.config = None
         self.notification_manager = None
+        self._init_outputs(config, event_log)
+        # Monitor zakończeń procesów - zgłasza zamknięcie klienta od razu, razem z kodem wyjścia
+        self.exit_monitor = backend.create_exit_monitor() if exit_detection and backend else None
+        # Tryb bezczynności: bez klientów zamiast pełnego skanowania procesów
+        # sprawdzane są tylko nowo uruchomione procesy
+        self.idle_check_interval = idle_check_interval if backend else 0.0
+        self._start_detector = None
+        # Sprawdzanie warstwowe: przyrost bajtów I/O i czasu CPU przy każdym sprawdzeniu,
+        # kosztowne wyliczanie połączeń i okien tylko gdy tanie sygnały na to wskazują
+        self.probe_recheck_interval = probe_recheck_interval
+        self.probe_cpu_threshold = probe_cpu_threshold
+        # Detektory wylogowania współdzielą sygnały zbierane leniwie przez te funkcje
+        self.detector_scheduler = detectors.DetectorScheduler(detector_names, detector_budget_ms)
+        self.hung_timeout = hung_timeout
+        self.flap_policy = stability.FlapPolicy(flap_hysteresis, flap_min_dwell, flap_window, flap_threshold)
+        self.signal_collectors = {
+            detectors.SIGNAL_IO: self.get_io_activity,
+            detectors.SIGNAL_CONNECTIONS: self.get_remote_endpoints,
+            detectors.SIGNAL_WINDOW: lambda proc: self._probe_window(proc.pid),
+        }
+        # PID-y klientów wstrzymanych przez kanał sterowania - nie są sprawdzane do wznowienia
+        self.paused: Set[int] = set()
+        # Zatrzymanie trwającego dźwięku alertu (Enter w konsoli lub potwierdzenie przez kanał sterowania)
+        self._alert_stop: Optional[threading.Event] = None
+        self._stdin_closed = False
+        self._stdin_reader: Optional[threading.Thread] = None
+        # Snapshot stanu dla zapytań z innych wątków (kanał sterowania, bot Discord) - tworzony na żądanie
+        self.snapshots = None
+        self.control = None
+        if control_enabled and control and backend:
+            self.control = control.ControlChannel(self, self.enable_snapshots(), control_address)
+        # Metryki są liczone zawsze (tanio), serwer HTTP działa tylko po włączeniu
+        self.metrics = metrics.WatcherMetrics()
+        self.metrics.attach_event_bus(self.bus)
+        self.metrics_server = metrics.MetricsServer(self.metrics, metrics_host, metrics_port) if metrics_enabled else None
+        self.diagnostics = diagnostics.MemoryDiagnostics(diagnostics_interval, diagnostics_top) if diagnostics_enabled else None
+        self._services_started = False
+    
+    def _init_outputs(self, config: Optional[Config], event_log: str) -> None:
+        """Ujścia zdarzeń, konfiguracja i powiadomienia (moduły opcjonalne, jeśli dostępne)"""
+        self.bus.add_sink(events.ConsoleSink())
+        self.bus.add_sink(events.DiscordSink(self))
+        self.bus.add_sink(events.SoundSink(self))
+        if event_log:
+            self.bus.add_sink(events.RecorderSink(event_log))
+        self.config = config or (Config() if Config else None)
         if self.config and NotificationManager:
             self.notification_manager = NotificationManager(self.config)
     
+    def _publish(self, event: events.ClientEvent, client: Metin2Client) -> None:
+        """
+        Publikuje zdarzenie klienta: najpierw synchronicznie powiadamia obserwatorów,
+        a potem przekazuje je ujściom magistrali zdarzeń (bez czekania na nie)
+        """
+        for listener in self.listeners:
+            try:
+                listener(event.name, client)
+            except Exception as e:
+                print(f"[{self._format_time()}] Błąd obserwatora zdarzeń ({event.name}): {e}")
+        self.metrics.client_events.inc(event.name)
+        self.bus.publish(event)
+    
     def _play_sound_loop(self, stop_event: threading.Event) -> None:
         """Odtwarza dźwięk w pętli aż do zatrzymania"""
         try:
@@ -135,6 +297,49 @@ class Metin2Watcher:
         except Exception:
             pass
     
+    def _read_stdin_loop(self) -> None:
+        """Wątek czytający Enter z konsoli - zatrzymuje aktualnie odtwarzany alert"""
+        while True:
+            try:
+                input()
+            except (EOFError, KeyboardInterrupt, RuntimeError):
+                self._stdin_closed = True
+            stop_event = self._alert_stop
+            if stop_event:
+                stop_event.set()
+            if self._stdin_closed:
+                return
+    
+    def _wait_for_alert_ack(self, stop_event: threading.Event) -> None:
+        """Czeka na Enter w konsoli albo potwierdzenie alertu przez kanał sterowania"""
+        if self.control is None:
+            try:
+                input()  # Czeka na Enter
+            except (EOFError, KeyboardInterrupt):
+                pass
+            return
+        
+        # Z kanałem sterowania konsolę czyta osobny wątek, aby alert dało się potwierdzić zdalnie
+        if self._stdin_closed:
+            return
+        self._alert_stop = stop_event
+        if self._stdin_reader is None:
+            self._stdin_reader = threading.Thread(target=self._read_stdin_loop, daemon=True)
+            self._stdin_reader.start()
+        try:
+            while not stop_event.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._alert_stop = None
+    
+    def stop_alert_sound(self) -> None:
+        """Zatrzymuje trwający dźwięk alertu (bezpieczne z innych wątków)"""
+        stop_event = self._alert_stop
+        if stop_event:
+            stop_event.set()
+    
     def play_logout_sound(self, wait_for_input: bool = True):
         """
         Odtwarza dźwięk powiadomienia o wylogowaniu.
@@ -156,10 +361,7 @@ class Metin2Watcher:
                     
                     # Wyświetl komunikat i czekaj na input
                     print(f"\n[{self._format_time()}] [UWAGA] Naciśnij Enter aby zatrzymać dźwięk powiadomienia...")
-                    try:
-                        input()  # Czeka na Enter
-                    except (EOFError, KeyboardInterrupt):
-                        pass
+                    self._wait_for_alert_ack(stop_event)
                     
                     # Zatrzymaj dźwięk
                     stop_event.set()
@@ -188,33 +390,206 @@ class Metin2Watcher:
     
     def handle_client_closed(self, client: Metin2Client, reason: str) -> None:
         """
-        Obsługuje zamknięcie klienta - wyświetla komunikat i odtwarza dźwięk.
+        Obsługuje zamknięcie klienta - publikuje zdarzenie (komunikat, powiadomienia
+        i dźwięk wykonują ujścia magistrali zdarzeń).
         
         Args:
             client: Klient który został zamknięty
             reason: Powód zamknięcia (np. "proces zakończony", "okno zamknięte")
         """
-        print(f"[{self._format_time()}] [UWAGA] Klient zamknięty ({reason}): {client}")
+        self._publish(events.Closed(events.ClientInfo.from_client(client), reason), client)
+    
+    def handle_client_crashed(self, client: Metin2Client, exit_code: Optional[int]) -> None:
+        """
+        Obsługuje crash klienta (proces zakończony kodem błędu).
         
-        # Wyślij powiadomienia
-        if self.notification_manager:
-            self.notification_manager.notify_client_closed(str(client))
+        Args:
+            client: Klient który uległ awarii
+            exit_code: Kod wyjścia procesu
+        """
+        self._publish(events.Crashed(events.ClientInfo.from_client(client), exit_code), client)
+    
+    def handle_client_hung(self, client: Metin2Client) -> None:
+        """Obsługuje zawieszenie klienta"""
+        self._publish(events.Hung(events.ClientInfo.from_client(client)), client)
+    
+    def handle_client_responsive(self, client: Metin2Client) -> None:
+        """Obsługuje powrót zawieszonego klienta do działania"""
+        self._publish(events.Responsive(events.ClientInfo.from_client(client)), client)
+    
+    def handle_client_unstable(self, client: Metin2Client, transitions: int) -> None:
+        """Obsługuje klienta, którego stan zalogowania zmienia się zbyt często"""
+        self._publish(events.Unstable(events.ClientInfo.from_client(client), transitions), client)
+    
+    def handle_client_stable(self, client: Metin2Client, suppressed: int) -> None:
+        """Obsługuje uspokojenie się niestabilnego klienta"""
+        self._publish(events.Stable(events.ClientInfo.from_client(client), suppressed), client)
+    
+    def update_login_state(self, client: Metin2Client, logged_in: bool) -> None:
+        """Przepuszcza wynik detektorów przez maszynę stanów klienta i zgłasza zdarzenia"""
+        now = time.monotonic()
+        machine = client.login_state
+        if machine is None:
+            machine = client.login_state = stability.LoginStateMachine(client.is_logged_in, now)
+        changes = machine.observe(logged_in, now, self.flap_policy)
+        client.is_logged_in = machine.state
+        for change in changes:
+            if change == stability.LOGOUT:
+                self.handle_client_logout(client)
+            elif change == stability.RECONNECT:
+                self.handle_client_reconnect(client)
+            elif change == stability.UNSTABLE:
+                self.handle_client_unstable(client, len(machine.transitions))
+            elif change == stability.STABLE:
+                self.handle_client_stable(client, machine.suppressed)
+    
+    def check_hung(self, client: Metin2Client, cpu_advanced: Optional[bool]) -> None:
+        """
+        Sprawdza, czy klient się zawiesił. Główny wskaźnik to brak odpowiedzi okna
+        (backend.is_window_responding), a gdy nie da się go sprawdzić - czas CPU procesu,
+        który nie rośnie (gra renderuje bez przerwy, więc zawsze zużywa trochę CPU).
+        Zawieszenie jest zgłaszane po hung_timeout sekundach. Gdy nie da się odczytać
+        ani okna, ani czasu CPU (cpu_advanced=None, brak uprawnień), stan jest nieznany
+        i klient nie jest uznawany za zawieszonego.
+        """
+        if self.hung_timeout <= 0:
+            return
         
-        # Odtwórz dźwięk powiadomienia (tak samo jak przy wylogowaniu)
-        if self.play_logout_sound(wait_for_input=self.sound_wait_for_input):
-            if not self.sound_wait_for_input:
-                print(f"[{self._format_time()}] [DŹWIĘK] Odtworzono powiadomienie dźwiękowe")
+        responding = backend.is_window_responding(client.window_handle) if backend else None
+        stalled = (responding is False) or (responding is None and cpu_advanced is False)
+        if not stalled:
+            client.stalled_since = None
+            if client.is_hung:
+                client.is_hung = False
+                self.handle_client_responsive(client)
+            return
         
+        if client.stalled_since is None:
+            client.stalled_since = time.monotonic()
+        elif not client.is_hung and time.monotonic() - client.stalled_since >= self.hung_timeout:
+            client.is_hung = True
+            self.handle_client_hung(client)
+    
+    def process_exits(self) -> None:
+        """Obsługuje zakończenia procesów zgłoszone przez monitor zakończeń"""
+        if not self.exit_monitor:
+            return
+        for pid, exit_code in self.exit_monitor.poll_exits():
+            client = self.clients.pop(pid, None)
+            if client is None:
+                continue
+            if backend.is_crash_exit_code(exit_code):
+                self.handle_client_crashed(client, exit_code)
+            elif exit_code is None:
+                self.handle_client_closed(client, "proces zakończony")
+            else:
+                self.handle_client_closed(client, f"proces zakończony, {backend.format_exit_code(exit_code)}")
+    
+    def wait_interval(self) -> None:
+        """
+        Czeka check_interval sekund do następnego sprawdzenia.
+        Zakończenia procesów zgłoszone w trakcie czekania są obsługiwane od razu.
+        """
+        deadline = time.monotonic() + self.check_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self.exit_monitor is None:
+                time.sleep(remaining)
+                return
+            if self.exit_monitor.wakeup.wait(remaining):
+                self.process_exits()
+    
+    def is_idle(self) -> bool:
+        """Czy watcher może przejść w tryb bezczynności (brak monitorowanych klientów)"""
+        return not self.clients
+    
+    def wait_for_new_client(self) -> None:
+        """
+        Tryb bezczynności - czeka aż zostanie uruchomiony proces Metin2.
+        Sprawdzane są tylko nazwy nowych procesów zgłoszonych przez detektor,
+        bez pełnego skanowania wszystkich procesów co check_interval.
+        """
+        print(f"[{self._format_time()}] [BEZCZYNNOŚĆ] Brak klientów - oczekiwanie na uruchomienie klienta ({self._start_detector.name})")
+        while self.running:
+            new_pids = self._start_detector.wait_for_new_pids(self.idle_check_interval)
+            if new_pids is None:
+                # Detektor zgubił zdarzenia - pełne sprawdzenie rozstrzygnie, czy klient się pojawił
+                return
+            for pid in new_pids:
+                try:
+                    is_client = self.matcher.match_process(psutil.Process(pid))
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+                if is_client:
+                    print(f"[{self._format_time()}] [OK] Wykryto uruchomienie klienta (PID {pid}) - wznowienie monitorowania")
+                    return
+    
+    def wait_next(self) -> None:
+        """Czeka do następnego cyklu - w trybie bezczynności aż do uruchomienia klienta"""
+        if self._start_detector and self.is_idle():
+            self.wait_for_new_client()
+        else:
+            self.wait_interval()
+    
+    def enable_snapshots(self):
+        """Włącza publikowanie snapshotu stanu po każdym cyklu i zwraca jego wydawcę"""
+        if self.snapshots is None:
+            self.snapshots = control.SnapshotPublisher(self)
+        return self.snapshots
+    
+    def set_paused(self, pid: int, paused: bool) -> None:
+        """Wstrzymuje lub wznawia sprawdzanie klienta (zamknięcie procesu jest wykrywane nadal)"""
+        client = self.clients.get(pid)
+        if client is None:
+            return
+        if paused:
+            self.paused.add(pid)
+        elif pid in self.paused:
+            self.paused.discard(pid)
+            # Stan sprzed pauzy jest nieaktualny - pełne sprawdzenie i nowe odliczanie zawieszenia
+            client.stalled_since = None
+            self.request_reprobe(pid)
+    
+    def request_reprobe(self, pid: int) -> None:
+        """Wymusza pełne sprawdzenie klienta (połączenia i okno) w następnym cyklu"""
+        client = self.clients.get(pid)
+        if client is not None:
+            client.probe_signature = None
+            client.last_full_probe = 0.0
+    
+    def handle_client_discovered(self, client: Metin2Client) -> None:
+        """Obsługuje wykrycie nowego klienta"""
+        self._publish(events.ClientDiscovered(events.ClientInfo.from_client(client)), client)
+    
+    def handle_client_logout(self, client: Metin2Client) -> None:
+        """Obsługuje wylogowanie klienta"""
+        self._publish(events.LoggedOut(events.ClientInfo.from_client(client)), client)
+    
+    def handle_client_reconnect(self, client: Metin2Client) -> None:
+        """Obsługuje ponowne zalogowanie klienta"""
+        self._publish(events.Reconnected(events.ClientInfo.from_client(client)), client)
+    
+    def is_metin2_process_name(self, name: str) -> bool:
+        """Sprawdza, czy nazwa procesu pasuje do klienta Metin2"""
+        return self.matcher.match_name(name)
+    
     def find_metin2_processes(self) -> List[psutil.Process]:
-        """Znajduje wszystkie uruchomione procesy Metin2"""
+        """
+        Znajduje wszystkie uruchomione procesy Metin2.
+        Wynik dopasowania jest zapamiętany per (pid, create_time, nazwa), więc reguły
+        są sprawdzane tylko dla nowych procesów.
+        """
         processes = []
-        for proc in psutil.process_iter(['pid', 'name']):
+        seen = set()
+        for proc in psutil.process_iter(['pid', 'name', 'create_time']):
             try:
-                proc_name = proc.info['name'].lower()
-                if any(metin2_name.lower() in proc_name for metin2_name in self.METIN2_PROCESS_NAMES):
+                if self.matcher.match_process(proc, seen):
                     processes.append(proc)
             except (psutil.NoSuchProcess, psutil.AccessDenied):
                 continue
+        self.matcher.prune(seen)
         return processes
     
     def _find_windows_for_process(self, pid: int, min_size: int = 100) -> List[Tuple[int, str, Tuple[int, int], bool]]:
@@ -314,6 +689,14 @@ class Metin2Watcher:
         
         return None, None, None
     
+    def _probe_window(self, pid: int) -> Tuple[Optional[int], str, Optional[Tuple[int, int]]]:
+        """Wyszukuje okno klienta (kosztowne - wylicza okna systemu)"""
+        hwnd, window_title, window_size = self.get_window_info(pid)
+        # Jeśli nie znaleziono okna, spróbuj jeszcze raz z mniejszymi wymaganiami
+        if hwnd is None:
+            hwnd, window_title, window_size = self._find_any_window(pid)
+        return hwnd, window_title or f"Metin2 (PID: {pid})", window_size
+    
     def get_window_title(self, pid: int) -> Optional[str]:
         """Pobiera tytuł okna dla danego procesu (zachowana dla kompatybilności)"""
         _, title, _ = self.get_window_info(pid)
@@ -371,102 +754,69 @@ class Metin2Watcher:
         except Exception:
             return False
     
+    def get_io_activity(self, proc: psutil.Process) -> Tuple[int, float]:
+        """
+        Pobiera tanie sygnały aktywności procesu (sprawdzane przy każdym cyklu).
+        Zwraca: (total_bytes, cpu_time)
+        """
+        record = probe.probe_process(proc)
+        if record is None:
+            return 0, 0.0
+        return record.io_bytes, record.cpu_time
+    
+    def get_remote_endpoints(self, proc: psutil.Process) -> probe.Endpoints:
+        """Zwraca zdalne adresy połączeń procesu (kosztowne - wylicza tablicę połączeń)"""
+        return probe.read_endpoints(proc)
+    
+    def get_connection_count(self, proc: psutil.Process) -> int:
+        """Zwraca liczbę połączeń ESTABLISHED procesu (kosztowne - wylicza tablicę połączeń)"""
+        return len(self.get_remote_endpoints(proc).established)
+    
     def get_network_activity(self, proc: psutil.Process) -> Tuple[int, int]:
         """
         Pobiera aktywność sieciową procesu.
         Zwraca: (total_bytes, num_connections)
         """
-        total_bytes = 0
-        num_connections = 0
+        total_bytes, _ = self.get_io_activity(proc)
+        return total_bytes, self.get_connection_count(proc)
+    
+    def needs_full_probe(self, client: Metin2Client, network_bytes: int, cpu_time: float) -> bool:
+        """
+        Decyduje, czy w tym cyklu sprawdzić połączenia i okno klienta.
+        Kosztowne sprawdzenie jest wykonywane, gdy tani sygnał przekroczył próg,
+        przyrost bajtów nie zgadza się ze statusem klienta, u zalogowanego klienta trwa
+        odliczanie braku połączeń albo minęło probe_recheck_interval od ostatniego pełnego sprawdzenia.
         
-        try:
-            io_counters = proc.io_counters()
-            if io_counters:
-                # Suma wysłanych i odebranych bajtów
-                total_bytes = io_counters.bytes_sent + io_counters.bytes_recv
-        except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
-            pass
+        Gdy bajty I/O nie obejmują ruchu sieciowego (poza Windows), żaden tani sygnał nie pokazuje
+        zerwania ani odzyskania połączenia - połączenia są wtedy sprawdzane w każdym cyklu,
+        a probe_recheck_interval nie ma znaczenia (warstwa CPU sama nie wykryłaby wylogowania).
+        """
+        if self.probe_recheck_interval <= 0 or not probe.IO_BYTES_INCLUDE_NETWORK:
+            return True
         
-        try:
-            # Sprawdź liczbę aktywnych połączeń sieciowych
-            connections = proc.net_connections()
-            if connections:
-                # Licz tylko ESTABLISHED połączenia
-                num_connections = len([c for c in connections if c.status == 'ESTABLISHED'])
-        except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
-            pass
+        elapsed = max(time.monotonic() - client.last_check, 0.001)
+        bytes_active = network_bytes - client.last_network_bytes >= self.network_threshold / self.network_check_samples
+        cpu_active = (cpu_time - client.last_cpu_time) / elapsed >= self.probe_cpu_threshold
+        signature = (bytes_active, cpu_active)
+        crossed = signature != client.probe_signature
+        client.probe_signature = signature
         
-        return total_bytes, num_connections
+        return (crossed
+                or bytes_active != client.is_logged_in
+                or (client.is_logged_in and client.no_connections_since is not None)
+                or time.monotonic() - client.last_full_probe >= self.probe_recheck_interval)
     
-    def is_logged_in_by_network(self, client: Metin2Client, current_bytes: int, num_connections: int) -> bool:
+    def is_logged_in_by_network(self, client: Metin2Client, signals: detectors.ClientSignals,
+                                allow_expensive: bool = True) -> bool:
         """
-        Sprawdza czy klient jest zalogowany na podstawie aktywności sieciowej.
-        Główny wskaźnik: liczba aktywnych połączeń sieciowych (ESTABLISHED).
-        Jeśli brak połączeń przez 5 sekund = wylogowany.
+        Sprawdza czy klient jest zalogowany, uruchamiając detektory wylogowania
+        na sygnałach z rekordu odczytu procesu (signals.record) i sygnałach zbieranych leniwie.
+        Główny wskaźnik: liczba aktywnych połączeń sieciowych (ESTABLISHED) -
+        brak połączeń przez 5 sekund = wylogowany.
+        Detektory wymagające kosztownych sygnałów (połączenia, okno) są uruchamiane
+        tylko przy allow_expensive i w ramach budżetu - inaczej obowiązuje ich poprzedni wynik.
         """
-        # Aktualizuj liczbę połączeń
-        client.num_connections = num_connections
-        
-        # GŁÓWNY WSKAŹNIK: Jeśli brak połączeń sieciowych
-        if num_connections == 0:
-            # Jeśli to pierwszy raz gdy brak połączeń, zapisz czas
-            if client.no_connections_since is None:
-                client.no_connections_since = datetime.now()
-            
-            # Sprawdź czy minęło 5 sekund od momentu braku połączeń
-            time_without_connections = (datetime.now() - client.no_connections_since).total_seconds()
-            if time_without_connections >= 5.0:
-                return False
-            else:
-                # Czekamy jeszcze - klient nadal uważany za zalogowanego
-                return True
-        else:
-            # Połączenia są aktywne - zresetuj timer
-            client.no_connections_since = None
-        
-        # Dla nowych klientów (bez historii) zakładamy że są zalogowani
-        # i zbieramy próbki przed oceną
-        if client.last_network_bytes == 0:
-            client.last_network_bytes = current_bytes
-            return True  # Nowy klient z połączeniem - zakładamy że jest zalogowany
-        
-        # Oblicz zmianę aktywności sieciowej (różnica między sprawdzeniami)
-        bytes_diff = current_bytes - client.last_network_bytes
-        
-        # Jeśli różnica jest ujemna (co może się zdarzyć przy restarcie licznika),
-        # zresetuj historię
-        if bytes_diff < 0:
-            client.last_network_bytes = current_bytes
-            client.network_activity_history.clear()
-            return True  # Reset - zakładamy że jest zalogowany
-        
-        # Dodaj różnicę do historii
-        client.network_activity_history.append(bytes_diff)
-        
-        # Zachowaj tylko ostatnie N próbek
-        if len(client.network_activity_history) > self.network_check_samples:
-            client.network_activity_history.pop(0)
-        
-        # Aktualizuj ostatnią wartość
-        client.last_network_bytes = current_bytes
-        
-        # Jeśli mamy wystarczająco próbek, sprawdź aktywność
-        if len(client.network_activity_history) >= self.network_check_samples:
-            # Sprawdź czy ostatnie próbki pokazują brak aktywności
-            recent_activity = client.network_activity_history[-self.network_check_samples:]
-            total_recent_activity = sum(recent_activity)
-            
-            # Średnia aktywność na próbkę
-            avg_activity = total_recent_activity / len(recent_activity)
-            
-            # Jeśli przez ostatnie próbki nie było żadnej aktywności sieciowej,
-            # prawdopodobnie nastąpiło wylogowanie
-            # Sprawdzamy zarówno całkowitą aktywność jak i średnią
-            if total_recent_activity < self.network_threshold and avg_activity < (self.network_threshold / self.network_check_samples):
-                return False
-        
-        # Jeśli nie mamy jeszcze wystarczająco próbek lub aktywność jest wystarczająca
-        return True
+        return self.detector_scheduler.evaluate(self, client, signals, allow_expensive)
     
     def is_logged_in(self, window_title: str) -> bool:
         """
@@ -477,26 +827,16 @@ class Metin2Watcher:
         if not window_title:
             return True  # Jeśli nie możemy sprawdzić, zakładamy że jest zalogowany
         
-        title_lower = window_title.lower()
-        
-        # Jeśli tytuł zawiera wskaźniki ekranu logowania, użytkownik jest wylogowany
-        for indicator in self.LOGIN_SCREEN_INDICATORS:
-            if indicator in title_lower:
-                # Ale sprawdźmy czy to nie jest normalny tytuł z "metin2" w nazwie
-                # Ekran logowania zwykle ma specyficzne tytuły
-                if 'select server' in title_lower or 'wybierz serwer' in title_lower:
-                    return False
-                # Jeśli tytuł jest bardzo krótki (tylko "metin2"), może to być ekran logowania
-                if len(title_lower.split()) <= 2 and 'metin2' in title_lower:
-                    return False
-        
-        # Jeśli tytuł zawiera nazwę postaci lub serwera, prawdopodobnie jest zalogowany
-        # (to wymaga dostosowania do konkretnych serwerów)
-        return True
+        # Wzorce ekranu logowania (login_title_patterns) wymagają dostosowania do konkretnych serwerów
+        return not self.matcher.is_login_title(window_title)
     
     def update_clients(self) -> None:
         """Aktualizuje listę monitorowanych klientów"""
+        self.process_exits()
+        self.detector_scheduler.start_tick()
         current_processes = self.find_metin2_processes()
+        # Najdłużej nie sprawdzani klienci jako pierwsi korzystają z budżetu detektorów
+        current_processes.sort(key=lambda proc: self.clients[proc.pid].last_full_probe if proc.pid in self.clients else 0.0)
         current_pids = {proc.pid for proc in current_processes}
         
         # Sprawdź czy któryś klient się zamknął (proces zniknął)
@@ -517,42 +857,66 @@ class Metin2Watcher:
         for proc in current_processes:
             try:
                 pid = proc.pid
-                name = proc.name()
-                hwnd, window_title, window_size = self.get_window_info(pid)
-                # Jeśli nie znaleziono okna, spróbuj jeszcze raz z mniejszymi wymaganiami
-                if hwnd is None:
-                    hwnd, window_title, window_size = self._find_any_window(pid)
-                window_title = window_title or f"Metin2 (PID: {pid})"
-                network_bytes, num_connections = self.get_network_activity(proc)
+                if pid in self.paused and pid in self.clients:
+                    continue
+                # Tania warstwa - przy każdym cyklu, jednym odczytem procesu
+                record = probe.probe_process(proc)
+                if record is None:
+                    self.metrics.probe_failures.inc("gone")
+                    continue
+                network_bytes, cpu_time = record.io_bytes, record.cpu_time
                 
                 if pid not in self.clients:
-                    # Nowy klient
+                    # Nowy klient - zawsze pełne sprawdzenie
+                    name = record.name
+                    hwnd, window_title, window_size = self._probe_window(pid)
+                    endpoints = self.get_remote_endpoints(proc)
+                    num_connections = len(endpoints.established)
                     client = Metin2Client(
                         pid=pid,
                         name=name,
                         window_title=window_title,
-                        start_time=datetime.now(),
-                        last_check=datetime.now(),
                         is_logged_in=(num_connections > 0),  # Zalogowany jeśli ma połączenia
                         last_network_bytes=network_bytes,
                         num_connections=num_connections,
                         window_handle=hwnd,
-                        window_size=window_size
+                        window_size=window_size,
+                        create_time=record.create_time,
+                        last_cpu_time=cpu_time,
+                        last_full_probe=time.monotonic(),
+                        remote_endpoints=endpoints.established
                     )
                     self.clients[pid] = client
-                    print(f"[{self._format_time()}] [OK] Nowy klient wykryty: {client}")
+                    if self.exit_monitor:
+                        self.exit_monitor.watch(pid)
+                    self.handle_client_discovered(client)
                 else:
                     # Aktualizuj istniejący klient
                     client = self.clients[pid]
-                    old_logged_in = client.is_logged_in
-                    client.window_title = window_title
-                    client.window_handle = hwnd
-                    client.window_size = window_size
-                    client.last_check = datetime.now()
+                    old_endpoints = client.remote_endpoints
+                    hwnd = client.window_handle
+                    # Przy braku uprawnień czas CPU wynosi 0 - nieznany, a nie zatrzymany
+                    cpu_advanced = None if record.access_denied else cpu_time > client.last_cpu_time
+                    signals = detectors.ClientSignals(proc, self.signal_collectors, record)
+                    # Kosztowna warstwa - tylko gdy tanie sygnały na to wskazują
+                    allow_expensive = self.needs_full_probe(client, network_bytes, cpu_time)
+                    client.last_check = time.monotonic()
+                    client.last_cpu_time = cpu_time
                     
-                    # Sprawdź status logowania na podstawie aktywności sieciowej
-                    is_logged_in_network = self.is_logged_in_by_network(client, network_bytes, num_connections)
-                    client.num_connections = num_connections
+                    # Sprawdź status logowania detektorami
+                    is_logged_in_network = self.is_logged_in_by_network(client, signals, allow_expensive)
+                    if signals.has(detectors.SIGNAL_CONNECTIONS):
+                        client.num_connections = len(signals.get(detectors.SIGNAL_CONNECTIONS).established)
+                    if self.debug and client.remote_endpoints != old_endpoints:
+                        print(f"[{self._format_time()}] [DEBUG] Zmiana połączeń ({client.endpoint_event}): PID {pid} -> "
+                              f"{', '.join(f'{ip}:{port}' for ip, port in sorted(client.remote_endpoints)) or 'brak'}")
+                    if signals.has(detectors.SIGNAL_CONNECTIONS) or signals.has(detectors.SIGNAL_WINDOW):
+                        # Przy pełnym sprawdzeniu odśwież też okno (jeśli detektor go nie pobrał)
+                        hwnd, window_title, window_size = signals.get(detectors.SIGNAL_WINDOW)
+                        client.window_title = window_title
+                        client.window_handle = hwnd
+                        client.window_size = window_size
+                        client.last_full_probe = time.monotonic()
                     
                     # Sprawdź czy okno nadal istnieje (jeśli nie, to zamknięcie)
                     # Tylko jeśli wcześniej mieliśmy handle okna
@@ -568,32 +932,17 @@ class Metin2Watcher:
                         del self.clients[pid]
                         continue
                     
+                    self.check_hung(client, cpu_advanced)
+                    
                     # Jeśli okno istnieje, ale aktywność sieciowa jest zerowa,
                     # prawdopodobnie jest to ekran logowania (wylogowanie)
-                    # Użyj wykrywania sieciowego jako głównej metody
-                    client.is_logged_in = is_logged_in_network
-                    
-                    # Sprawdź czy nastąpiło wylogowanie
-                    if old_logged_in and not client.is_logged_in:
-                        print(f"[{self._format_time()}] [WYLOGOWANY] Wylogowanie wykryte (ekran logowania): {client}")
-                        
-                        # Wyślij powiadomienia
-                        if self.notification_manager:
-                            self.notification_manager.notify_logout(str(client))
-                        
-                        # Odtwórz dźwięk powiadomienia
-                        if self.play_logout_sound(wait_for_input=self.sound_wait_for_input):
-                            if not self.sound_wait_for_input:
-                                print(f"[{self._format_time()}] [DŹWIĘK] Odtworzono powiadomienie dźwiękowe")
-                    elif not old_logged_in and client.is_logged_in:
-                        print(f"[{self._format_time()}] [ZALOGOWANY] Ponowne zalogowanie: {client}")
+                    # Użyj wykrywania sieciowego jako głównej metody, z histerezą
+                    self.update_login_state(client, is_logged_in_network)
                         
-                        # Wyślij powiadomienia
-                        if self.notification_manager:
-                            self.notification_manager.notify_reconnect(str(client))
-                        
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+            except psutil.NoSuchProcess:
+                self.metrics.probe_failures.inc("gone")
+            except psutil.AccessDenied:
+                self.metrics.probe_failures.inc("access_denied")
     
     def print_status(self, debug: bool = False) -> None:
         """Wyświetla aktualny status wszystkich klientów"""
@@ -601,16 +950,99 @@ class Metin2Watcher:
             print(f"[{self._format_time()}] Brak aktywnych klientów Metin2")
             return
         
-        print(f"\n[{self._format_time()}] Status klientów ({len(self.clients)}):")
+        lines = [f"\n[{self._format_time()}] Status klientów ({len(self.clients)}):"]
         for client in self.clients.values():
             status_icon = "[ZALOGOWANY]" if client.is_logged_in else "[WYLOGOWANY]"
-            print(f"  {status_icon} {client}")
+            if client.login_state and client.login_state.unstable:
+                status_icon = "[NIESTABILNY]"
+            if client.is_hung:
+                status_icon = "[ZAWIESZONY]"
+            lines.append(f"  {status_icon} {client}")
             if debug:
                 # Wyświetl informacje debugowania
                 recent_activity = sum(client.network_activity_history[-5:]) if len(client.network_activity_history) > 0 else 0
-                print(f"      Debug: Aktywność sieciowa (ostatnie 5 próbek): {recent_activity} bajtów")
-                print(f"      Debug: Historia próbek: {len(client.network_activity_history)}/{self.network_check_samples}")
-        print()
+                lines.append(f"      Debug: Aktywność sieciowa (ostatnie 5 próbek): {recent_activity} bajtów")
+                lines.append(f"      Debug: Historia próbek: {len(client.network_activity_history)}/{self.network_check_samples}")
+                endpoints = ', '.join(f'{ip}:{port}' for ip, port in sorted(client.remote_endpoints)) or 'brak'
+                lines.append(f"      Debug: Połączenia: {endpoints} (ostatnia zmiana: {client.endpoint_event or 'brak'})")
+        if debug and self.diagnostics and self.diagnostics.summary:
+            lines.append("  Debug: Ostatni pomiar pamięci:")
+            lines.extend(f"      {line}" for line in self.diagnostics.summary)
+        # Komunikaty zdarzeń wypisuje wątek ujścia konsoli - blok statusu wypisywany w całości
+        with events.CONSOLE_LOCK:
+            print("\n".join(lines) + "\n")
+    
+    def save_state(self) -> None:
+        """Zapisuje snapshot monitorowanych klientów (jeśli włączony)"""
+        if self.snapshot_interval > 0:
+            state_snapshot.save_snapshot(list(self.clients.values()))
+            self._last_snapshot = time.monotonic()
+    
+    def restore_state(self) -> int:
+        """
+        Odtwarza klientów z ostatniego snapshotu.
+        Przywracani są tylko klienci, których proces nadal działa (ten sam PID i create_time),
+        razem z bazowymi wartościami sieciowymi i historią próbek - dzięki temu wykrywanie
+        wylogowań działa od razu po restarcie, bez ponownego zbierania próbek.
+        
+        Returns:
+            Liczba przywróconych klientów
+        """
+        if self.snapshot_interval <= 0:
+            return 0
+        
+        saved = state_snapshot.load_snapshot(Metin2Client, max_age=max(self.snapshot_interval * 10, 600.0))
+        for (pid, create_time), client in saved.items():
+            try:
+                proc = psutil.Process(pid)
+                if abs(proc.create_time() - create_time) > 0.01:
+                    continue  # PID użyty ponownie przez inny proces
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            self.clients[pid] = client
+            if self.exit_monitor:
+                self.exit_monitor.watch(pid)
+        
+        if self.clients:
+            print(f"[{self._format_time()}] [OK] Przywrócono {len(self.clients)} klientów z poprzedniego stanu")
+        return len(self.clients)
+    
+    def tick(self, show_status: bool = True) -> None:
+        """Wykonuje jeden cykl monitorowania"""
+        if self.idle_check_interval > 0 and self._start_detector is None:
+            # Detektor powstaje przed pierwszym skanowaniem, aby nie przeoczyć
+            # klienta uruchomionego między skanowaniem a wejściem w bezczynność
+            self._start_detector = backend.create_start_detector(self.idle_check_interval)
+        started = time.perf_counter()
+        if not self._services_started:
+            self._services_started = True
+            self._start_services()
+        elif self.control:
+            self.control.apply_commands()
+        self.update_clients()
+        self.paused.intersection_update(self.clients)
+        if self.snapshots:
+            self.snapshots.publish()
+        self.metrics.update_clients(self.clients, self.paused)
+        self.metrics.tick_duration.observe(time.perf_counter() - started)
+        if self.snapshot_interval > 0 and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.save_state()
+        if show_status and self.clients:
+            self.print_status(debug=self.debug)
+    
+    def _start_services(self) -> None:
+        """Uruchamia kanał sterowania i serwer metryk (przy pierwszym cyklu, po nagłówku)"""
+        if self.control and not self.control.start():
+            self.control = None
+        if self.metrics_server:
+            try:
+                self.metrics_server.start()
+                print(f"[{self._format_time()}] [METRYKI] Metryki: http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                print(f"[{self._format_time()}] [METRYKI] Serwer metryk niedostępny: {e}")
+                self.metrics_server = None
+        if self.diagnostics:
+            self.diagnostics.start()
     
     def run(self, show_status: bool = True) -> None:
         """Uruchamia monitor w pętli"""
@@ -628,13 +1060,33 @@ class Metin2Watcher:
             print("Dźwięk powiadomień: WYŁĄCZONY")
         print("Naciśnij Ctrl+C aby zatrzymać\n")
         
+        self.restore_state()
+        
         try:
             while self.running:
-                self.update_clients()
-                if show_status and self.clients:
-                    self.print_status(debug=self.debug)
-                time.sleep(self.check_interval)
+                self.tick(show_status)
+                self.wait_next()
         except KeyboardInterrupt:
             print("\n\nZatrzymywanie monitora...")
             self.running = False
+        finally:
+            self.shutdown()
+    
+    def shutdown(self) -> None:
+        """Zatrzymuje monitor, zapisuje stan klientów i zwalnia zasoby systemowe"""
+        self.running = False
+        self.save_state()
+        if self._start_detector:
+            self._start_detector.close()
+            self._start_detector = None
+        if self.exit_monitor:
+            self.exit_monitor.close()
+            self.exit_monitor = None
+        if self.control:
+            self.control.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.diagnostics:
+            self.diagnostics.close()
+        self.bus.close()
 
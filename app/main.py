@@ -1,29 +1,257 @@
 """
 Główny plik uruchomieniowy M2Watcher
 """
+import argparse
+import json
 import sys
 import traceback
+from typing import List, TYPE_CHECKING
 
 try:
     from config import Config
-    from m2watcher import Metin2Watcher
 except ImportError as e:
     print(f"Błąd importu modułów: {e}")
     print(f"Python path: {sys.path}")
     traceback.print_exc()
     sys.exit(1)
 
-# Import bota Discord (opcjonalny)
-try:
-    from discord_bot import M2WatcherBot
-    DISCORD_BOT_AVAILABLE = True
-except ImportError:
-    DISCORD_BOT_AVAILABLE = False
-    M2WatcherBot = None
+# Watcher (psutil, pywin32, detektory) jest importowany dopiero przy uruchomieniu
+# monitorowania, więc --once i --control startują szybko
+if TYPE_CHECKING:
+    from m2watcher import Metin2Watcher
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parsuje argumenty wiersza poleceń (nadpisują ustawienia z konfiguracji)"""
+    parser = argparse.ArgumentParser(description="M2Watcher - Monitor klientów Metin2")
+    parser.add_argument("--mode", choices=["standalone", "agent", "aggregator"],
+                        help="Tryb pracy (domyślnie z konfiguracji: mode)")
+    parser.add_argument("--host-id", help="Identyfikator hosta w trybie agenta")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="Adres agregatora w trybie agenta")
+    parser.add_argument("--listen", metavar="HOST:PORT", help="Adres nasłuchiwania w trybie agregatora")
+    parser.add_argument("--control", nargs="+", metavar="KOMENDA",
+                        help="Wysyła komendę do działającego watchera i wypisuje odpowiedź JSON: "
+                             "status, client PID, ack [PID], pause PID, resume PID, reprobe [PID]")
+    parser.add_argument("--once", action="store_true",
+                        help="Jednorazowe sprawdzenie klientów (stan na podstawie połączeń) bez uruchamiania monitora")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--json", dest="output_format", action="store_const", const="json", default="text",
+                        help="Z --once: wynik jako jeden dokument JSON")
+    output.add_argument("--ndjson", dest="output_format", action="store_const", const="ndjson",
+                        help="Z --once: jedna linia JSON na klienta, wypisywana od razu po odczycie")
+    parser.add_argument("--export", nargs=2, metavar=("TABELA", "PLIK"),
+                        help="Eksportuje z bazy agregatora próbki telemetrii (samples) lub zdarzenia (events) "
+                             "do pliku Parquet lub Arrow IPC (wymaga pyarrow)")
+    parser.add_argument("--export-format", choices=["parquet", "arrow"],
+                        help="Z --export: format pliku (domyślnie z rozszerzenia: .parquet, .arrow)")
+    parser.add_argument("--since", help="Z --export: od czasu (timestamp, data ISO lub sekundy wstecz, np. -86400)")
+    parser.add_argument("--until", help="Z --export: do czasu (jak --since)")
+    parser.add_argument("--host", help="Z --export: tylko klienci hosta (agenta)")
+    parser.add_argument("--pid", type=int, help="Z --export: tylko klient o podanym PID")
+    args = parser.parse_args(argv)
+    if args.output_format != "text" and not args.once:
+        parser.error("--json i --ndjson wymagają --once")
+    export_options = (args.export_format, args.since, args.until, args.host, args.pid)
+    if not args.export and any(option is not None for option in export_options):
+        parser.error("--export-format, --since, --until, --host i --pid wymagają --export")
+    if args.export and args.export[0] not in ("samples", "events"):
+        parser.error("--export: TABELA musi być samples lub events")
+    return args
+
+
+def _split_address(value: str, default_port: int):
+    """Dzieli "host:port" na (host, port)"""
+    host, _, port = value.rpartition(":")
+    if not host:
+        return value, default_port
+    return host, int(port)
+
+
+def _create_watcher(config: Config) -> "Metin2Watcher":
+    """Tworzy watcher na podstawie konfiguracji"""
+    from m2watcher import Metin2Watcher
+    
+    watcher_cls = Metin2Watcher
+    extra_args = {}
+    workers = config.get("workers", 0)
+    if workers > 1:
+        # Duże hosty: sprawdzanie klientów rozdzielone między kilka procesów
+        from sharding import ShardedWatcher
+        watcher_cls = ShardedWatcher
+        extra_args["workers"] = workers
+    
+    return watcher_cls(
+        check_interval=config.get("check_interval", 2.0),
+        network_check_samples=config.get("network_check_samples", 5),
+        network_threshold=config.get("network_threshold", 1000),
+        debug=config.get("debug", False),
+        sound_enabled=config.get("sound_enabled", True),
+        sound_wait_for_input=config.get("sound_wait_for_input", True),
+        config=config,
+        snapshot_interval=config.get("state_snapshot_interval", 30.0),
+        exit_detection=config.get("exit_detection", True),
+        idle_check_interval=config.get("idle_check_interval", 5.0),
+        probe_recheck_interval=config.get("probe_recheck_interval", 10.0),
+        probe_cpu_threshold=config.get("probe_cpu_threshold", 0.02),
+        detector_names=config.get("detectors"),
+        detector_budget_ms=config.get("detector_budget_ms", 50.0),
+        hung_timeout=config.get("hung_timeout", 30.0),
+        flap_hysteresis=config.get("flap.hysteresis", 1),
+        flap_min_dwell=config.get("flap.min_dwell", 0.0),
+        flap_window=config.get("flap.window", 300.0),
+        flap_threshold=config.get("flap.threshold", 4),
+        control_enabled=config.get("control.enabled", False),
+        control_address=config.get("control.address", ""),
+        process_names=config.get("process_match.names"),
+        process_exe_patterns=config.get("process_match.exe_patterns"),
+        process_cmdline_patterns=config.get("process_match.cmdline_patterns"),
+        login_title_patterns=config.get("login_title_patterns"),
+        event_queue_size=config.get("event_queue_size", 256),
+        event_log=config.get("event_log", ""),
+        metrics_enabled=config.get("metrics.enabled", False),
+        metrics_host=config.get("metrics.host", "127.0.0.1"),
+        metrics_port=config.get("metrics.port", 9108),
+        diagnostics_enabled=config.get("diagnostics.enabled", False),
+        diagnostics_interval=config.get("diagnostics.interval", 600.0),
+        diagnostics_top=config.get("diagnostics.top", 10),
+        **extra_args
+    )
+
+
+def run_agent(config: Config, args: argparse.Namespace) -> None:
+    """Uruchamia tryb agenta - bez bota Discord, stan wysyłany do agregatora"""
+    import socket
+    from agent import Agent
+    
+    host_id = args.host_id or config.get("agent.host_id", "") or socket.gethostname()
+    port = config.get("agent.aggregator_port", 7878)
+    address = args.connect or f"{config.get('agent.aggregator_host', '127.0.0.1')}:{port}"
+    aggregator_host, aggregator_port = _split_address(address, port)
+    
+    agent = Agent(
+        _create_watcher(config),
+        host_id=host_id,
+        aggregator_host=aggregator_host,
+        aggregator_port=aggregator_port,
+        telemetry_interval=config.get("agent.telemetry_interval", 10.0),
+        token=config.get("agent.token", "")
+    )
+    agent.run()
+
+
+def _telemetry_retention(config: Config) -> dict:
+    """Retencja telemetrii z konfiguracji (dni) w sekundach według rozdzielczości kubełków"""
+    keys = {"raw": 0, "minute": 60, "hour": 3600, "day": 86400}
+    defaults = Config.DEFAULT_CONFIG["aggregator"]["retention_days"]
+    return {resolution: float(config.get(f"aggregator.retention_days.{key}", defaults[key])) * 86400
+            for key, resolution in keys.items()}
+
+
+def run_aggregator(config: Config, args: argparse.Namespace, notification_manager) -> None:
+    """Uruchamia tryb agregatora - widok floty i jedyne połączenie Discord"""
+    from aggregator import Aggregator
+    
+    port = config.get("aggregator.listen_port", 7878)
+    address = args.listen or f"{config.get('aggregator.listen_host', '127.0.0.1')}:{port}"
+    listen_host, listen_port = _split_address(address, port)
+    
+    event_store = None
+    if config.get("aggregator.event_store", True):
+        from event_store import EventStore
+        event_store = EventStore(retention=_telemetry_retention(config))
+        if config.get("aggregator.api_enabled", True):
+            try:
+                from query_api import start_query_api
+                start_query_api(
+                    event_store,
+                    host=config.get("aggregator.api_host", "127.0.0.1"),
+                    port=config.get("aggregator.api_port", 7879)
+                )
+            except ImportError as e:
+                print(f"API zapytań niedostępne (brak modułu): {e}")
+    
+    aggregator = Aggregator(
+        listen_host=listen_host,
+        listen_port=listen_port,
+        notification_manager=notification_manager,
+        agent_timeout=config.get("aggregator.agent_timeout", 60.0),
+        show_status=config.get("show_status", True),
+        event_store=event_store,
+        token=config.get("aggregator.token", "")
+    )
+    if not aggregator.token and listen_host not in ("127.0.0.1", "localhost", "::1"):
+        print(f"Uwaga: agregator nasłuchuje na {listen_host} bez tokenu - "
+              f"każdy w sieci może podszyć się pod agenta (ustaw aggregator.token)")
+    aggregator.run()
+
+
+def run_control_command(config: Config, command: List[str]) -> None:
+    """Wysyła komendę do kanału sterowania działającego watchera i wypisuje odpowiedź"""
+    import control
+
+    try:
+        pid = int(command[1]) if len(command) > 1 else None
+    except ValueError:
+        print(f"Nieprawidłowy PID: {command[1]}")
+        sys.exit(2)
+    try:
+        response = control.send_command(config.get("control.address", ""), command[0], pid)
+    except OSError as e:
+        print(f"Brak połączenia z kanałem sterowania (czy watcher jest uruchomiony?): {e}")
+        sys.exit(1)
+    print(json.dumps(response, ensure_ascii=False, indent=2))
+    if not response.get("ok"):
+        sys.exit(1)
+
+
+def _start_discord_bot(config: Config):
+    """
+    Uruchamia bota Discord. discord.py (i aiohttp) są importowane dopiero tutaj,
+    więc przy wyłączonym Discordzie nie spowalniają startu aplikacji.
+    """
+    try:
+        from discord_bot import M2WatcherBot
+    except ImportError as e:
+        print(f"Bot Discord niedostępny (brak modułu): {e}")
+        return None
+    
+    discord_bot = M2WatcherBot(config)
+    discord_bot.start()  # Uruchom bota w tle
+    print("Bot Discord uruchomiony")
+    return discord_bot
+
+
+def run_once(args: argparse.Namespace) -> None:
+    """Jednorazowe sprawdzenie - konfiguracja tylko do odczytu, minimum importów"""
+    from oneshot import run_once as scan_once
+    
+    scan_once(Config(create=False), args.output_format)
+
+
+def run_export(args: argparse.Namespace) -> None:
+    """Eksport kolumnowy z bazy zdarzeń agregatora - bez uruchamiania monitora"""
+    from event_store import parse_time
+    from export import ExportError, export_table
+    
+    table, path = args.export
+    try:
+        count = export_table(table, path, args.export_format, host=args.host, pid=args.pid,
+                             since=parse_time(args.since), until=parse_time(args.until))
+    except (ExportError, ValueError) as e:
+        print(f"Błąd eksportu: {e}")
+        sys.exit(1)
+    print(f"Wyeksportowano {count} wierszy ({table}) do {path}")
 
 
 def main():
     """Główna funkcja"""
+    args = parse_args()
+    if args.once:
+        run_once(args)
+        return
+    if args.export:
+        run_export(args)
+        return
     try:
         # Uruchom aplikację
         config = Config()
@@ -33,15 +261,23 @@ def main():
         input("Naciśnij Enter aby zakończyć...")
         sys.exit(1)
     
+    if args.control:
+        run_control_command(config, args.control)
+        return
+    
+    mode = args.mode or config.get("mode", "standalone")
+    if mode == "agent":
+        # Agent nie utrzymuje własnego połączenia Discord - robi to agregator
+        run_agent(config, args)
+        return
+    
     # Uruchom bota Discord jeśli jest włączony
     discord_bot = None
-    if DISCORD_BOT_AVAILABLE and config.get("discord.enabled", False):
+    if config.get("discord.enabled", False):
         bot_token = config.get("discord.bot_token", "")
         if bot_token:
             try:
-                discord_bot = M2WatcherBot(config)
-                discord_bot.start()  # Uruchom bota w tle
-                print("Bot Discord uruchomiony")
+                discord_bot = _start_discord_bot(config)
             except Exception as e:
                 print(f"Błąd uruchamiania bota Discord: {e}")
                 discord_bot = None
@@ -50,18 +286,17 @@ def main():
     from notifications import NotificationManager
     notification_manager = NotificationManager(config, discord_bot)
     
-    watcher = Metin2Watcher(
-        check_interval=config.get("check_interval", 2.0),
-        network_check_samples=config.get("network_check_samples", 5),
-        network_threshold=config.get("network_threshold", 1000),
-        debug=config.get("debug", False),
-        sound_enabled=config.get("sound_enabled", True),
-        sound_wait_for_input=config.get("sound_wait_for_input", True),
-        config=config
-    )
+    if mode == "aggregator":
+        run_aggregator(config, args, notification_manager)
+        return
+    
+    watcher = _create_watcher(config)
     
     # Zastąp notification_manager w watcherze naszym z botem
     watcher.notification_manager = notification_manager
+    if discord_bot:
+        # Komendy bota odpowiadają ze snapshotu publikowanego po każdym cyklu
+        discord_bot.attach_snapshots(watcher.enable_snapshots())
     
     try:
         watcher.run(show_status=config.get("show_status", True))
@@ -80,6 +315,10 @@ def main():
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    
+    # Wymagane dla procesów roboczych (workers > 1) w zbudowanym exe
+    multiprocessing.freeze_support()
     try:
         main()
     except Exception as e:
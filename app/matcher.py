@@ -0,0 +1,122 @@
+"""
+Dopasowanie procesów i tytułów okien klientów Metin2
+Reguły z konfiguracji (nazwy procesów, wzorce ścieżki exe i linii poleceń, wzorce
+tytułów ekranu logowania) są kompilowane raz do pojedynczych wyrażeń regularnych,
+a wyniki zapamiętywane per proces (pid, create_time, nazwa) i per tytuł okna - niezmienione
+procesy i tytuły nie są dopasowywane ponownie
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
+
+import psutil
+
+DEFAULT_PROCESS_NAMES = ["metin2client.exe"]
+
+# Tytuł ekranu logowania: wybór serwera albo sam "metin2" z co najwyżej jednym dodatkowym słowem
+DEFAULT_LOGIN_TITLE_PATTERNS = [
+    r"select server",
+    r"wybierz serwer",
+    r"^\s*(?:\S*metin2\S*(?:\s+\S+)?|\S+\s+\S*metin2\S*)\s*$",
+]
+
+# Limit zapamiętanych tytułów - po przekroczeniu pamięć jest czyszczona
+MAX_CACHED_TITLES = 1024
+
+# Nazwa należy do klucza, bo po exec() proces zachowuje PID i czas utworzenia
+ProcessKey = Tuple[int, float, str]
+
+
+def _compile(patterns: Iterable[str], kind: str) -> Optional[Pattern]:
+    """Łączy wzorce w jedno wyrażenie (bez rozróżniania wielkości liter), pomijając błędne"""
+    valid = []
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            print(f"Ostrzeżenie: Nieprawidłowy wzorzec {kind} '{pattern}' - pomijanie ({e})")
+            continue
+        valid.append(f"(?:{pattern})")
+    return re.compile("|".join(valid), re.IGNORECASE) if valid else None
+
+
+class ClientMatcher:
+    """Skompilowane reguły rozpoznawania procesów klienta i ekranu logowania"""
+
+    def __init__(self, process_names: Optional[List[str]] = None,
+                 exe_patterns: Optional[List[str]] = None,
+                 cmdline_patterns: Optional[List[str]] = None,
+                 login_title_patterns: Optional[List[str]] = None):
+        """
+        Args:
+            process_names: Fragmenty nazwy procesu (bez rozróżniania wielkości liter)
+            exe_patterns: Wyrażenia regularne dla pełnej ścieżki pliku exe
+            cmdline_patterns: Wyrażenia regularne dla linii poleceń procesu
+            login_title_patterns: Wyrażenia regularne tytułu okna oznaczającego ekran logowania
+        """
+        names = DEFAULT_PROCESS_NAMES if process_names is None else process_names
+        self._name_regex = _compile((re.escape(name) for name in names if name), "nazwy procesu")
+        self._exe_regex = _compile(exe_patterns or [], "ścieżki exe")
+        self._cmdline_regex = _compile(cmdline_patterns or [], "linii poleceń")
+        self._title_regex = _compile(
+            DEFAULT_LOGIN_TITLE_PATTERNS if login_title_patterns is None else login_title_patterns,
+            "tytułu okna"
+        )
+        self._process_cache: Dict[ProcessKey, bool] = {}
+        self._title_cache: Dict[str, bool] = {}
+
+    def match_name(self, name: str) -> bool:
+        """Sprawdza samą nazwę procesu"""
+        return bool(self._name_regex and self._name_regex.search(name))
+
+    def _match_uncached(self, proc: psutil.Process, name: str) -> bool:
+        if self.match_name(name):
+            return True
+        # Ścieżka i linia poleceń wymagają osobnych odczytów - tylko gdy są reguły
+        try:
+            if self._exe_regex and self._exe_regex.search(proc.exe() or ""):
+                return True
+            if self._cmdline_regex and self._cmdline_regex.search(" ".join(proc.cmdline())):
+                return True
+        except (psutil.AccessDenied, psutil.ZombieProcess, OSError):
+            pass
+        return False
+
+    def match_process(self, proc: psutil.Process, seen: Optional[Set[ProcessKey]] = None) -> bool:
+        """
+        Sprawdza, czy proces jest klientem Metin2. Nazwa i czas utworzenia są brane
+        z proc.info (process_iter), jeśli są dostępne.
+
+        Args:
+            proc: Proces do sprawdzenia
+            seen: Zbiór, do którego dodawany jest klucz procesu (dla prune)
+        """
+        info = getattr(proc, 'info', None)
+        if info is None:
+            name, create_time = proc.name(), proc.create_time()
+        else:
+            # Brak uprawnień do pola process_iter zwraca None - bez ponownego odczytu
+            name, create_time = info.get('name'), info.get('create_time')
+        name = name or ""
+        key = (proc.pid, create_time or 0.0, name)
+        if seen is not None:
+            seen.add(key)
+        result = self._process_cache.get(key)
+        if result is None:
+            result = self._match_uncached(proc, name)
+            self._process_cache[key] = result
+        return result
+
+    def prune(self, seen: Set[ProcessKey]) -> None:
+        """Usuwa zapamiętane wyniki zakończonych procesów (gdy jest ich znacznie więcej niż działających)"""
+        if len(self._process_cache) > 2 * len(seen) + 64:
+            self._process_cache = {key: result for key, result in self._process_cache.items() if key in seen}
+
+    def is_login_title(self, title: str) -> bool:
+        """Sprawdza, czy tytuł okna oznacza ekran logowania"""
+        result = self._title_cache.get(title)
+        if result is None:
+            result = bool(self._title_regex and self._title_regex.search(title))
+            if len(self._title_cache) >= MAX_CACHED_TITLES:
+                self._title_cache.clear()
+            self._title_cache[title] = result
+        return result
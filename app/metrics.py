@@ -0,0 +1,200 @@
+"""
+Metryki M2Watcher w formacie tekstowym Prometheus
+Liczniki i histogramy są aktualizowane przyrostowo przez wątek monitorowania,
+a odczyt (GET /metrics) tylko je formatuje - bez psutil i bez dostępu do listy klientów
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Progi histogramu czasu cyklu (sekundy)
+TICK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CLIENT_STATES = ("logged_in", "logged_out", "hung", "paused")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Metryka z jedną (opcjonalną) etykietą"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+
+    def _sample(self, suffix: str, label_value: Optional[str], value: float, extra: str = "") -> str:
+        labels = []
+        if self.label and label_value is not None:
+            labels.append(f'{self.label}="{label_value}"')
+        if extra:
+            labels.append(extra)
+        label_text = "{" + ",".join(labels) + "}" if labels else ""
+        return f"{self.name}{suffix}{label_text} {_format_value(value)}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None,
+                 label_values: Sequence[str] = ()):
+        super().__init__(name, help_text, label)
+        # Znane wartości etykiety są widoczne od razu z zerem
+        self.values: Dict[Optional[str], float] = {value: 0 for value in label_values} if label else {None: 0}
+
+    def inc(self, label_value: Optional[str] = None, amount: float = 1) -> None:
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self) -> List[str]:
+        # list() kopiuje słownik atomowo - wątek monitorowania może w tym czasie dodać etykietę
+        return [self._sample("", label_value, value) for label_value, value in list(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, label_value: Optional[str] = None) -> None:
+        self.values[label_value] = value
+
+
+class CallbackGauge(Metric):
+    """Wartości odczytywane przy odczycie metryk z funkcji (np. długości kolejek)"""
+
+    def __init__(self, name: str, help_text: str, label: str, callback: Callable[[], Dict[str, float]],
+                 kind: str = "gauge"):
+        super().__init__(name, help_text, label)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        return [self._sample("", label_value, value) for label_value, value in self.callback().items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+        # Liczniki nieskumulowane - sumy progów są liczone dopiero przy odczycie
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self) -> List[str]:
+        counts, total_sum = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(self._sample("_bucket", None, cumulative, f'le="{_format_value(bound)}"'))
+        lines.append(self._sample("_sum", None, total_sum))
+        lines.append(self._sample("_count", None, cumulative))
+        return lines
+
+
+class WatcherMetrics:
+    """Metryki jednego watchera"""
+
+    def __init__(self):
+        self.start_time = Gauge("m2watcher_start_time_seconds", "Czas uruchomienia watchera (unix)")
+        self.start_time.set(time.time())
+        self.tick_duration = Histogram("m2watcher_tick_duration_seconds", "Czas jednego cyklu monitorowania",
+                                       TICK_BUCKETS)
+        self.probe_failures = Counter("m2watcher_probe_failures_total",
+                                      "Nieudane odczyty procesów klientów", "reason",
+                                      ("gone", "access_denied"))
+        self.client_events = Counter("m2watcher_client_events_total", "Zdarzenia klientów", "event",
+                                     ("discovered", "logout", "reconnect", "closed", "crashed", "hung", "responsive",
+                                      "unstable", "stable"))
+        self.clients = Gauge("m2watcher_clients", "Monitorowani klienci według stanu", "state", CLIENT_STATES)
+        self.metrics: List[Metric] = [self.start_time, self.tick_duration, self.probe_failures,
+                                      self.client_events, self.clients]
+
+    def attach_event_bus(self, bus) -> None:
+        """Dodaje głębokość kolejek i liczbę pominiętych zdarzeń ujść magistrali zdarzeń"""
+        self.metrics.append(CallbackGauge("m2watcher_sink_queue_depth",
+                                          "Zdarzenia oczekujące w kolejce ujścia (konsola, Discord, dźwięk, ...)",
+                                          "sink", bus.queue_depths))
+        self.metrics.append(CallbackGauge("m2watcher_sink_dropped_events_total",
+                                          "Zdarzenia pominięte przez przepełnioną kolejkę ujścia",
+                                          "sink", bus.dropped, kind="counter"))
+
+    def update_clients(self, clients, paused) -> None:
+        """Liczba klientów według stanu - wywoływane przez wątek monitorowania po cyklu"""
+        counts = dict.fromkeys(CLIENT_STATES, 0)
+        for pid, client in clients.items():
+            if pid in paused:
+                counts["paused"] += 1
+            elif client.is_hung:
+                counts["hung"] += 1
+            elif client.is_logged_in:
+                counts["logged_in"] += 1
+            else:
+                counts["logged_out"] += 1
+        for state, count in counts.items():
+            self.clients.set(count, state)
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MetricsServer:
+    """Lokalny serwer HTTP udostępniający /metrics"""
+
+    def __init__(self, metrics: WatcherMetrics, host: str = "127.0.0.1", port: int = 9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        """Uruchamia serwer w tle. Rzuca OSError, jeśli port jest zajęty."""
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="M2Watcher-metrics").start()
+
+    def close(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -2,19 +2,14 @@
 System powiadomień dla M2Watcher
 Obsługuje powiadomienia Discord
 """
-import requests
-import json
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Tuple, TYPE_CHECKING
 from config import Config
+from routing import NotificationRouter, Target
 
-# Import bota Discord (opcjonalny)
-try:
+# Bot Discord jest potrzebny tylko do adnotacji typów - sam obiekt bota
+# przekazuje main.py, który importuje discord.py dopiero gdy Discord jest włączony
+if TYPE_CHECKING:
     from discord_bot import M2WatcherBot
-    DISCORD_BOT_AVAILABLE = True
-except ImportError:
-    DISCORD_BOT_AVAILABLE = False
-    M2WatcherBot = None
 
 
 class NotificationManager:
@@ -24,6 +19,16 @@ class NotificationManager:
         self.config = config
         self.discord_enabled = config.get("discord.enabled", False)
         self.discord_bot = discord_bot
+        # Reguły discord.routes kierują powiadomienia klientów do różnych odbiorców
+        self.router = NotificationRouter(config.get("discord.routes", []), config.get("discord.user_id", ""))
+    
+    @property
+    def enabled(self) -> bool:
+        """
+        Czy jakikolwiek kanał powiadomień jest włączony.
+        Metody notify_* przyjmują też obiekt klienta, a jego tekst budują tylko gdy jest komu go wysłać.
+        """
+        return bool(self.discord_enabled and self.discord_bot)
     
     def send_discord_bot_message(self, message: str, title: str = "M2Watcher", 
                                  color: int = 0xff0000, user_id: Optional[str] = None) -> bool:
@@ -55,31 +60,71 @@ class NotificationManager:
             print(f"Błąd wysyłania wiadomości przez bota Discord: {e}")
             return False
     
-    def notify_logout(self, client_info: str, user_id: Optional[str] = None) -> None:
+    def notify_logout(self, client_info: object, user_id: Optional[str] = None) -> None:
         """Wysyła powiadomienie o wylogowaniu"""
-        message = f"⚠️ Wylogowanie wykryte: {client_info}"
-        self._send_all_notifications(message, "Wylogowanie", 0xff0000, user_id)
+        if self.enabled:
+            self._send_all_notifications(f"⚠️ Wylogowanie wykryte: {client_info}", "Wylogowanie", 0xff0000, user_id, client_info)
     
-    def notify_client_closed(self, client_info: str, user_id: Optional[str] = None) -> None:
+    def notify_client_closed(self, client_info: object, user_id: Optional[str] = None) -> None:
         """Wysyła powiadomienie o zamknięciu klienta"""
-        message = f"🔴 Klient zamknięty: {client_info}"
-        self._send_all_notifications(message, "Klient zamknięty", 0xff0000, user_id)
+        if self.enabled:
+            self._send_all_notifications(f"🔴 Klient zamknięty: {client_info}", "Klient zamknięty", 0xff0000, user_id, client_info)
     
-    def notify_client_crashed(self, client_info: str, user_id: Optional[str] = None) -> None:
+    def notify_client_crashed(self, client_info: object, user_id: Optional[str] = None) -> None:
         """Wysyła powiadomienie o crashu klienta"""
-        message = f"💥 Crash klienta: {client_info}"
-        self._send_all_notifications(message, "Crash klienta", 0xff0000, user_id)
+        if self.enabled:
+            self._send_all_notifications(f"💥 Crash klienta: {client_info}", "Crash klienta", 0xff0000, user_id, client_info)
+    
+    def notify_client_hung(self, client_info: object, user_id: Optional[str] = None) -> None:
+        """Wysyła powiadomienie o zawieszeniu klienta"""
+        if self.enabled:
+            self._send_all_notifications(f"🧊 Klient nie odpowiada: {client_info}", "Klient nie odpowiada", 0xff8800, user_id, client_info)
+    
+    def notify_client_unstable(self, client_info: object, transitions: Optional[int] = None,
+                               user_id: Optional[str] = None) -> None:
+        """Wysyła jedno powiadomienie o niestabilnym kliencie zamiast powiadomień o każdej zmianie stanu"""
+        if self.enabled:
+            count_info = f" ({transitions} zmian stanu)" if transitions is not None else ""
+            self._send_all_notifications(
+                f"📶 Niestabilne połączenie{count_info} - kolejne zmiany bez powiadomień: {client_info}",
+                "Niestabilne połączenie", 0xff8800, user_id, client_info
+            )
     
-    def notify_reconnect(self, client_info: str, user_id: Optional[str] = None) -> None:
+    def notify_client_stable(self, client_info: object, suppressed: Optional[int] = None,
+                             user_id: Optional[str] = None) -> None:
+        """Wysyła podsumowanie po ustabilizowaniu się klienta"""
+        if self.enabled:
+            count_info = f" (pominięte zmiany stanu: {suppressed})" if suppressed is not None else ""
+            self._send_all_notifications(
+                f"📶 Połączenie ustabilizowane{count_info}: {client_info}",
+                "Połączenie ustabilizowane", 0x00ff00, user_id, client_info
+            )
+    
+    def notify_host_offline(self, host: str, user_id: Optional[str] = None) -> None:
+        """Wysyła powiadomienie o utracie połączenia z agentem (tryb agregatora)"""
+        message = f"📡 Utracono połączenie z hostem: {host}"
+        self._send_all_notifications(message, "Host offline", 0xff8800, user_id)
+    
+    def notify_reconnect(self, client_info: object, user_id: Optional[str] = None) -> None:
         """Wysyła powiadomienie o ponownym zalogowaniu"""
-        message = f"✅ Ponowne zalogowanie: {client_info}"
-        self._send_all_notifications(message, "Ponowne zalogowanie", 0x00ff00, user_id)
+        if self.enabled:
+            self._send_all_notifications(f"✅ Ponowne zalogowanie: {client_info}", "Ponowne zalogowanie", 0x00ff00, user_id, client_info)
     
-    def _send_all_notifications(self, message: str, title: str, color: int, user_id: Optional[str] = None) -> None:
+    def _targets(self, client_info: object, user_id: Optional[str]) -> Tuple[Target, ...]:
+        """Odbiorcy powiadomienia - jawnie podany user_id pomija reguły kierowania"""
+        if user_id:
+            return (Target(None, user_id),)
+        return self.router.resolve(client_info)
+    
+    def _send_all_notifications(self, message: str, title: str, color: int, user_id: Optional[str] = None,
+                                client_info: object = None) -> None:
         """Wysyła powiadomienia przez wszystkie włączone kanały"""
-        # Discord bot
+        # Discord bot - wszyscy odbiorcy klienta równolegle
         if self.discord_enabled and self.discord_bot:
             bot_token = self.config.get("discord.bot_token", "")
             if bot_token:
-                self.send_discord_bot_message(message, title, color, user_id)
-
+                # Domyślny odbiorca bez user_id (jak dotąd) nie dostaje powiadomień
+                targets = [target for target in self._targets(client_info, user_id)
+                           if target.user_id or target.channel_id]
+                if targets:
+                    self.discord_bot.send_to_targets_sync(message, title, targets, color)
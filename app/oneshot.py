@@ -0,0 +1,87 @@
+"""
+Jednorazowe sprawdzenie klientów Metin2 (main.py --once)
+Jedno wykrycie procesów i odczyt połączeń, stan na podstawie połączeń sieciowych,
+wynik na standardowe wyjście. Importuje tylko psutil i moduły dopasowania/odczytu
+procesów - bez watchera, bota Discord, dźwięku i zapisu konfiguracji - aby mogło
+być często uruchamiane przez skrypty i systemy monitorowania
+"""
+import json
+import sys
+import time
+from typing import Iterator
+
+import psutil
+
+import matcher
+import probe
+
+FORMATS = ("text", "json", "ndjson")
+
+
+def scan_clients(client_matcher: matcher.ClientMatcher) -> Iterator[dict]:
+    """Wykrywa klientów i zwraca ich stan (po jednym, w miarę odczytu)"""
+    for proc in psutil.process_iter(['name', 'create_time']):
+        try:
+            if not client_matcher.match_process(proc):
+                continue
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        record = probe.probe_process(proc)
+        if record is None:
+            continue
+        endpoints = probe.read_endpoints(proc)
+        yield {
+            "pid": record.pid,
+            "name": record.name,
+            "create_time": record.create_time,
+            "is_logged_in": bool(endpoints.established),
+            "num_connections": len(endpoints.established),
+            "connecting": endpoints.connecting,
+            "endpoints": [f"{ip}:{port}" for ip, port in sorted(endpoints.established)],
+            "cpu_time": record.cpu_time,
+            "access_denied": record.access_denied,
+        }
+
+
+def _format_text(client: dict) -> str:
+    status = "Zalogowany" if client["is_logged_in"] else "Wylogowany"
+    connections_info = f"({client['num_connections']} połączeń)" if client["num_connections"] > 0 else "(brak połączeń)"
+    return f"PID: {client['pid']} | {client['name']} | {status} {connections_info}"
+
+
+def run_once(config, output_format: str = "text", stream=None) -> int:
+    """
+    Wykonuje jedno sprawdzenie i wypisuje wynik.
+
+    Args:
+        config: Konfiguracja (reguły process_match)
+        output_format: "text", "json" (jeden dokument) lub "ndjson" (jedna linia na klienta, od razu)
+        stream: Strumień wyjścia (domyślnie sys.stdout)
+
+    Returns:
+        Liczba znalezionych klientów
+    """
+    stream = stream or sys.stdout
+    client_matcher = matcher.ClientMatcher(
+        process_names=config.get("process_match.names"),
+        exe_patterns=config.get("process_match.exe_patterns"),
+        cmdline_patterns=config.get("process_match.cmdline_patterns"),
+    )
+    timestamp = time.time()
+    count = 0
+    clients = []
+    for client in scan_clients(client_matcher):
+        count += 1
+        if output_format == "ndjson":
+            stream.write(json.dumps({"timestamp": timestamp, **client}, ensure_ascii=False) + "\n")
+            stream.flush()
+        elif output_format == "json":
+            clients.append(client)
+        else:
+            stream.write(_format_text(client) + "\n")
+    if output_format == "json":
+        stream.write(json.dumps({"timestamp": timestamp, "clients": clients}, ensure_ascii=False) + "\n")
+    elif output_format == "text" and not count:
+        stream.write("Brak aktywnych klientów Metin2\n")
+    stream.flush()
+    return count
@@ -0,0 +1,96 @@
+"""
+Odczyt danych procesu klienta dla M2Watcher
+Wszystkie tanie dane procesu (nazwa, czas utworzenia, liczniki I/O, czas CPU) są
+odczytywane jednym przebiegiem w psutil.Process.oneshot() do zwartego rekordu,
+który dalej trafia do detektorów i kodu statusu zamiast ponownych odczytów
+"""
+import platform
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+
+import psutil
+
+# Na Windows liczniki I/O procesu obejmują operacje na gniazdach (other_bytes), więc przyrost
+# bajtów odzwierciedla ruch sieciowy. Na innych systemach send()/recv() nie są w nich liczone
+# i przyrost bajtów służy tylko jako sygnał do pełnego sprawdzenia klienta.
+IO_BYTES_INCLUDE_NETWORK = platform.system() == 'Windows'
+
+Endpoint = Tuple[str, int]
+
+
+class Endpoints(NamedTuple):
+    """Zdalne adresy połączeń procesu"""
+    established: FrozenSet[Endpoint]  # (ip, port) połączeń ESTABLISHED
+    connecting: int = 0  # Liczba połączeń w trakcie nawiązywania (SYN_SENT)
+
+
+class ProbeRecord:
+    """Wynik jednego odczytu procesu klienta"""
+
+    __slots__ = ("pid", "name", "create_time", "io_bytes", "cpu_time", "endpoints", "access_denied")
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.name = ""
+        self.create_time = 0.0
+        self.io_bytes = 0  # Suma bajtów I/O (patrz IO_BYTES_INCLUDE_NETWORK)
+        self.cpu_time = 0.0  # Czas CPU user + system (sekundy)
+        self.endpoints: Optional[Endpoints] = None  # Tylko gdy odczytano połączenia (kosztowne)
+        self.access_denied = False  # Część danych niedostępna (brak uprawnień)
+
+
+def _io_bytes(io_counters) -> int:
+    # psutil nie rozdziela ruchu sieciowego procesu - operacje na gniazdach
+    # trafiają do other_bytes (Windows) lub read_chars/write_chars (Linux)
+    return (getattr(io_counters, 'read_chars', io_counters.read_bytes)
+            + getattr(io_counters, 'write_chars', io_counters.write_bytes)
+            + getattr(io_counters, 'other_bytes', 0))
+
+
+def probe_process(proc: psutil.Process) -> Optional[ProbeRecord]:
+    """
+    Odczytuje tanie dane procesu w jednym kontekście oneshot().
+    Nazwa i czas utworzenia pobrane wcześniej przez process_iter (proc.info) nie są odczytywane ponownie.
+
+    Returns:
+        ProbeRecord lub None, jeśli proces już nie istnieje
+    """
+    record = ProbeRecord(proc.pid)
+    info = getattr(proc, 'info', None) or {}
+    try:
+        with proc.oneshot():
+            try:
+                record.name = info.get('name') or proc.name()
+                record.create_time = info.get('create_time') or proc.create_time()
+            except psutil.AccessDenied:
+                record.access_denied = True
+
+            try:
+                io_counters = proc.io_counters()
+                if io_counters:
+                    record.io_bytes = _io_bytes(io_counters)
+            except (psutil.AccessDenied, AttributeError):
+                record.access_denied = True
+
+            try:
+                cpu_times = proc.cpu_times()
+                record.cpu_time = cpu_times.user + cpu_times.system
+            except psutil.AccessDenied:
+                record.access_denied = True
+    except psutil.NoSuchProcess:
+        return None
+    return record
+
+
+def read_endpoints(proc: psutil.Process) -> Endpoints:
+    """Zwraca zdalne adresy połączeń procesu (kosztowne - wylicza tablicę połączeń)"""
+    established = []
+    connecting = 0
+    try:
+        for c in proc.net_connections():
+            if c.status == psutil.CONN_ESTABLISHED and c.raddr:
+                established.append((c.raddr[0], c.raddr[1]))
+            elif c.status == psutil.CONN_SYN_SENT:
+                connecting += 1
+    except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+        pass
+    return Endpoints(frozenset(established), connecting)
@@ -0,0 +1,190 @@
+"""
+Binarny protokół agent -> agregator dla M2Watcher
+Każda wiadomość to ramka: nagłówek (wersja, typ, długość) + zwarty payload
+"""
+import struct
+from typing import List, Tuple
+
+PROTOCOL_VERSION = 1
+
+# Nagłówek ramki: wersja protokołu (u8), typ wiadomości (u8), długość payloadu (u16)
+HEADER = struct.Struct('!BBH')
+MAX_PAYLOAD = 0xFFFF
+
+# Typy wiadomości
+MSG_HELLO = 1      # host_id i token agenta - wysyłane zaraz po połączeniu
+MSG_EVENT = 2      # zmiana stanu klienta
+MSG_TELEMETRY = 3  # próbkowana telemetria wszystkich klientów hosta
+MSG_HEARTBEAT = 4  # podtrzymanie połączenia gdy nie ma innego ruchu
+
+# Kody zdarzeń klientów
+EVENT_DISCOVERED = 1
+EVENT_LOGOUT = 2
+EVENT_RECONNECT = 3
+EVENT_CLOSED = 4
+EVENT_CRASHED = 5
+EVENT_HUNG = 6
+EVENT_RESPONSIVE = 7
+EVENT_UNSTABLE = 8
+EVENT_STABLE = 9
+
+EVENT_CODES = {
+    "discovered": EVENT_DISCOVERED,
+    "logout": EVENT_LOGOUT,
+    "reconnect": EVENT_RECONNECT,
+    "closed": EVENT_CLOSED,
+    "crashed": EVENT_CRASHED,
+    "hung": EVENT_HUNG,
+    "responsive": EVENT_RESPONSIVE,
+    "unstable": EVENT_UNSTABLE,
+    "stable": EVENT_STABLE,
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+# Zdarzenie: kod (u8), pid (u32), create_time (f64), czas zdarzenia (f64),
+# zalogowany (bool), liczba połączeń (u16) + tytuł okna (string)
+EVENT_STRUCT = struct.Struct('!BIdd?H')
+
+# Telemetria: czas próbki (f64), liczba rekordów (u16), a potem rekordy:
+# pid (u32), przyrost bajtów od poprzedniej próbki (u32), połączenia (u16), zalogowany (bool)
+TELEMETRY_HEADER = struct.Struct('!dH')
+TELEMETRY_RECORD = struct.Struct('!IIH?')
+MAX_TELEMETRY_RECORDS = (MAX_PAYLOAD - TELEMETRY_HEADER.size) // TELEMETRY_RECORD.size
+
+# Telemetria jednego klienta: (pid, bytes_delta, num_connections, is_logged_in)
+TelemetryRecord = Tuple[int, int, int, bool]
+
+
+class ProtocolError(Exception):
+    """Błąd dekodowania ramki protokołu"""
+
+
+def _encode_str(value: str) -> bytes:
+    """Koduje string jako u8 długość + UTF-8 (obcięty do 255 bajtów)"""
+    data = value.encode('utf-8')[:255]
+    # Obcięcie mogło przeciąć znak wielobajtowy - usuń niepełną końcówkę
+    data = data.decode('utf-8', errors='ignore').encode('utf-8')
+    return bytes((len(data),)) + data
+
+
+def _decode_str(payload: bytes, offset: int) -> Tuple[str, int]:
+    """Dekoduje string zapisany przez _encode_str, zwraca (wartość, nowy offset)"""
+    if offset >= len(payload):
+        raise ProtocolError("Brak długości stringa")
+    length = payload[offset]
+    end = offset + 1 + length
+    if end > len(payload):
+        raise ProtocolError("Ucięty string")
+    return payload[offset + 1:end].decode('utf-8', errors='replace'), end
+
+
+def _frame(msg_type: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload za duży: {len(payload)} bajtów")
+    return HEADER.pack(PROTOCOL_VERSION, msg_type, len(payload)) + payload
+
+
+def encode_hello(host_id: str, token: str = "") -> bytes:
+    """Tworzy ramkę powitalną z identyfikatorem hosta i wspólnym tokenem agregatora"""
+    return _frame(MSG_HELLO, _encode_str(host_id) + _encode_str(token))
+
+
+def encode_heartbeat() -> bytes:
+    """Tworzy ramkę podtrzymania połączenia"""
+    return _frame(MSG_HEARTBEAT)
+
+
+def encode_event(event: str, pid: int, create_time: float, timestamp: float,
+                 is_logged_in: bool, num_connections: int, window_title: str) -> bytes:
+    """Tworzy ramkę zdarzenia klienta"""
+    payload = EVENT_STRUCT.pack(
+        EVENT_CODES[event], pid, create_time, timestamp,
+        is_logged_in, min(num_connections, 0xFFFF)
+    ) + _encode_str(window_title or "")
+    return _frame(MSG_EVENT, payload)
+
+
+def encode_telemetry(timestamp: float, records: List[TelemetryRecord]) -> List[bytes]:
+    """
+    Tworzy ramki telemetrii. Przy bardzo dużej liczbie klientów rekordy
+    są dzielone na kilka ramek, aby zmieścić się w limicie payloadu.
+    """
+    frames = []
+    for start in range(0, max(len(records), 1), MAX_TELEMETRY_RECORDS):
+        chunk = records[start:start + MAX_TELEMETRY_RECORDS]
+        parts = [TELEMETRY_HEADER.pack(timestamp, len(chunk))]
+        for pid, bytes_delta, num_connections, is_logged_in in chunk:
+            parts.append(TELEMETRY_RECORD.pack(
+                pid, max(0, min(bytes_delta, 0xFFFFFFFF)),
+                min(num_connections, 0xFFFF), is_logged_in
+            ))
+        frames.append(_frame(MSG_TELEMETRY, b"".join(parts)))
+    return frames
+
+
+def decode_header(header: bytes) -> Tuple[int, int]:
+    """
+    Dekoduje nagłówek ramki.
+
+    Returns:
+        (typ wiadomości, długość payloadu)
+    """
+    version, msg_type, length = HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Nieobsługiwana wersja protokołu: {version}")
+    return msg_type, length
+
+
+def decode_payload(msg_type: int, payload: bytes):
+    """
+    Dekoduje payload wiadomości.
+
+    Returns:
+        MSG_HELLO: (host_id, token)
+        MSG_EVENT: (event, pid, create_time, timestamp, is_logged_in, num_connections, window_title)
+        MSG_TELEMETRY: (timestamp, lista TelemetryRecord)
+        MSG_HEARTBEAT: None
+    """
+    try:
+        if msg_type == MSG_HELLO:
+            host_id, offset = _decode_str(payload, 0)
+            # Token jest opcjonalny - starsze agenty wysyłają sam host_id
+            token = _decode_str(payload, offset)[0] if offset < len(payload) else ""
+            return host_id, token
+
+        if msg_type == MSG_EVENT:
+            code, pid, create_time, timestamp, is_logged_in, num_connections = \
+                EVENT_STRUCT.unpack_from(payload, 0)
+            window_title, _ = _decode_str(payload, EVENT_STRUCT.size)
+            if code not in EVENT_NAMES:
+                raise ProtocolError(f"Nieznany kod zdarzenia: {code}")
+            return (EVENT_NAMES[code], pid, create_time, timestamp,
+                    is_logged_in, num_connections, window_title)
+
+        if msg_type == MSG_TELEMETRY:
+            timestamp, count = TELEMETRY_HEADER.unpack_from(payload, 0)
+            records = [
+                TELEMETRY_RECORD.unpack_from(payload, TELEMETRY_HEADER.size + i * TELEMETRY_RECORD.size)
+                for i in range(count)
+            ]
+            return timestamp, records
+
+        if msg_type == MSG_HEARTBEAT:
+            return None
+    except struct.error as e:
+        raise ProtocolError(f"Uszkodzony payload: {e}")
+
+    raise ProtocolError(f"Nieznany typ wiadomości: {msg_type}")
+
+
+async def read_message(reader) -> Tuple[int, object]:
+    """
+    Odczytuje i dekoduje jedną wiadomość ze strumienia asyncio.
+
+    Returns:
+        (typ wiadomości, zdekodowana treść)
+    """
+    header = await reader.readexactly(HEADER.size)
+    msg_type, length = decode_header(header)
+    payload = await reader.readexactly(length) if length else b""
+    return msg_type, decode_payload(msg_type, payload)
@@ -0,0 +1,132 @@
+"""
+Lokalne API HTTP do zapytań o zdarzenia klientów (tryb agregatora)
+Odpowiedzi ze zdarzeniami są strumieniowane jako NDJSON i stronicowane kursorem
+"""
+import json
+import threading
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+from werkzeug.serving import make_server
+
+from event_store import EventStore, EVENT_COLUMNS, parse_time, query_events, query_rollups, query_telemetry
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def create_app(store: EventStore) -> Flask:
+    """Tworzy aplikację Flask z endpointami zapytań"""
+    app = Flask("m2watcher")
+
+    @app.errorhandler(ValueError)
+    def bad_request(error):
+        return jsonify({"error": f"Nieprawidłowy parametr: {error}"}), 400
+
+    @app.route("/events")
+    def events():
+        """Zdarzenia filtrowane po host, pid, event, since, until; strona: limit, cursor"""
+        limit = min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        pid = request.args.get("pid")
+        # Parametry są sprawdzane przed otwarciem połączenia - błąd (400) nie zostawia go otwartego
+        filters = dict(
+            host=request.args.get("host"),
+            pid=int(pid) if pid else None,
+            event=request.args.get("event"),
+            since=parse_time(request.args.get("since")),
+            until=parse_time(request.args.get("until")),
+            after_id=int(request.args.get("cursor", 0)),
+            limit=max(limit, 1),
+        )
+        conn = store.connect_reader()
+        try:
+            rows, next_cursor = query_events(conn, **filters)
+        except Exception:
+            conn.close()
+            raise
+
+        def generate():
+            try:
+                for row in rows:
+                    yield json.dumps(dict(zip(EVENT_COLUMNS, row)), ensure_ascii=False) + "\n"
+            finally:
+                conn.close()
+
+        headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=headers)
+
+    @app.route("/rollups")
+    def rollups():
+        """Czas zalogowania i liczba wylogowań na klienta w okresie since..until"""
+        conn = store.connect_reader()
+        try:
+            results = query_rollups(
+                conn,
+                host=request.args.get("host"),
+                since=parse_time(request.args.get("since")),
+                until=parse_time(request.args.get("until")),
+            )
+        finally:
+            conn.close()
+
+        def generate():
+            for entry in results:
+                yield json.dumps(entry, ensure_ascii=False) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    @app.route("/telemetry")
+    def telemetry():
+        """Telemetria (przyrost bajtów, połączenia, czas w stanie) w kubełkach; filtry host, pid, since, until, step"""
+        pid = request.args.get("pid")
+        step = request.args.get("step")
+        resolution = request.args.get("resolution")
+        conn = store.connect_reader()
+        try:
+            chosen, rows = query_telemetry(
+                conn,
+                host=request.args.get("host"),
+                pid=int(pid) if pid else None,
+                since=parse_time(request.args.get("since")),
+                until=parse_time(request.args.get("until")),
+                step=float(step) if step else None,
+                resolution=int(resolution) if resolution else None,
+                retention=store.retention,
+            )
+        except Exception:
+            conn.close()
+            raise
+
+        def generate():
+            try:
+                for row in rows:
+                    yield json.dumps(dict(zip(row.keys(), row)), ensure_ascii=False) + "\n"
+            finally:
+                conn.close()
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                        headers={"X-Resolution": str(chosen)})
+
+    return app
+
+
+def start_query_api(store: EventStore, host: str = "127.0.0.1", port: int = 7879):
+    """
+    Uruchamia API w wątku w tle.
+
+    Returns:
+        Serwer (można go zatrzymać przez shutdown()) lub None, jeśli port jest niedostępny
+    """
+    try:
+        server = make_server(host, port, create_app(store), threaded=True)
+    except OSError as e:
+        print(f"API zapytań niedostępne ({host}:{port}): {e}")
+        return None
+    except SystemExit:
+        # werkzeug przy zajętym porcie wypisuje komunikat i wywołuje sys.exit(1) -
+        # agregator (agenci, Discord) musi działać dalej bez API
+        print(f"API zapytań niedostępne: port {host}:{port} jest zajęty")
+        return None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"API zapytań nasłuchuje na http://{host}:{port}")
+    return server
@@ -0,0 +1,105 @@
+"""
+Kierowanie powiadomień klientów do odbiorców Discord
+Reguły z konfiguracji (discord.routes) przypisują klientów - po tytule okna, tagu
+postaci albo zakresie PID - do użytkowników lub kanałów. Odbiorcy klienta są
+wyznaczani raz i zapamiętywani do zmiany klienta (PID, czas utworzenia, tytuł okna)
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+# Limit zapamiętanych klientów - po przekroczeniu pamięć jest czyszczona
+MAX_CACHED_CLIENTS = 1024
+
+
+class Target(NamedTuple):
+    """
+    Odbiorca powiadomienia. channel_id None oznacza kanał z konfiguracji (discord.channel_id),
+    "" - wiadomość prywatną do user_id
+    """
+    channel_id: Optional[str]
+    user_id: str
+
+
+class RouteRule:
+    """Reguła kierowania - wszystkie podane warunki muszą być spełnione"""
+
+    __slots__ = ("title", "tag", "pid_range", "target")
+
+    def __init__(self, title: Optional[Pattern], tag: str, pid_range: Optional[Tuple[int, int]], target: Target):
+        self.title = title
+        self.tag = tag
+        self.pid_range = pid_range
+        self.target = target
+
+    @classmethod
+    def from_config(cls, rule: dict) -> "RouteRule":
+        """
+        Tworzy regułę z wpisu konfiguracji, np.
+        {"title": "Wojownik", "tag": "[ANIA]", "pids": [1000, 2000], "user_id": "...", "channel_id": "..."}
+
+        Raises:
+            ValueError: Błędny wzorzec, zakres PID albo brak odbiorcy
+        """
+        user_id = str(rule.get("user_id") or "")
+        channel_id = str(rule.get("channel_id") or "")
+        if not user_id and not channel_id:
+            raise ValueError("brak user_id i channel_id")
+        try:
+            title = re.compile(rule["title"], re.IGNORECASE) if rule.get("title") else None
+        except re.error as e:
+            raise ValueError(f"nieprawidłowy wzorzec tytułu: {e}")
+        pid_range = None
+        if rule.get("pids"):
+            low, high = (int(value) for value in rule["pids"])
+            if low > high:
+                raise ValueError(f"pusty zakres PID {low}-{high}")
+            pid_range = (low, high)
+        tag = str(rule.get("tag") or "").lower()
+        return cls(title, tag, pid_range, Target(channel_id, user_id))
+
+    def matches(self, pid: Optional[int], title: str) -> bool:
+        if self.pid_range and (pid is None or not self.pid_range[0] <= pid <= self.pid_range[1]):
+            return False
+        if self.tag and self.tag not in title.lower():
+            return False
+        if self.title and not self.title.search(title):
+            return False
+        return True
+
+
+class NotificationRouter:
+    """Wyznacza odbiorców powiadomień klienta na podstawie reguł"""
+
+    def __init__(self, rules: Optional[List[dict]] = None, default_user_id: str = ""):
+        """
+        Args:
+            rules: Reguły z konfiguracji (discord.routes)
+            default_user_id: Odbiorca klientów, do których nie pasuje żadna reguła (discord.user_id)
+        """
+        self.rules: List[RouteRule] = []
+        for index, rule in enumerate(rules or []):
+            try:
+                self.rules.append(RouteRule.from_config(rule))
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                print(f"Ostrzeżenie: Nieprawidłowa reguła discord.routes[{index}] - pomijanie ({e})")
+        self.default_targets: Tuple[Target, ...] = (Target(None, default_user_id),)
+        self._cache: Dict[tuple, Tuple[Target, ...]] = {}
+
+    def resolve(self, client_info: object) -> Tuple[Target, ...]:
+        """
+        Zwraca odbiorców powiadomienia o kliencie (bez powtórzeń). Obiekty bez pola pid
+        (np. sam tekst) trafiają do domyślnego odbiorcy.
+        """
+        pid = getattr(client_info, "pid", None)
+        if not self.rules or pid is None:
+            return self.default_targets
+        title = getattr(client_info, "window_title", "") or ""
+        key = (getattr(client_info, "host", None), pid, getattr(client_info, "create_time", None), title)
+        targets = self._cache.get(key)
+        if targets is None:
+            matched = dict.fromkeys(rule.target for rule in self.rules if rule.matches(pid, title))
+            targets = tuple(matched) or self.default_targets
+            if len(self._cache) >= MAX_CACHED_CLIENTS:
+                self._cache.clear()
+            self._cache[key] = targets
+        return targets
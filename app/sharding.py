@@ -0,0 +1,427 @@
+"""
+Wieloprocesowy watcher dla hostów z dużą liczbą klientów
+Monitorowane PID-y są dzielone między N procesów roboczych, z których każdy
+sprawdza tylko swoją część. Koordynator wykrywa nowe procesy, przydziela je
+robotnikom, odbiera zwarte zmiany stanu i jako jedyny wysyła powiadomienia
+oraz wyświetla status
+"""
+import multiprocessing
+import queue
+import time
+from typing import Dict, List, Optional
+
+import psutil
+
+import stability
+import state_snapshot
+from m2watcher import Metin2Client, Metin2Watcher
+
+# Wiadomości koordynator -> robotnik
+CMD_ASSIGN = "assign"      # (CMD_ASSIGN, [(pid, rekord klienta lub None)])
+CMD_UNASSIGN = "unassign"  # (CMD_UNASSIGN, [(pid, nowy robotnik)]) - przeniesienie do innego robotnika
+CMD_PAUSE = "pause"        # (CMD_PAUSE, [(pid, wstrzymany)]) - komenda kanału sterowania
+CMD_REPROBE = "reprobe"    # (CMD_REPROBE, [pid]) - wymuszenie pełnego sprawdzenia
+CMD_STOP = "stop"
+
+# Wiadomość robotnik -> koordynator:
+# (worker_id, [(zdarzenie, powód lub kod wyjścia, rekord klienta, stan klienta)],
+#  [stany klientów zmienione od ostatniej wiadomości])
+# Rekord (state_snapshot) jest wysyłany tylko przy zdarzeniach; co cykl porównywany i wysyłany
+# jest jedynie krótki stan z _client_state - bez liczników bajtów, które zmieniają się stale.
+# Zdarzenie EVENT_MIGRATE niesie pełny rekord klienta oddanego przez robotnika (powód = nowy robotnik),
+# bo kopia koordynatora ma stan detektorów tylko z ostatniego zdarzenia
+EVENT_MIGRATE = "migrate"
+
+# Jak często robotnik sprawdza zgłoszenia monitora zakończeń podczas czekania na komendy
+EXIT_CHECK_INTERVAL = 0.05
+
+
+def _client_state(client: Metin2Client) -> tuple:
+    """Stan klienta potrzebny koordynatorowi (status, kanał sterowania, !client)"""
+    return (
+        client.pid,
+        client.window_title,
+        client.is_logged_in,
+        client.num_connections,
+        client.is_hung,
+        tuple(sorted(client.remote_endpoints)),
+        client.endpoint_event,
+        bool(client.login_state and client.login_state.unstable),
+    )
+
+
+def _apply_state(client: Metin2Client, state: tuple) -> None:
+    """Przenosi stan z _client_state na klienta koordynatora"""
+    (_, client.window_title, client.is_logged_in, client.num_connections, client.is_hung,
+     endpoints, client.endpoint_event, unstable) = state
+    client.remote_endpoints = frozenset(endpoints)
+    if unstable or client.login_state:
+        # Koordynator nie prowadzi maszyny stanów - odzwierciedla tylko oznaczenie robotnika
+        if client.login_state is None:
+            client.login_state = stability.LoginStateMachine(client.is_logged_in, time.monotonic())
+        client.login_state.unstable = unstable
+
+
+class _ShardWorkerWatcher(Metin2Watcher):
+    """Watcher działający w procesie roboczym - sprawdza tylko przydzielone PID-y"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.assigned: Dict[int, Optional[psutil.Process]] = {}
+        self.outbox: List[tuple] = []
+
+    def _init_outputs(self, config, event_log: str) -> None:
+        # Zdarzenia zgłasza i powiadamia koordynator - bez konfiguracji, powiadomień i ujść
+        pass
+
+    def find_metin2_processes(self) -> List[psutil.Process]:
+        processes = []
+        for pid, proc in list(self.assigned.items()):
+            try:
+                if proc is None:
+                    proc = psutil.Process(pid)
+                    self.assigned[pid] = proc
+                if proc.is_running():
+                    processes.append(proc)
+                    continue
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+            # Proces zakończony - update_clients zgłosi zamknięcie, PID przestaje być nasz
+            del self.assigned[pid]
+        return processes
+
+    # Zamiast komunikatów i powiadomień robotnik tylko zbiera zdarzenia dla koordynatora
+
+    def _report(self, event: str, reason, client: Metin2Client) -> None:
+        self.outbox.append((event, reason, state_snapshot.client_to_record(client), _client_state(client)))
+
+    def handle_client_discovered(self, client: Metin2Client) -> None:
+        self._report("discovered", "", client)
+
+    def handle_client_logout(self, client: Metin2Client) -> None:
+        self._report("logout", "", client)
+
+    def handle_client_reconnect(self, client: Metin2Client) -> None:
+        self._report("reconnect", "", client)
+
+    def handle_client_closed(self, client: Metin2Client, reason: str) -> None:
+        self._report("closed", reason, client)
+
+    def handle_client_crashed(self, client: Metin2Client, exit_code) -> None:
+        self._report("crashed", exit_code, client)
+
+    def handle_client_hung(self, client: Metin2Client) -> None:
+        self._report("hung", "", client)
+
+    def handle_client_responsive(self, client: Metin2Client) -> None:
+        self._report("responsive", "", client)
+
+    def handle_client_unstable(self, client: Metin2Client, transitions: int) -> None:
+        self._report("unstable", transitions, client)
+
+    def handle_client_stable(self, client: Metin2Client, suppressed: int) -> None:
+        self._report("stable", suppressed, client)
+
+
+def _worker_main(worker_id: int, commands: multiprocessing.Queue, results: multiprocessing.Queue,
+                 settings: dict) -> None:
+    """Główna pętla procesu roboczego"""
+    watcher = _ShardWorkerWatcher(sound_enabled=False, **settings)
+    try:
+        _worker_loop(worker_id, watcher, commands, results)
+    except KeyboardInterrupt:
+        pass  # Ctrl+C trafia do całej grupy procesów - zatrzymanie obsługuje koordynator
+    finally:
+        # Robotnik nie zapisuje stanu (robi to koordynator) - zwalnia tylko zasoby
+        if watcher.exit_monitor:
+            watcher.exit_monitor.close()
+        watcher.bus.close()
+
+
+def _worker_loop(worker_id: int, watcher: _ShardWorkerWatcher, commands: multiprocessing.Queue,
+                 results: multiprocessing.Queue) -> None:
+    last_sent: Dict[int, tuple] = {}
+
+    while True:
+        # Czekanie na komendy jest jednocześnie przerwą między sprawdzeniami
+        deadline = time.monotonic() + watcher.check_interval
+        try:
+            while True:
+                timeout = deadline - time.monotonic()
+                if watcher.exit_monitor:
+                    timeout = min(timeout, EXIT_CHECK_INTERVAL)
+                    if watcher.exit_monitor.wakeup.is_set():
+                        # Zakończenie procesu zgłaszamy od razu, bez czekania na pełne sprawdzenie
+                        watcher.process_exits()
+                        if watcher.outbox:
+                            results.put((worker_id, watcher.outbox, []))
+                            watcher.outbox = []
+                try:
+                    command, payload = commands.get(timeout=timeout) if timeout > 0 else commands.get_nowait()
+                except queue.Empty:
+                    if time.monotonic() < deadline:
+                        continue
+                    raise
+                if command == CMD_STOP:
+                    return
+                if command == CMD_ASSIGN:
+                    for pid, record in payload:
+                        watcher.assigned.setdefault(pid, None)
+                        if record is not None:
+                            watcher.clients[pid] = state_snapshot.client_from_record(record, Metin2Client)
+                            if watcher.exit_monitor:
+                                watcher.exit_monitor.watch(pid)
+                elif command == CMD_UNASSIGN:
+                    migrated = []
+                    for pid, target in payload:
+                        watcher.assigned.pop(pid, None)
+                        watcher.paused.discard(pid)
+                        last_sent.pop(pid, None)
+                        client = watcher.clients.pop(pid, None)
+                        if client is not None:
+                            migrated.append((EVENT_MIGRATE, target, state_snapshot.client_to_record(client),
+                                             _client_state(client)))
+                    if migrated:
+                        results.put((worker_id, migrated, []))
+                elif command == CMD_PAUSE:
+                    for pid, paused in payload:
+                        watcher.set_paused(pid, paused)
+                elif command == CMD_REPROBE:
+                    for pid in payload:
+                        watcher.request_reprobe(pid)
+        except queue.Empty:
+            pass
+
+        watcher.update_clients()
+        watcher.paused.intersection_update(watcher.clients)
+
+        # Wyślij tylko klientów, których stan zmienił się od ostatniej wiadomości
+        changed = []
+        for pid, client in watcher.clients.items():
+            state = _client_state(client)
+            if last_sent.get(pid) != state:
+                last_sent[pid] = state
+                changed.append(state)
+        for pid in list(last_sent):
+            if pid not in watcher.clients:
+                del last_sent[pid]
+
+        if watcher.outbox or changed:
+            results.put((worker_id, watcher.outbox, changed))
+            watcher.outbox = []
+
+
+class ShardedWatcher(Metin2Watcher):
+    """Koordynator wielu procesów roboczych"""
+
+    def __init__(self, workers: int = 2, **kwargs):
+        """
+        Inicjalizuje koordynatora
+
+        Args:
+            workers: Liczba procesów roboczych
+            **kwargs: Argumenty Metin2Watcher (przekazywane też robotnikom)
+        """
+        # Zakończenia procesów wykrywają robotnicy, którzy obserwują swoich klientów
+        kwargs["exit_detection"] = False
+        super().__init__(**kwargs)
+        self.num_workers = max(1, workers)
+        self._settings = {
+            "check_interval": self.check_interval,
+            "network_check_samples": self.network_check_samples,
+            "network_threshold": self.network_threshold,
+            "probe_recheck_interval": self.probe_recheck_interval,
+            "probe_cpu_threshold": self.probe_cpu_threshold,
+            "detector_names": [detector.name for detector in self.detector_scheduler.detectors],
+            "detector_budget_ms": self.detector_scheduler.budget_ms,
+            "hung_timeout": self.hung_timeout,
+            "flap_hysteresis": self.flap_policy.hysteresis,
+            "flap_min_dwell": self.flap_policy.min_dwell,
+            "flap_window": self.flap_policy.window,
+            "flap_threshold": self.flap_policy.threshold,
+            "login_title_patterns": kwargs.get("login_title_patterns"),
+        }
+        self._workers: List[multiprocessing.Process] = []
+        self._commands: List[multiprocessing.Queue] = []
+        self._results: Optional[multiprocessing.Queue] = None
+        # PID -> numer robotnika
+        self._assignment: Dict[int, int] = {}
+
+    def start_workers(self) -> None:
+        """Uruchamia procesy robocze"""
+        if self._workers:
+            return
+        self._results = multiprocessing.Queue()
+        for worker_id in range(self.num_workers):
+            commands = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=_worker_main,
+                args=(worker_id, commands, self._results, self._settings),
+                name=f"M2Watcher-shard-{worker_id}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+            self._commands.append(commands)
+        # Klienci przywróceni ze snapshotu trafiają do robotników razem ze stanem
+        for pid in self.clients:
+            self._assign(pid, self._least_loaded())
+
+    def stop_workers(self) -> None:
+        """Zatrzymuje procesy robocze"""
+        for commands in self._commands:
+            commands.put((CMD_STOP, None))
+        for worker in self._workers:
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._commands = []
+        self._assignment = {}
+
+    def _load(self) -> List[int]:
+        load = [0] * self.num_workers
+        for worker_id in self._assignment.values():
+            load[worker_id] += 1
+        return load
+
+    def _least_loaded(self) -> int:
+        load = self._load()
+        return load.index(min(load))
+
+    def _assign(self, pid: int, worker_id: int, record: Optional[list] = None) -> None:
+        if record is None:
+            client = self.clients.get(pid)
+            record = state_snapshot.client_to_record(client) if client else None
+        self._assignment[pid] = worker_id
+        self._commands[worker_id].put((CMD_ASSIGN, [(pid, record)]))
+        if pid in self.paused:
+            self._commands[worker_id].put((CMD_PAUSE, [(pid, True)]))
+
+    # Komendy kanału sterowania wykonuje robotnik, który sprawdza danego klienta
+
+    def set_paused(self, pid: int, paused: bool) -> None:
+        super().set_paused(pid, paused)
+        worker_id = self._assignment.get(pid)
+        if worker_id is not None:
+            self._commands[worker_id].put((CMD_PAUSE, [(pid, paused)]))
+
+    def request_reprobe(self, pid: int) -> None:
+        worker_id = self._assignment.get(pid)
+        if worker_id is not None:
+            self._commands[worker_id].put((CMD_REPROBE, [pid]))
+
+    def _rebalance(self) -> None:
+        """
+        Przenosi klientów z najbardziej do najmniej obciążonego robotnika. Przenoszony jest
+        tylko klient już zgłoszony przez robotnika - nowy robotnik dostaje go dopiero razem
+        z pełnym stanem odesłanym przez poprzedniego (EVENT_MIGRATE)
+        """
+        load = self._load()
+        while max(load) - min(load) > 1:
+            source, target = load.index(max(load)), load.index(min(load))
+            pid = next((pid for pid, worker_id in self._assignment.items()
+                        if worker_id == source and pid in self.clients), None)
+            if pid is None:
+                return
+            self._assignment[pid] = target
+            self._commands[source].put((CMD_UNASSIGN, [(pid, target)]))
+            load[source] -= 1
+            load[target] += 1
+
+    def _apply_results(self) -> None:
+        """Odbiera wszystkie oczekujące zmiany stanu od robotników"""
+        while True:
+            try:
+                message = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._apply_message(*message)
+
+    def _apply_message(self, worker_id: int, events: list, changed: list) -> None:
+        """Aktualizuje klientów na podstawie wiadomości robotnika i wykonuje skutki zdarzeń"""
+        for event, reason, record, state in events:
+            client = state_snapshot.client_from_record(record, Metin2Client)
+            _apply_state(client, state)
+            pid = client.pid
+            if event == EVENT_MIGRATE:
+                if pid in self.clients:
+                    self.clients[pid] = client
+                # Klient mógł w międzyczasie zniknąć albo zostać przydzielony ponownie
+                if self._assignment.get(pid) == reason:
+                    self._assign(pid, reason, record)
+            elif event == "discovered":
+                self.clients[pid] = client
+                self.handle_client_discovered(client)
+            elif event in ("closed", "crashed"):
+                self.clients.pop(pid, None)
+                if self._assignment.get(pid) == worker_id:
+                    del self._assignment[pid]
+                if event == "crashed":
+                    self.handle_client_crashed(client, reason)
+                else:
+                    self.handle_client_closed(client, reason)
+            elif pid in self.clients:
+                self.clients[pid] = client
+                if event == "logout":
+                    self.handle_client_logout(client)
+                elif event == "reconnect":
+                    self.handle_client_reconnect(client)
+                elif event == "hung":
+                    self.handle_client_hung(client)
+                elif event == "responsive":
+                    self.handle_client_responsive(client)
+                elif event == "unstable":
+                    self.handle_client_unstable(client, reason)
+                elif event == "stable":
+                    self.handle_client_stable(client, reason)
+
+        # Stany są zbierane po zdarzeniach cyklu, więc są od nich nowsze
+        for state in changed:
+            client = self.clients.get(state[0])
+            if client is not None and self._assignment.get(client.pid) == worker_id:
+                _apply_state(client, state)
+
+    def update_clients(self) -> None:
+        """Wykrywa nowe procesy, rozdziela je między robotników i zbiera wyniki"""
+        self.start_workers()
+        self._apply_results()
+
+        current_pids = {proc.pid for proc in self.find_metin2_processes()}
+        for pid in list(self._assignment):
+            if pid not in current_pids:
+                # Robotnik sam wykryje zakończenie i zgłosi zamknięcie
+                del self._assignment[pid]
+        for pid in current_pids:
+            if pid not in self._assignment:
+                self._assign(pid, self._least_loaded())
+        # Przenoszony jest tylko klient znany koordynatorowi - najpierw odbierz świeże zgłoszenia
+        self._apply_results()
+        self._rebalance()
+
+    def is_idle(self) -> bool:
+        # Klient przydzielony robotnikowi może jeszcze nie być zgłoszony jako wykryty
+        return not self.clients and not self._assignment
+
+    def wait_interval(self) -> None:
+        """Czeka do następnego sprawdzenia, obsługując wiadomości robotników od razu po nadejściu"""
+        if not self._results:
+            super().wait_interval()
+            return
+        deadline = time.monotonic() + self.check_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                message = self._results.get(timeout=remaining)
+            except queue.Empty:
+                return
+            self._apply_message(*message)
+
+    def run(self, show_status: bool = True) -> None:
+        print(f"Tryb wieloprocesowy: {self.num_workers} procesów roboczych")
+        try:
+            super().run(show_status)
+        finally:
+            self.stop_workers()
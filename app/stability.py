@@ -0,0 +1,87 @@
+"""
+Stabilizacja stanu zalogowania klientów M2Watcher
+Surowy wynik detektorów przechodzi przez maszynę stanów klienta: zmiana stanu
+wymaga kilku zgodnych obserwacji z rzędu (histereza) i minimalnego czasu w
+poprzednim stanie, a klient, którego stan zmienia się zbyt często, jest oznaczany
+jako niestabilny - zamiast powiadomienia przy każdej zmianie wysyłane jest jedno
+podsumowanie na początku i jedno po uspokojeniu się połączenia
+"""
+import collections
+from typing import Deque, List, Optional
+
+# Zdarzenia zwracane przez LoginStateMachine.observe()
+LOGOUT = "logout"
+RECONNECT = "reconnect"
+UNSTABLE = "unstable"
+STABLE = "stable"
+
+
+class FlapPolicy:
+    """Ustawienia histerezy i wykrywania niestabilnych klientów (wspólne dla wszystkich klientów)"""
+
+    __slots__ = ("hysteresis", "min_dwell", "window", "threshold")
+
+    def __init__(self, hysteresis: int = 1, min_dwell: float = 0.0, window: float = 300.0, threshold: int = 4):
+        """
+        Args:
+            hysteresis: Ile kolejnych zgodnych obserwacji potrzeba do zmiany stanu
+            min_dwell: Minimalny czas (s) w stanie, zanim zmiana zostanie przyjęta
+            window: Okno (s), w którym liczone są zmiany stanu; klient jest stabilny,
+                    gdy przez tyle sekund stan się nie zmienił
+            threshold: Liczba zmian stanu w oknie, od której klient jest niestabilny (0 = wyłączone)
+        """
+        self.hysteresis = max(1, hysteresis)
+        self.min_dwell = max(0.0, min_dwell)
+        self.window = window
+        self.threshold = threshold
+
+
+class LoginStateMachine:
+    """Stan zalogowania jednego klienta"""
+
+    __slots__ = ("state", "since", "pending", "transitions", "unstable", "suppressed")
+
+    def __init__(self, state: bool, now: float):
+        self.state = state  # Przyjęty stan (True = zalogowany)
+        self.since = now  # Czas (monotoniczny) przyjęcia stanu
+        self.pending = 0  # Kolejne obserwacje przeciwne do przyjętego stanu
+        self.transitions: Deque[float] = collections.deque()  # Czasy zmian stanu w oknie
+        self.unstable = False
+        self.suppressed = 0  # Zmiany stanu bez powiadomienia od oznaczenia jako niestabilny
+
+    def observe(self, logged_in: bool, now: float, policy: FlapPolicy) -> List[str]:
+        """
+        Przetwarza obserwację detektorów i zwraca zdarzenia do zgłoszenia
+        (LOGOUT, RECONNECT, UNSTABLE, STABLE - zwykle żadne).
+        """
+        result = []
+        transition: Optional[str] = None
+        if logged_in == self.state:
+            self.pending = 0
+        else:
+            self.pending += 1
+            if self.pending >= policy.hysteresis and now - self.since >= policy.min_dwell:
+                self.state, self.since, self.pending = logged_in, now, 0
+                self.transitions.append(now)
+                transition = RECONNECT if logged_in else LOGOUT
+
+        while self.transitions and now - self.transitions[0] > policy.window:
+            self.transitions.popleft()
+
+        if self.unstable:
+            if transition:
+                self.suppressed += 1
+            elif not self.transitions:
+                self.unstable = False
+                result.append(STABLE)
+                if not self.state:
+                    # Klient uspokoił się na ekranie logowania - to zwykłe wylogowanie do obsłużenia
+                    result.append(LOGOUT)
+        elif transition and policy.threshold and len(self.transitions) >= policy.threshold:
+            # Zmiana, która przekroczyła próg, jest już częścią podsumowania
+            self.unstable = True
+            self.suppressed = 1
+            result.append(UNSTABLE)
+        elif transition:
+            result.append(transition)
+        return result
@@ -0,0 +1,184 @@
+"""
+Zapis i odtwarzanie stanu monitorowanych klientów (ciepły restart)
+Pozwala zachować klientów i ich bazowe wartości sieciowe po restarcie watchera
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import stability
+from config import CONFIG_DIR
+
+STATE_FILE = CONFIG_DIR / "state.json"
+SNAPSHOT_VERSION = 1
+
+# Klucz klienta w snapshocie - PID może zostać ponownie użyty przez system,
+# więc dopiero para (pid, create_time) jednoznacznie identyfikuje proces
+ClientKey = Tuple[int, float]
+
+
+# Klient trzyma czasy jako time.monotonic(), który nie ma znaczenia poza bieżącym
+# procesem - w snapshocie są zapisywane jako czas zegarowy (timestamp)
+
+def _to_timestamp(value: Optional[float]) -> Optional[float]:
+    return time.time() - (time.monotonic() - value) if value is not None else None
+
+
+def _from_timestamp(value: Optional[float]) -> Optional[float]:
+    return time.monotonic() - (time.time() - value) if value is not None else None
+
+
+def _login_state_to_record(machine: Optional[stability.LoginStateMachine]) -> Optional[list]:
+    if machine is None:
+        return None
+    return [machine.state, _to_timestamp(machine.since), machine.pending,
+            [_to_timestamp(ts) for ts in machine.transitions], machine.unstable, machine.suppressed]
+
+
+def _login_state_from_record(record: Optional[list]) -> Optional[stability.LoginStateMachine]:
+    if record is None:
+        return None
+    state, since, pending, transitions, unstable, suppressed = record
+    machine = stability.LoginStateMachine(bool(state), _from_timestamp(since))
+    machine.pending = pending
+    machine.transitions.extend(_from_timestamp(ts) for ts in transitions)
+    machine.unstable = bool(unstable)
+    machine.suppressed = suppressed
+    return machine
+
+
+def client_to_record(client) -> list:
+    """
+    Zamienia klienta na zwartą listę pól (kolejność jak w client_from_record).
+    Oprócz stanu widocznego dla użytkownika zawiera stan detektorów (czas CPU, wyniki
+    detektorów, adresy połączeń, histereza), więc klient przeniesiony do innego procesu
+    roboczego albo odtworzony po restarcie nie zaczyna wykrywania od zera
+    """
+    return [
+        client.pid,
+        client.create_time,
+        client.name,
+        client.window_title,
+        _to_timestamp(client.start_time),
+        client.is_logged_in,
+        client.last_network_bytes,
+        list(client.network_activity_history),
+        client.num_connections,
+        _to_timestamp(client.no_connections_since),
+        client.is_hung,
+        client.last_cpu_time,
+        list(client.probe_signature) if client.probe_signature is not None else None,
+        dict(client.detector_results),
+        [list(endpoint) for endpoint in client.remote_endpoints],
+        [list(endpoint) for endpoint in client.lost_endpoints],
+        client.endpoint_event,
+        _to_timestamp(client.stalled_since),
+        _login_state_to_record(client.login_state),
+    ]
+
+
+def client_from_record(record: list, client_cls):
+    """Odtwarza klienta z listy pól zapisanej przez client_to_record"""
+    (pid, create_time, name, window_title, start_ts, is_logged_in,
+     last_network_bytes, history, num_connections, no_conn_ts) = record[:10]
+    # Pola dodane później - starsze snapshoty ich nie mają
+    is_hung = bool(record[10]) if len(record) > 10 else False
+    detector_state = {}
+    if len(record) > 18:
+        (last_cpu_time, signature, results, endpoints, lost,
+         endpoint_event, stalled_ts) = record[11:18]
+        detector_state = {
+            "last_cpu_time": last_cpu_time,
+            "probe_signature": tuple(signature) if signature is not None else None,
+            "detector_results": dict(results),
+            "remote_endpoints": frozenset(tuple(endpoint) for endpoint in endpoints),
+            "lost_endpoints": frozenset(tuple(endpoint) for endpoint in lost),
+            "endpoint_event": endpoint_event,
+            "stalled_since": _from_timestamp(stalled_ts),
+        }
+    client = client_cls(
+        **detector_state,
+        pid=pid,
+        name=name,
+        window_title=window_title,
+        start_time=_from_timestamp(start_ts),
+        is_logged_in=is_logged_in,
+        network_activity_history=list(history),
+        last_network_bytes=last_network_bytes,
+        num_connections=num_connections,
+        no_connections_since=_from_timestamp(no_conn_ts),
+        create_time=create_time,
+        is_hung=is_hung,
+    )
+    if len(record) > 18:
+        client.login_state = _login_state_from_record(record[18])
+    return client
+
+
+def save_snapshot(clients: List, path: Path = STATE_FILE) -> bool:
+    """
+    Zapisuje snapshot klientów do pliku.
+    Zapis jest atomowy (plik tymczasowy + os.replace), więc przerwany zapis
+    nigdy nie zostawi uszkodzonego snapshotu.
+
+    Args:
+        clients: Lista klientów do zapisania
+        path: Ścieżka pliku snapshotu
+
+    Returns:
+        bool: Czy zapisano pomyślnie
+    """
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "clients": [client_to_record(client) for client in clients],
+    }
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    try:
+        path.parent.mkdir(exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"Błąd podczas zapisywania stanu klientów: {e}")
+        return False
+
+
+def load_snapshot(client_cls, path: Path = STATE_FILE, max_age: float = 600.0) -> Dict[ClientKey, object]:
+    """
+    Wczytuje snapshot klientów.
+
+    Args:
+        client_cls: Klasa klienta (Metin2Client)
+        path: Ścieżka pliku snapshotu
+        max_age: Maksymalny wiek snapshotu w sekundach (starszy jest ignorowany)
+
+    Returns:
+        Słownik {(pid, create_time): klient}, pusty jeśli brak poprawnego snapshotu
+    """
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"Błąd podczas wczytywania stanu klientów: {e}")
+        return {}
+
+    if data.get("version") != SNAPSHOT_VERSION:
+        return {}
+    if time.time() - data.get("saved_at", 0) > max_age:
+        return {}
+
+    clients = {}
+    for record in data.get("clients", []):
+        try:
+            client = client_from_record(record, client_cls)
+        except (TypeError, ValueError):
+            continue
+        clients[(client.pid, client.create_time)] = client
+    return clients